@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Compare the download throughput of the thread pool and asyncio engines.
+
+A local HTTP server stands in for the GAPE API and the image host. It lists
+``--images`` images of ``--size`` bytes and waits ``--latency`` seconds before each
+response to mimic a distant server. Each engine downloads the listing into a new
+temporary directory and the images per second and MiB per second are printed.
+
+    python -m benchmarks.engines --images 500 --concurrency 32 --latency 0.05
+"""
+
+import argparse
+import tempfile
+import time
+from benchmarks.servers import make_gape_handler, serve
+from winearth_copy import async_engine
+from winearth_copy.read_configuration import ASYNCIO, THREADS
+from winearth_copy.winearth_download import WinEarthDownload
+
+
+def benchmark(engine, url, concurrency):
+    if engine == ASYNCIO:
+        downloader = async_engine.AsyncWinEarthDownload(None, "", concurrency)
+    else:
+        downloader = WinEarthDownload(None, "", concurrency)
+    downloader.api_url = url + "/api"
+    downloader.base_download_url = url + "/images/"
+
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        if engine == ASYNCIO:
+            summary = async_engine.run(downloader.process_images(path))
+        else:
+            summary = downloader.process_images(path)
+        elapsed = time.perf_counter() - start
+
+    downloader.close()
+
+    return summary["downloaded"], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    engines = [THREADS]
+    if async_engine.available():
+        engines.append(ASYNCIO)
+    else:
+        print("aiohttp and aiobotocore are not installed, skipping asyncio")
+
+    print(
+        f"{args.images} images of {args.size} bytes, {args.latency}s latency, "
+        f"concurrency {args.concurrency}"
+    )
+    with serve(make_gape_handler(args.images, args.size, args.latency)) as url:
+        for engine in engines:
+            downloaded, elapsed = benchmark(engine, url, args.concurrency)
+            print(
+                f"{engine:>8}: {downloaded / elapsed:8.1f} images/s "
+                f"{downloaded * args.size / elapsed / 1024 / 1024:8.1f} MiB/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
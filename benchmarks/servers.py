@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+"""
+Local stand-ins for the GAPE API, the DatabaseImages host and S3 used by the
+benchmarks.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.etree import ElementTree
+
+S3_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+# Bytes written at a time when a response is throttled
+WRITE_SIZE = 64 * 1024
+
+
+def image_records(images, directory="ISS/BENCH"):
+    """
+    Build GAPE records for a number of images.
+
+    Args:
+        images (int): The number of images.
+        directory (str, optional): The images.directory of every image.
+
+    Returns:
+        list: The records.
+    """
+    return [
+        {
+            "images.directory": directory,
+            "images.filename": "ISS000-E-%d.JPG" % frame,
+            "nadir.mission": "ISS000",
+            "nadir.roll": "E",
+            "nadir.frame": frame,
+        }
+        for frame in range(images)
+    ]
+
+
+def make_gape_handler(images, size, latency=0, bandwidth=0, error_rate=0, seed=None):
+    """
+    Create a request handler that serves the GAPE API listing under /api and an image
+    of ``size`` bytes for every other path.
+
+    Args:
+        images (int): The number of images listed.
+        size (int): The size of each image in bytes.
+        latency (float, optional): The seconds to wait before each response.
+        bandwidth (int, optional): The bytes per second each response is sent at, or 0
+            for no limit.
+        error_rate (float, optional): The fraction of image requests answered with 503.
+        seed (int, optional): The seed of the random errors.
+
+    Returns:
+        type: The BaseHTTPRequestHandler subclass.
+    """
+    listing = json.dumps(image_records(images)).encode()
+    image = b"\xff\xd8\xff" + b"\x00" * max(0, size - 5) + b"\xff\xd9"
+    errors = random.Random(seed)
+    errors_lock = threading.Lock()
+
+    class GapeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+
+            if not self.path.startswith("/api"):
+                with errors_lock:
+                    error = errors.random() < error_rate
+                if error:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+            body = listing if self.path.startswith("/api") else image
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            write_throttled(self.wfile, body, bandwidth)
+
+        def log_message(self, format, *args):
+            pass
+
+    return GapeHandler
+
+
+def write_throttled(wfile, body, bandwidth):
+    """
+    Write a response body, no faster than ``bandwidth`` bytes per second if it is set.
+
+    Args:
+        wfile (file): The response stream.
+        body (bytes): The body.
+        bandwidth (int): The bytes per second, or 0 for no limit.
+
+    Returns:
+        None
+    """
+    if not bandwidth:
+        wfile.write(body)
+        return None
+
+    for start in range(0, len(body), WRITE_SIZE):
+        piece = body[start : start + WRITE_SIZE]
+        wfile.write(piece)
+        time.sleep(len(piece) / bandwidth)
+
+    return None
+
+
+def make_s3_handler(latency=0):
+    """
+    Create a request handler that implements the S3 calls S3Upload makes: PutObject,
+    HeadObject, ListObjectsV2 and multipart uploads, with path-style addressing.
+
+    Bodies are hashed and dropped, so only the size and ETag of each object is kept.
+    Requests are not authenticated.
+
+    Args:
+        latency (float, optional): The seconds to wait before each response.
+
+    Returns:
+        type: The BaseHTTPRequestHandler subclass.
+    """
+    objects = {}
+    uploads = {}
+    lock = threading.Lock()
+
+    class S3Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def parse(self):
+            url = urlsplit(self.path)
+            bucket, _, key = url.path.lstrip("/").partition("/")
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            if "uploads" in url.query.split("&"):
+                query["uploads"] = ""
+            return bucket, unquote(key), query
+
+        def read_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length)
+
+        def send(self, status, body=b"", headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def send_xml(self, root):
+            self.send(
+                200,
+                ElementTree.tostring(root, encoding="utf-8"),
+                {"Content-Type": "application/xml"},
+            )
+
+        def do_PUT(self):
+            time.sleep(latency)
+            bucket, key, query = self.parse()
+            body = self.read_body()
+            etag = hashlib.md5(body).hexdigest()
+
+            with lock:
+                if "uploadId" in query:
+                    uploads[query["uploadId"]][int(query["partNumber"])] = (
+                        len(body),
+                        hashlib.md5(body).digest(),
+                    )
+                else:
+                    objects[key] = (len(body), etag)
+
+            self.send(200, headers={"ETag": '"%s"' % etag})
+
+        def do_POST(self):
+            time.sleep(latency)
+            bucket, key, query = self.parse()
+            self.read_body()
+
+            if "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                with lock:
+                    uploads[upload_id] = {}
+                root = ElementTree.Element(
+                    "InitiateMultipartUploadResult", xmlns=S3_NAMESPACE
+                )
+                ElementTree.SubElement(root, "Bucket").text = bucket
+                ElementTree.SubElement(root, "Key").text = key
+                ElementTree.SubElement(root, "UploadId").text = upload_id
+                return self.send_xml(root)
+
+            with lock:
+                parts = uploads.pop(query["uploadId"])
+            digests = b"".join(parts[number][1] for number in sorted(parts))
+            etag = "%s-%d" % (hashlib.md5(digests).hexdigest(), len(parts))
+            with lock:
+                objects[key] = (sum(size for size, digest in parts.values()), etag)
+
+            root = ElementTree.Element(
+                "CompleteMultipartUploadResult", xmlns=S3_NAMESPACE
+            )
+            ElementTree.SubElement(root, "Bucket").text = bucket
+            ElementTree.SubElement(root, "Key").text = key
+            ElementTree.SubElement(root, "ETag").text = '"%s"' % etag
+            self.send_xml(root)
+
+        def do_DELETE(self):
+            time.sleep(latency)
+            bucket, key, query = self.parse()
+            with lock:
+                uploads.pop(query.get("uploadId"), None)
+            self.send(204)
+
+        def do_HEAD(self):
+            time.sleep(latency)
+            bucket, key, query = self.parse()
+            with lock:
+                found = objects.get(key)
+            if found is None:
+                return self.send(404)
+            self.send(200, headers={"ETag": '"%s"' % found[1]})
+
+        def do_GET(self):
+            time.sleep(latency)
+            bucket, key, query = self.parse()
+            prefix = query.get("prefix", "")
+
+            root = ElementTree.Element("ListBucketResult", xmlns=S3_NAMESPACE)
+            ElementTree.SubElement(root, "Name").text = bucket
+            ElementTree.SubElement(root, "Prefix").text = prefix
+            ElementTree.SubElement(root, "IsTruncated").text = "false"
+            with lock:
+                listed = sorted(
+                    (name, found)
+                    for name, found in objects.items()
+                    if name.startswith(prefix)
+                )
+            ElementTree.SubElement(root, "KeyCount").text = str(len(listed))
+            for name, (size, etag) in listed:
+                contents = ElementTree.SubElement(root, "Contents")
+                ElementTree.SubElement(contents, "Key").text = name
+                ElementTree.SubElement(contents, "Size").text = str(size)
+                ElementTree.SubElement(contents, "ETag").text = '"%s"' % etag
+            self.send_xml(root)
+
+        def log_message(self, format, *args):
+            pass
+
+    return S3Handler
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+    """
+    A ThreadingHTTPServer with a listen backlog large enough for every client
+    connection to be accepted at once. With the default of 5, connections beyond it
+    wait for a SYN retransmission, which adds a second to some transfers.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+@contextmanager
+def serve(handler):
+    """
+    Run a handler on a local ThreadingHTTPServer while the context is open.
+
+    Args:
+        handler (type): The BaseHTTPRequestHandler subclass.
+
+    Yields:
+        str: The base URL of the server.
+    """
+    server = BenchmarkServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield "http://127.0.0.1:%d" % server.server_port
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Measure how long the command line entry points take to import.
+
+Each case imports the modules one command needs in a new interpreter, as running
+the command would, and reports the best of ``--repeat`` runs together with the
+heavy dependencies (requests, boto3, aiohttp, Pillow) it loaded. ``--max-seconds``
+makes the benchmark exit with an error when a case is slower, so it can guard against
+import time regressions:
+
+    python -m benchmarks.startup --repeat 5 --max-seconds 0.3 --cases cli
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from benchmarks.transfers import git_commit
+
+# The modules each command imports, in order
+CASES = {
+    "cli": ("winearth_copy",),
+    "download": ("winearth_copy", "winearth_copy.winearth_download"),
+    "upload": ("winearth_copy", "winearth_copy.s3_upload"),
+    "sync": ("winearth_copy", "winearth_copy.sync"),
+    "asyncio": ("winearth_copy", "winearth_copy.async_engine"),
+}
+
+# Dependencies that take most of the import time
+HEAVY_MODULES = (
+    "requests",
+    "urllib3",
+    "boto3",
+    "botocore.client",
+    "aiohttp",
+    "aiobotocore",
+    "PIL",
+)
+
+MEASURE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": list(sys.modules)}))
+"""
+
+
+def measure(modules):
+    """
+    Import modules in a new interpreter.
+
+    Args:
+        modules (tuple): The names of the modules to import, in order.
+
+    Returns:
+        dict: The seconds the imports took, the seconds the whole interpreter took,
+        and the names of every module loaded.
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-c", MEASURE, *modules],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    measurement = json.loads(process.stdout)
+    measurement["process_seconds"] = time.perf_counter() - start
+
+    return measurement
+
+
+def benchmark_case(case, repeat):
+    """
+    Measure one case, keeping the fastest run.
+
+    Args:
+        case (str): The name of the case in CASES.
+        repeat (int): The number of runs.
+
+    Returns:
+        dict: The result.
+    """
+    measurements = [measure(CASES[case]) for _ in range(repeat)]
+    best = min(measurements, key=lambda measurement: measurement["seconds"])
+
+    return {
+        "case": case,
+        "repeat": repeat,
+        "import_seconds": round(best["seconds"], 6),
+        "process_seconds": round(
+            min(measurement["process_seconds"] for measurement in measurements), 6
+        ),
+        "modules": len(best["modules"]),
+        "heavy_modules": [
+            module for module in HEAVY_MODULES if module in best["modules"]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    cases = args.cases.split(",")
+    for case in cases:
+        if case not in CASES:
+            parser.error("unknown case: %s" % case)
+
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+    }
+
+    slow = []
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for case in cases:
+            result = {**run, **benchmark_case(case, args.repeat)}
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            if (
+                args.max_seconds is not None
+                and result["import_seconds"] > args.max_seconds
+            ):
+                slow.append(case)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if slow:
+        sys.exit(
+            "Slower than %s seconds to import: %s" % (args.max_seconds, ", ".join(slow))
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""
+Measure download, metadata and upload throughput against local stand-in servers.
+
+A local HTTP server imitates the GAPE API and the DatabaseImages host, with
+``--latency`` seconds before each response, ``--bandwidth`` bytes per second per
+response and ``--error-rate`` of image requests answered with 503. A second local
+server imitates S3. Every combination of ``--files`` and ``--sizes`` is run through
+WinEarthDownload.download_images, WinEarthDownload.save_metadata and
+S3Upload.upload_directory, each in a new process so its peak RSS can be measured.
+One JSON object per run is written to ``--output``, or printed:
+
+    python -m benchmarks.transfers --files 100,1000 --sizes 64K,1M --output results.jsonl
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.servers import image_records, make_gape_handler, make_s3_handler, serve
+from winearth_copy.s3_upload import S3Upload
+from winearth_copy.winearth_download import WinEarthDownload
+
+BENCHMARKS = ("download", "metadata", "upload")
+
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+
+
+def parse_size(size):
+    """
+    Parse a size such as 512, 64K or 16M into bytes.
+
+    Args:
+        size (str): The size.
+
+    Returns:
+        int: The size in bytes.
+    """
+    size = size.strip().upper()
+    if size and size[-1] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1]])
+
+    return int(size)
+
+
+def peak_rss():
+    """
+    Get the peak resident set size of this process.
+
+    Returns:
+        int: The peak RSS in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def git_commit():
+    """
+    Get the commit the benchmarks are run on.
+
+    Returns:
+        str: The commit hash, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_files(path, files, size):
+    """
+    Write ``files`` images of ``size`` bytes to upload.
+
+    Args:
+        path (str): The directory.
+        files (int): The number of files.
+        size (int): The size of each file in bytes.
+
+    Returns:
+        None
+    """
+    directory = os.path.join(path, "ISS", "BENCH")
+    os.makedirs(directory)
+    data = os.urandom(size)
+    for record in image_records(files):
+        with open(os.path.join(directory, record["images.filename"]), "wb") as f:
+            f.write(data)
+
+    return None
+
+
+def run_download(args, urls, files, size):
+    downloader = WinEarthDownload(None, "", args.concurrency, args.retries)
+    downloader.base_download_url = urls["gape"] + "/images/"
+
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        downloaded = downloader.download_images(image_records(files), path)
+        elapsed = time.perf_counter() - start
+
+    requests = downloader.connection_stats()["requests"]
+    downloader.close()
+
+    return {
+        "seconds": elapsed,
+        "completed": downloaded,
+        "bytes": downloaded * size,
+        "requests_per_file": requests / max(1, files),
+    }
+
+
+def run_metadata(args, urls, files, size):
+    downloader = WinEarthDownload(None, "")
+
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        saved = downloader.save_metadata(image_records(files), path)
+        elapsed = time.perf_counter() - start
+
+    downloader.close()
+
+    return {
+        "seconds": elapsed,
+        "completed": saved,
+        "bytes": None,
+        "requests_per_file": 0.0,
+    }
+
+
+def run_upload(args, urls, files, size):
+    s3 = S3Upload(
+        "benchmark",
+        "benchmark",
+        urls["s3"],
+        "path",
+        args.concurrency,
+        args.multipart_threshold,
+        args.multipart_chunksize,
+    )
+
+    with tempfile.TemporaryDirectory() as path:
+        write_files(path, files, size)
+        start = time.perf_counter()
+        summary = s3.upload_directory("benchmark", path)
+        elapsed = time.perf_counter() - start
+
+    return {
+        "seconds": elapsed,
+        "completed": summary["uploaded"],
+        "bytes": summary["uploaded"] * size,
+        "requests_per_file": summary["requests_per_file"],
+    }
+
+
+RUNNERS = {
+    "download": run_download,
+    "metadata": run_metadata,
+    "upload": run_upload,
+}
+
+
+def run_case(benchmark, args, urls, files, size, results):
+    """
+    Run one benchmark and put its measurements on a queue. Called in a new process,
+    with the progress printed for each file discarded.
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        measurements = RUNNERS[benchmark](args, urls, files, size)
+    measurements["peak_rss"] = peak_rss()
+    results.put(measurements)
+
+
+def benchmark_case(benchmark, args, files, size):
+    """
+    Run one benchmark in a new process against new stand-in servers.
+
+    Args:
+        benchmark (str): "download", "metadata" or "upload".
+        args (argparse.Namespace): The command line arguments.
+        files (int): The number of files.
+        size (int): The size of each file in bytes.
+
+    Returns:
+        dict: The result.
+    """
+    gape_handler = make_gape_handler(
+        files, size, args.latency, args.bandwidth, args.error_rate, args.seed
+    )
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    with serve(gape_handler) as gape_url, serve(
+        make_s3_handler(args.latency)
+    ) as s3_url:
+        process = context.Process(
+            target=run_case,
+            args=(
+                benchmark,
+                args,
+                {"gape": gape_url, "s3": s3_url},
+                files,
+                size,
+                results,
+            ),
+        )
+        process.start()
+        process.join()
+
+    if process.exitcode != 0:
+        raise RuntimeError(
+            "The %s benchmark exited with %d" % (benchmark, process.exitcode)
+        )
+    measurements = results.get()
+
+    seconds = measurements["seconds"]
+    return {
+        "benchmark": benchmark,
+        "files": files,
+        "size": size,
+        "concurrency": args.concurrency,
+        "latency": args.latency,
+        "bandwidth": args.bandwidth,
+        "error_rate": args.error_rate,
+        "completed": measurements["completed"],
+        "seconds": round(seconds, 6),
+        "files_per_second": round(measurements["completed"] / seconds, 3),
+        "mb_per_second": (
+            None
+            if measurements["bytes"] is None
+            else round(measurements["bytes"] / seconds / 1000000, 3)
+        ),
+        "peak_rss": measurements["peak_rss"],
+        "requests_per_file": round(measurements["requests_per_file"], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS))
+    parser.add_argument("--files", default="10,100")
+    parser.add_argument("--sizes", default="64K,1M")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--multipart-threshold", type=parse_size, default="64M")
+    parser.add_argument("--multipart-chunksize", type=parse_size, default="16M")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    benchmarks = args.benchmarks.split(",")
+    for benchmark in benchmarks:
+        if benchmark not in RUNNERS:
+            parser.error("unknown benchmark: %s" % benchmark)
+
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+    }
+
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for benchmark in benchmarks:
+            for files in [int(files) for files in args.files.split(",")]:
+                for size in [parse_size(size) for size in args.sizes.split(",")]:
+                    result = {**run, **benchmark_case(benchmark, args, files, size)}
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+                    # Only one metadata run per file count, it does not use the size
+                    if benchmark == "metadata":
+                        break
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,10 +14,21 @@ setup(
         "boto3",
         "requests",
     ],
+    extras_require={
+        "async": [
+            "aiobotocore",
+            "aiohttp",
+        ],
+        "validate": [
+            "Pillow",
+        ],
+    },
     entry_points={  # Optional
         "console_scripts": [
             "winearth-download=winearth_copy:download",
             "winearth-upload=winearth_copy:upload",
+            "winearth-sync=winearth_copy:sync",
+            "winearth-daemon=winearth_copy:daemon",
         ],
     },
     classifiers=[
@@ -9,7 +9,61 @@ class TestParseArguments(unittest.TestCase):
         )
         self.assertEqual(args.configuration_file, "config_file.txt")
         self.assertEqual(args.query_date, "20240101")
+        self.assertIsNone(args.download_concurrency)
+
+    def test_parse_arguments_download_concurrency(self):
+        args = winearth_copy.arguments.parse_arguments(
+            ["--config", "config_file.txt", "--download-concurrency", "8"]
+        )
+        self.assertEqual(args.download_concurrency, 8)
+
+    def test_parse_arguments_profile(self):
+        args = winearth_copy.arguments.parse_arguments(
+            ["--config", "config_file.txt", "--profile", "/tmp/profile"]
+        )
+        self.assertEqual(args.profile, "/tmp/profile")
+
+        args = winearth_copy.arguments.parse_arguments(["--config", "config_file.txt"])
+        self.assertIsNone(args.profile)
+
+    def test_parse_arguments_watch(self):
+        args = winearth_copy.arguments.parse_arguments(
+            ["--config", "config_file.txt", "--watch"]
+        )
+        self.assertTrue(args.watch)
+
+        args = winearth_copy.arguments.parse_arguments(["--config", "config_file.txt"])
+        self.assertFalse(args.watch)
+
+    def test_parse_arguments_rescan(self):
+        args = winearth_copy.arguments.parse_arguments(
+            ["--config", "config_file.txt", "--rescan"]
+        )
+        self.assertTrue(args.rescan)
+
+        args = winearth_copy.arguments.parse_arguments(["--config", "config_file.txt"])
+        self.assertFalse(args.rescan)
 
     def test_parse_arguments_missing_config(self):
         with self.assertRaises(SystemExit):
             winearth_copy.arguments.parse_arguments(["--query-date", "20240101"])
+
+    def test_parse_arguments_backfill(self):
+        args = winearth_copy.arguments.parse_arguments(
+            [
+                "--config",
+                "config_file.txt",
+                "--start-date",
+                "20240101",
+                "--end-date",
+                "20240131",
+            ]
+        )
+        self.assertEqual(args.start_date, "20240101")
+        self.assertEqual(args.end_date, "20240131")
+
+    def test_parse_arguments_end_date_without_start_date(self):
+        with self.assertRaises(SystemExit):
+            winearth_copy.arguments.parse_arguments(
+                ["--config", "config_file.txt", "--end-date", "20240131"]
+            )
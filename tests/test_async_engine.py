@@ -0,0 +1,334 @@
+import asyncio
+import botocore.exceptions
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from winearth_copy import async_engine
+from winearth_copy.async_engine import (
+    AsyncS3Upload,
+    AsyncWinEarthDownload,
+    HostLimiter,
+)
+from winearth_copy.state import DELETED, IMAGE, TransferState
+
+LISTING = [
+    {"images.directory": "ISS/16/AS16", "images.filename": "AS16-12345.JPG"},
+    {"images.directory": "ISS/16/AS16", "images.filename": "AS16-12346.JPG"},
+]
+
+
+class GapeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    failures = {}
+    slow = set()
+
+    def do_GET(self):
+        # Fail the first request for a path if it is listed in failures
+        if self.failures.pop(self.path, None):
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.path.startswith("/api"):
+            body = json.dumps(LISTING).encode()
+        else:
+            body = b"image " + self.path.encode()
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if self.path in self.slow:
+            # Send part of the body and stall so the transfer can be cancelled
+            self.wfile.write(body[:4])
+            self.wfile.flush()
+            time.sleep(2)
+
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeS3Client:
+    """
+    Stores objects in memory in place of an aiobotocore client.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.meta = mock.Mock()
+
+    async def put_object(self, Bucket, Key, Body, ContentMD5):
+        self.objects[Key] = Body
+        return {"ETag": '"%s"' % hashlib.md5(Body).hexdigest()}
+
+    async def create_multipart_upload(self, Bucket, Key):
+        self.parts = {}
+        return {"UploadId": "upload-id"}
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        self.parts[PartNumber] = Body
+        return {"ETag": '"%s"' % hashlib.md5(Body).hexdigest()}
+
+    async def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = [self.parts[part["PartNumber"]] for part in MultipartUpload["Parts"]]
+        self.objects[Key] = b"".join(parts)
+        return {
+            "ETag": '"%s-%d"'
+            % (
+                hashlib.md5(
+                    b"".join(hashlib.md5(part).digest() for part in parts)
+                ).hexdigest(),
+                len(parts),
+            )
+        }
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.parts = {}
+        return {}
+
+    def get_paginator(self, operation):
+        objects = self.objects
+
+        class Paginator:
+            async def paginate(self, Bucket, Prefix):
+                yield {
+                    "Contents": [
+                        {
+                            "Key": key,
+                            "Size": len(body),
+                            "ETag": '"%s"' % hashlib.md5(body).hexdigest(),
+                        }
+                        for key, body in objects.items()
+                        if key.startswith(Prefix)
+                    ]
+                }
+
+        return Paginator()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+
+@unittest.skipUnless(async_engine.available(), "aiohttp and aiobotocore are required")
+class TestAsyncWinEarthDownload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), GapeHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        url = "http://127.0.0.1:%d" % self.server.server_port
+        self.win_earth = AsyncWinEarthDownload("20240508", "fake_api_key", 2, 1)
+        self.win_earth.api_url = url + "/api"
+        self.win_earth.base_download_url = url + "/images/"
+
+    def test_process_images(self):
+        GapeHandler.failures["/images/ISS/16/AS16/AS16-12345.JPG"] = True
+
+        with mock.patch.object(async_engine, "backoff", mock.AsyncMock()):
+            summary = asyncio.run(self.win_earth.process_images(self.temp_dir.name))
+
+        self.assertEqual(
+            summary,
+            {
+                "images": 2,
+                "metadata": 2,
+                "downloaded": 2,
+                "timeouts": 0,
+                "hedges": 0,
+                "result": None,
+            },
+        )
+        directory = os.path.join(self.temp_dir.name, "ISS/16/AS16")
+        self.assertEqual(
+            sorted(os.listdir(directory)),
+            [
+                "AS16-12345.JPG",
+                "AS16-12345.json",
+                "AS16-12346.JPG",
+                "AS16-12346.json",
+            ],
+        )
+        with open(os.path.join(directory, "AS16-12345.JPG"), "rb") as f:
+            self.assertEqual(f.read(), b"image /images/ISS/16/AS16/AS16-12345.JPG")
+
+        # The failed request was retried and connections were reused
+        stats = self.win_earth.connection_stats()
+        self.assertEqual(stats["requests"], 4)
+        self.assertGreater(stats["reused"], 0)
+
+    def test_process_images_state(self):
+        state = TransferState(os.path.join(self.temp_dir.name, "state.sqlite3"))
+        self.addCleanup(state.close)
+        self.win_earth.state = state
+
+        asyncio.run(self.win_earth.process_images(self.temp_dir.name))
+
+        row = state.get(("AS16", "", "12346"), IMAGE)
+        self.assertEqual(
+            row["md5"],
+            hashlib.md5(b"image /images/ISS/16/AS16/AS16-12346.JPG").hexdigest(),
+        )
+
+        # A second run skips the images the database knows about
+        summary = asyncio.run(self.win_earth.process_images(self.temp_dir.name))
+
+        self.assertEqual(summary["downloaded"], 0)
+        self.assertEqual(self.win_earth.counts["skipped"], 2)
+
+    def test_fetch_image_cancelled(self):
+        GapeHandler.slow.add("/images/ISS/16/AS16/AS16-12345.JPG")
+        self.addCleanup(GapeHandler.slow.clear)
+        directory = os.path.join(self.temp_dir.name, "ISS/16/AS16")
+        os.makedirs(directory)
+
+        async def cancel():
+            async with async_engine.aiohttp.ClientSession() as self.win_earth.session:
+                task = asyncio.create_task(
+                    self.win_earth.fetch_image(LISTING[0], self.temp_dir.name)
+                )
+                while not os.listdir(directory):
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+        asyncio.run(cancel())
+
+        # The temporary file is removed
+        self.assertEqual(os.listdir(directory), [])
+
+    def test_host_limiter(self):
+        limiter = HostLimiter(3)
+
+        self.assertIs(limiter("https://a.example/x"), limiter("https://a.example/y"))
+        self.assertIsNot(limiter("https://a.example/x"), limiter("https://b.example/x"))
+
+
+@unittest.skipUnless(async_engine.available(), "aiohttp and aiobotocore are required")
+class TestAsyncS3Upload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+        self.s3_upload = AsyncS3Upload(
+            "fake_access_key", "fake_secret_key", "http://localhost:4566", "path", 2
+        )
+        self.client = FakeS3Client()
+        self.s3_upload.create_client = lambda: self.client
+
+    def write_file(self, name, data):
+        file_path = os.path.join(self.temp_dir.name, name)
+        with open(file_path, "wb") as f:
+            f.write(data)
+
+        return file_path
+
+    def test_upload_directory(self):
+        first = self.write_file("first.JPG", b"first")
+        second = self.write_file("second.JPG", b"second")
+
+        # An object already in the bucket is not uploaded again
+        self.client.objects[second] = b"second"
+
+        summary = asyncio.run(
+            self.s3_upload.upload_directory("test-bucket", self.temp_dir.name)
+        )
+
+        self.assertEqual(summary["uploaded"], 1)
+        self.assertEqual(summary["skipped"], 1)
+        self.assertEqual(summary["failed"], 0)
+        self.assertEqual(self.client.objects[first], b"first")
+        self.assertFalse(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+    def test_upload_directory_multipart(self):
+        self.s3_upload.multipart_threshold = 10
+        self.s3_upload.multipart_chunksize = 8
+        file_path = self.write_file("large.JPG", b"0123456789abcdefghij")
+
+        summary = asyncio.run(
+            self.s3_upload.upload_directory("test-bucket", self.temp_dir.name)
+        )
+
+        self.assertEqual(summary["uploaded"], 1)
+        self.assertEqual(self.client.objects[file_path], b"0123456789abcdefghij")
+
+    def test_upload_directory_bad_etag(self):
+        file_path = self.write_file("first.JPG", b"first")
+
+        async def put_object(**kwargs):
+            return {"ETag": '"bad"'}
+
+        self.client.put_object = put_object
+
+        summary = asyncio.run(
+            self.s3_upload.upload_directory("test-bucket", self.temp_dir.name)
+        )
+
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(summary["failed_files"], [file_path])
+        self.assertTrue(os.path.exists(file_path))
+
+    def test_upload_directory_connection_error(self):
+        file_path = self.write_file("first.JPG", b"first")
+
+        def get_paginator(operation):
+            raise botocore.exceptions.EndpointConnectionError(
+                endpoint_url="http://localhost:4566"
+            )
+
+        async def put_object(**kwargs):
+            return {}
+
+        async def head_object(**kwargs):
+            raise botocore.exceptions.EndpointConnectionError(
+                endpoint_url="http://localhost:4566"
+            )
+
+        self.client.get_paginator = get_paginator
+        self.client.put_object = put_object
+        self.client.head_object = head_object
+
+        # The listing and the ETag lookup fail without ending the upload, and the file
+        # that can not be verified is kept
+        summary = asyncio.run(
+            self.s3_upload.upload_directory("test-bucket", self.temp_dir.name)
+        )
+
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(summary["failed_files"], [file_path])
+        self.assertTrue(os.path.exists(file_path))
+
+    def test_upload_directory_state(self):
+        state = TransferState(os.path.join(self.temp_dir.name, ".state.sqlite3"))
+        self.addCleanup(state.close)
+        self.s3_upload.state = state
+        self.write_file("ISS070-E-1.JPG", b"first")
+
+        summary = asyncio.run(
+            self.s3_upload.upload_directory("test-bucket", self.temp_dir.name)
+        )
+
+        self.assertEqual(summary["uploaded"], 1)
+        self.assertEqual(state.get_path("ISS070-E-1.JPG")["state"], DELETED)
+
+
+if __name__ == "__main__":
+    unittest.main()
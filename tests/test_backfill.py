@@ -0,0 +1,158 @@
+import os
+import tempfile
+import unittest
+import requests_mock
+from winearth_copy.backfill import Backfill, date_range
+from winearth_copy.state import (
+    COMPLETE,
+    DELETED,
+    METADATA_LINES,
+    STARTED,
+    TransferState,
+)
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.state = TransferState(os.path.join(self.temp_dir.name, "state.sqlite3"))
+        self.backfill = Backfill(
+            "fake_api_key", self.temp_dir.name, self.state, concurrency=2
+        )
+        self.api_url = self.backfill.downloader.api_url
+        self.base_download_url = self.backfill.downloader.base_download_url
+
+    def tearDown(self):
+        self.backfill.close()
+        self.state.close()
+        self.temp_dir.cleanup()
+
+    def mock_day(self, mock, query_date, filenames, status_code=200):
+        records = [
+            {"images.directory": "ISS/%s" % query_date, "images.filename": filename}
+            for filename in filenames
+        ]
+        mock.get(
+            self.api_url + "?query=nadir|pdate|eq|%s" % query_date,
+            json=(
+                records
+                if filenames
+                else {
+                    "result": "SQL found no records that match the specified criteria"
+                }
+            ),
+            status_code=status_code,
+        )
+        for record in records:
+            mock.get(
+                "%sISS/%s/%s"
+                % (self.base_download_url, query_date, record["images.filename"]),
+                content=b"This is a test image",
+            )
+
+    def test_pool_size(self):
+        backfill = Backfill(
+            "fake_api_key",
+            self.temp_dir.name,
+            self.state,
+            concurrency=4,
+            day_concurrency=3,
+            hedge=True,
+        )
+        self.addCleanup(backfill.close)
+
+        # Every day has its listing and two requests for each hedged image
+        adapter = backfill.downloader.session.get_adapter("https://")
+        self.assertEqual(adapter._pool_maxsize, 27)
+
+    def test_date_range(self):
+        self.assertEqual(
+            date_range("20231230", "20240102"),
+            ["20231230", "20231231", "20240101", "20240102"],
+        )
+        self.assertEqual(date_range("20240102", "20240101"), [])
+
+        with self.assertRaises(ValueError):
+            date_range("2024-01-01", "20240102")
+
+    @requests_mock.Mocker()
+    def test_run(self, mock):
+        self.mock_day(mock, "20240101", ["ISS070-E-1.JPG", "ISS070-E-2.JPG"])
+        self.mock_day(mock, "20240102", [])
+        self.mock_day(mock, "20240103", ["ISS070-E-3.JPG"], status_code=500)
+
+        summary = self.backfill.run("20240101", "20240103")
+
+        self.assertEqual(summary["days"], 3)
+        self.assertEqual(summary["skipped_days"], 0)
+        self.assertEqual(summary["downloaded"], 2)
+        self.assertEqual(summary["metadata"], 2)
+        self.assertEqual(summary["incomplete_days"], ["20240103"])
+
+        self.assertEqual(self.state.get_day("20240101")["state"], COMPLETE)
+        self.assertEqual(self.state.get_day("20240101")["image_count"], 2)
+        self.assertEqual(self.state.get_day("20240102")["state"], COMPLETE)
+        self.assertEqual(self.state.get_day("20240103")["state"], STARTED)
+
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(self.temp_dir.name, "ISS", "20240101", "ISS070-E-1.JPG")
+            )
+        )
+        # The hashes are kept in the state database rather than a manifest
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(self.temp_dir.name, ".winearth", "manifest-20240101.json")
+            )
+        )
+
+    @requests_mock.Mocker()
+    def test_run_resume(self, mock):
+        self.mock_day(mock, "20240101", ["ISS070-E-1.JPG"])
+        self.mock_day(mock, "20240102", ["ISS070-E-2.JPG"])
+        self.state.set_day("20240101", COMPLETE, 1)
+
+        summary = self.backfill.run("20240101", "20240102")
+
+        # The completed day is not queried again
+        self.assertEqual(summary["skipped_days"], 1)
+        self.assertEqual(summary["downloaded"], 1)
+        self.assertEqual(summary["incomplete_days"], [])
+        self.assertFalse(
+            any("20240101" in request.url for request in mock.request_history)
+        )
+
+        # A recheck queries the completed day again and only downloads what is new
+        self.mock_day(mock, "20240101", ["ISS070-E-1.JPG", "ISS070-E-3.JPG"])
+
+        summary = self.backfill.run("20240101", "20240102", recheck=True)
+
+        self.assertEqual(summary["skipped_days"], 0)
+        self.assertEqual(summary["downloaded"], 2)
+        self.assertTrue(
+            any("20240101" in request.url for request in mock.request_history)
+        )
+
+    @requests_mock.Mocker()
+    def test_run_recheck_metadata_lines(self, mock):
+        self.backfill.close()
+        self.backfill = Backfill(
+            "fake_api_key",
+            self.temp_dir.name,
+            self.state,
+            concurrency=2,
+            metadata_format="jsonl",
+        )
+        self.mock_day(mock, "20240101", ["ISS070-E-1.JPG", "ISS070-E-2.JPG"])
+
+        summary = self.backfill.run("20240101", "20240101")
+        self.assertEqual(summary["metadata"], 1)
+
+        # A daemon cycle that queries the day again does not queue the unchanged
+        # metadata file for upload again
+        key = ("ISS/20240101", "", "20240101")
+        self.state.set_state(key, METADATA_LINES, DELETED)
+        summary = self.backfill.run("20240101", "20240101", recheck=True)
+
+        self.assertEqual(summary["metadata"], 0)
+        self.assertEqual(self.state.get(key, METADATA_LINES)["state"], DELETED)
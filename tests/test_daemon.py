@@ -0,0 +1,130 @@
+import json
+import unittest
+import urllib.error
+import urllib.request
+from datetime import date
+from mock import Mock
+from winearth_copy.daemon import STALE_CYCLES, Daemon
+from winearth_copy.metrics import Metrics
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.backfill = Mock()
+        self.backfill.metrics = Metrics()
+        self.backfill.run.return_value = {
+            "days": 3,
+            "skipped_days": 0,
+            "incomplete_days": [],
+            "metadata": 2,
+            "downloaded": 2,
+            "timeouts": 0,
+            "hedges": 0,
+        }
+        self.s3 = Mock()
+        self.s3.upload_directory.return_value = {
+            "uploaded": 4,
+            "skipped": 0,
+            "failed": 0,
+            "failed_files": [],
+        }
+        self.validator = Mock()
+        self.daemon = Daemon(
+            self.backfill,
+            self.s3,
+            "test-bucket",
+            "/tmp/winearth",
+            interval=60,
+            window=2,
+            validator=self.validator,
+        )
+
+    def test_query_dates(self):
+        self.assertEqual(
+            self.daemon.query_dates(date(2024, 3, 1)), ("20240228", "20240301")
+        )
+
+    def test_run_cycle(self):
+        cycle = self.daemon.run_cycle()
+
+        self.assertIsNone(cycle["error"])
+        self.assertEqual(cycle["downloaded"], 2)
+        self.assertEqual(cycle["uploaded"], 4)
+        start_date, end_date = self.daemon.query_dates()
+        self.backfill.run.assert_called_once_with(start_date, end_date, recheck=True)
+        self.validator.validate.assert_called_once_with()
+        self.s3.upload_directory.assert_called_once_with("test-bucket", "/tmp/winearth")
+        self.assertEqual(self.daemon.last_success, cycle["finished"])
+
+        # A failed cycle is counted and the next one still runs
+        self.s3.upload_directory.side_effect = OSError("connection reset")
+        cycle = self.daemon.run_cycle()
+
+        self.assertEqual(cycle["error"], "OSError: connection reset")
+        self.assertEqual(self.daemon.counts["cycles"], 2)
+        self.assertEqual(self.daemon.counts["failed_cycles"], 1)
+        self.assertEqual(self.daemon.counts["downloaded"], 4)
+        self.assertEqual(self.daemon.counts["uploaded"], 4)
+
+    def test_run(self):
+        self.assertEqual(self.daemon.run(cycles=1), 1)
+
+        # A stopped daemon returns without running a cycle
+        self.daemon.stop()
+        self.assertEqual(self.daemon.run(), 0)
+        self.assertEqual(self.backfill.run.call_count, 1)
+
+    def test_health(self):
+        # Healthy before the first cycle ends
+        self.assertTrue(self.daemon.health()["healthy"])
+
+        self.s3.upload_directory.return_value["failed"] = 1
+        self.daemon.run_cycle()
+        health = self.daemon.health()
+
+        self.assertFalse(health["healthy"])
+        self.assertEqual(health["last_cycle"]["error"], "Failed to upload 1 files.")
+
+        self.s3.upload_directory.return_value["failed"] = 0
+        self.daemon.run_cycle()
+        self.assertTrue(self.daemon.health()["healthy"])
+
+        # Unhealthy once no cycle has succeeded for too long
+        self.daemon.last_success -= STALE_CYCLES * self.daemon.interval + 1
+        self.assertFalse(self.daemon.health()["healthy"])
+
+    def test_serve(self):
+        self.daemon.metrics.observe("download", 0.02, 2048)
+        self.daemon.run_cycle()
+        server = self.daemon.serve("127.0.0.1", 0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = "http://127.0.0.1:%d" % server.server_port
+
+        with urllib.request.urlopen(url + "/healthz") as response:
+            health = json.load(response)
+        self.assertTrue(health["healthy"])
+        self.assertEqual(health["counts"]["uploaded"], 4)
+
+        with urllib.request.urlopen(url + "/metrics") as response:
+            lines = response.read().decode().splitlines()
+        self.assertIn(
+            'winearth_transfer_bytes_total{command="daemon",phase="download"} 2048',
+            lines,
+        )
+        self.assertIn('winearth_run_count{command="daemon",name="cycles"} 1', lines)
+
+        self.daemon.last_success = None
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(url + "/healthz")
+        self.assertEqual(context.exception.code, 503)
+        context.exception.close()
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(url + "/missing")
+        self.assertEqual(context.exception.code, 404)
+        context.exception.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
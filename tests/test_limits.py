@@ -0,0 +1,202 @@
+import io
+import threading
+import time
+import tempfile
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from winearth_copy.limits import (
+    AdaptiveLimiter,
+    AdaptiveRetry,
+    ThrottledReader,
+    TokenBucket,
+    bandwidth_limit,
+)
+from winearth_copy.s3_upload import S3Upload
+from mock import patch
+from winearth_copy.winearth_download import DeadlineExceeded, WinEarthDownload
+
+
+class ThrottleHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    throttled = 0
+
+    def do_GET(self):
+        # Throttle the first requests, then succeed
+        if ThrottleHandler.throttled > 0:
+            ThrottleHandler.throttled -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_increase(self):
+        limiter = AdaptiveLimiter(2, 4)
+
+        for _ in range(20):
+            with limiter:
+                pass
+
+        # The limit grows by about one for every limit transfers, up to the maximum
+        self.assertEqual(limiter.limit, 4)
+
+    def test_slow_transfers_hold(self):
+        limiter = AdaptiveLimiter(2, 8)
+        limiter.fastest = 0.001
+
+        with limiter:
+            time.sleep(0.01)
+
+        self.assertEqual(limiter.limit, 2)
+
+    def test_backoff(self):
+        limiter = AdaptiveLimiter(8, 16, cooldown=60)
+
+        limiter.backoff()
+        # A second signal inside the cooldown is ignored
+        limiter.backoff()
+
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.decreases, 1)
+
+        limiter.last_decrease -= 60
+        limiter.backoff()
+        limiter.last_decrease -= 60
+        limiter.backoff()
+        limiter.last_decrease -= 60
+        limiter.backoff()
+
+        self.assertEqual(limiter.limit, 1)
+
+    def test_failed_transfer_holds(self):
+        limiter = AdaptiveLimiter(8, 16)
+
+        # A transfer that backed off does not raise the limit again when it ends
+        with limiter:
+            limiter.backoff()
+
+        self.assertEqual(limiter.limit, 4)
+
+    def test_limit_blocks(self):
+        limiter = AdaptiveLimiter(1, 1)
+        entered = threading.Event()
+
+        def transfer():
+            with limiter:
+                entered.set()
+
+        with limiter:
+            thread = threading.Thread(target=transfer)
+            thread.start()
+            self.assertFalse(entered.wait(0.05))
+
+        thread.join()
+        self.assertTrue(entered.is_set())
+
+    def test_retry_backoff(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottleHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        limiter = AdaptiveLimiter(8, 16)
+        win_earth = WinEarthDownload(None, "fake_api_key", limiter=limiter)
+        self.addCleanup(win_earth.close)
+        self.assertIsInstance(
+            win_earth.session.get_adapter("http://").max_retries, AdaptiveRetry
+        )
+
+        ThrottleHandler.throttled = 1
+        response = win_earth.session.get("http://127.0.0.1:%d/" % server.server_port)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(limiter.limit, 4)
+
+    @patch.object(WinEarthDownload, "fetch_image", return_value=False)
+    def test_download_backoff(self, mock_fetch_image):
+        limiter = AdaptiveLimiter(8, 16)
+        win_earth = WinEarthDownload(None, "fake_api_key", limiter=limiter)
+        self.addCleanup(win_earth.close)
+        image_data = {"images.directory": "ISS", "images.filename": "ISS070-E-1.JPG"}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertFalse(win_earth.download_image(image_data, temp_dir))
+
+        self.assertEqual(limiter.limit, 4)
+
+    def test_deadline_backoff(self):
+        limiter = AdaptiveLimiter(8, 16)
+        win_earth = WinEarthDownload(None, "fake_api_key", limiter=limiter)
+        self.addCleanup(win_earth.close)
+
+        # Timeouts while the body is read are not seen by the retries of the session
+        with tempfile.TemporaryDirectory() as temp_dir, patch.object(
+            win_earth, "fetch_part", side_effect=DeadlineExceeded("Deadline exceeded")
+        ):
+            self.assertIsNone(
+                win_earth.fetch_attempts(
+                    "http://127.0.0.1/ISS070-E-1.JPG",
+                    "ISS070-E-1.JPG",
+                    temp_dir + "/.ISS070-E-1.JPG.part",
+                )
+            )
+
+        self.assertEqual(limiter.limit, 4)
+
+    def test_s3_retry_backoff(self):
+        limiter = AdaptiveLimiter(8, 16)
+        s3_upload = S3Upload(
+            "fake_access_key",
+            "fake_secret_key",
+            "http://localhost:4566",
+            "path",
+            limiter=limiter,
+        )
+
+        s3_upload.observe_retry(
+            response=(None, {"ResponseMetadata": {"HTTPStatusCode": 200}})
+        )
+        self.assertEqual(limiter.limit, 8)
+
+        s3_upload.observe_retry(
+            response=(None, {"ResponseMetadata": {"HTTPStatusCode": 503}})
+        )
+        self.assertEqual(limiter.limit, 4)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_consume(self):
+        bandwidth = TokenBucket(1000)
+
+        # The first second of data is free, after that the caller waits
+        self.assertEqual(bandwidth.consume(1000), 0)
+        self.assertAlmostEqual(bandwidth.consume(50), 0.05, delta=0.01)
+
+    def test_throttled_reader(self):
+        bandwidth = TokenBucket(1000, burst=10)
+        reader = ThrottledReader(io.BytesIO(b"0123456789" * 3), bandwidth)
+
+        start = time.monotonic()
+        self.assertEqual(reader.read(), b"0123456789" * 3)
+        self.assertGreaterEqual(time.monotonic() - start, 0.015)
+
+        reader.seek(0)
+        self.assertEqual(reader.tell(), 0)
+
+    def test_bandwidth_limit(self):
+        self.assertIsNone(bandwidth_limit(0))
+        self.assertEqual(bandwidth_limit(1024).rate, 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from winearth_copy.manifest import Manifest, lookup_md5, read_manifests
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = self.temp_dir.name
+
+        self.file_path = os.path.join(self.path, "ISS", "file.JPG")
+        os.makedirs(os.path.dirname(self.file_path))
+        with open(self.file_path, "wb") as f:
+            f.write(b"This is a test image")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_record_and_save(self):
+        manifest = Manifest(self.path, "20240101")
+        manifest.record(self.file_path, "fake_md5")
+        manifest.save()
+
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(self.path, ".winearth", "manifest-20240101.json")
+            )
+        )
+
+        # A new manifest for the same day loads the saved entries
+        manifest = Manifest(self.path, "20240101")
+        self.assertEqual(
+            manifest.entries[os.path.join("ISS", "file.JPG")]["md5"], "fake_md5"
+        )
+
+    def test_save_empty(self):
+        Manifest(self.path, "20240101").save()
+        self.assertFalse(os.path.exists(os.path.join(self.path, ".winearth")))
+
+    def test_lookup_md5(self):
+        manifest = Manifest(self.path, "20240101")
+        manifest.record(self.file_path, "fake_md5")
+        manifest.save()
+
+        entries = read_manifests(self.path)
+        self.assertEqual(lookup_md5(entries, self.path, self.file_path), "fake_md5")
+
+        # Unknown files have no hash
+        self.assertIsNone(
+            lookup_md5(entries, self.path, os.path.join(self.path, "other.JPG"))
+        )
+
+        # A file that changed since it was recorded is not trusted
+        with open(self.file_path, "ab") as f:
+            f.write(b"more data")
+        self.assertIsNone(lookup_md5(entries, self.path, self.file_path))
+
+    def test_read_manifests_invalid_json(self):
+        os.makedirs(os.path.join(self.path, ".winearth"))
+        with open(
+            os.path.join(self.path, ".winearth", "manifest-20240101.json"), "w"
+        ) as f:
+            f.write("invalid json")
+
+        self.assertEqual(read_manifests(self.path), {})
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from winearth_copy.metadata import (
+    MetadataLines,
+    metadata_lines_date,
+    metadata_lines_name,
+)
+
+
+class TestMetadataLines(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = self.temp_dir.name
+
+        self.records = [
+            {"images.directory": "ISS/070", "images.filename": "ISS070-E-1.JPG"},
+            {"images.directory": "ISS/070", "images.filename": "ISS070-E-2.JPG"},
+            {"images.directory": "ISS/071", "images.filename": "ISS071-E-1.JPG"},
+        ]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_save(self):
+        metadata_lines = MetadataLines("20240101")
+        for image_data in self.records:
+            metadata_lines.add(image_data)
+
+        saved = metadata_lines.save(self.path)
+
+        # One file is written for each image directory
+        self.assertEqual(
+            [directory for directory, *rest in saved], ["ISS/070", "ISS/071"]
+        )
+
+        file_path = os.path.join(self.path, "ISS", "070", "metadata-20240101.jsonl")
+        with open(file_path, "rb") as f:
+            data = f.read()
+
+        self.assertEqual(
+            saved[0], ("ISS/070", file_path, hashlib.md5(data).hexdigest())
+        )
+        self.assertEqual(
+            [json.loads(line) for line in data.splitlines()], self.records[:2]
+        )
+
+        # Records are written compactly, one per line
+        self.assertNotIn(b": ", data)
+
+        # No temporary files are left behind
+        self.assertEqual(
+            os.listdir(os.path.dirname(file_path)), ["metadata-20240101.jsonl"]
+        )
+
+    def test_save_replaces(self):
+        metadata_lines = MetadataLines("20240101")
+        metadata_lines.add(self.records[0])
+        metadata_lines.save(self.path)
+
+        metadata_lines = MetadataLines("20240101")
+        metadata_lines.add(self.records[1])
+        metadata_lines.save(self.path)
+
+        with open(
+            os.path.join(self.path, "ISS", "070", "metadata-20240101.jsonl")
+        ) as f:
+            self.assertEqual([json.loads(line) for line in f], [self.records[1]])
+
+    def test_save_empty(self):
+        self.assertEqual(MetadataLines("20240101").save(self.path), [])
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_metadata_lines_name(self):
+        self.assertEqual(metadata_lines_name("20240101"), "metadata-20240101.jsonl")
+        self.assertEqual(metadata_lines_date("metadata-20240101.jsonl"), "20240101")
+        self.assertIsNone(metadata_lines_date("ISS070-E-1.json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
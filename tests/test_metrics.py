@@ -0,0 +1,119 @@
+import json
+import os
+import tempfile
+import unittest
+from winearth_copy.metrics import LATENCY_BUCKETS, PHASES, Histogram, Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 5.65)
+        self.assertEqual(histogram.cumulative(), [(0.1, 2), (1.0, 3), ("+Inf", 4)])
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.75), 1.0)
+        # Observations above the largest bucket are reported at that bound
+        self.assertEqual(histogram.quantile(1.0), 1.0)
+        self.assertIsNone(Histogram().quantile(0.5))
+
+    def test_time(self):
+        metrics = Metrics()
+
+        with metrics.time("download") as timing:
+            timing.bytes = 100
+        with metrics.time("download") as timing:
+            timing.failed = True
+        with self.assertRaises(OSError):
+            with metrics.time("download"):
+                raise OSError("disk full")
+
+        # Only the operation that succeeded is in the histogram
+        self.assertEqual(metrics.latencies["download"].count, 1)
+        self.assertEqual(metrics.bytes["download"], 100)
+        self.assertEqual(metrics.errors["download"], 2)
+
+    def test_count(self):
+        metrics = Metrics()
+
+        with metrics.time("put") as timing:
+            self.assertEqual(b"".join(timing.count([b"abc", b"de"])), b"abcde")
+
+        self.assertEqual(metrics.bytes["put"], 5)
+
+    def test_summary(self):
+        metrics = Metrics()
+        metrics.observe("put", 0.2, 1000)
+        metrics.observe("put", 0.4, 3000)
+        metrics.retry("put")
+        metrics.error("verify")
+
+        summary = metrics.summary(uploaded=2)
+
+        self.assertEqual(summary["counts"], {"uploaded": 2})
+        self.assertEqual(set(summary["phases"]), set(PHASES))
+        put = summary["phases"]["put"]
+        self.assertEqual(put["count"], 2)
+        self.assertEqual(put["retries"], 1)
+        self.assertEqual(put["bytes"], 4000)
+        self.assertAlmostEqual(put["latency_seconds"]["mean"], 0.3)
+        self.assertEqual(put["latency_seconds"]["p95"], 0.5)
+        self.assertEqual(
+            len(put["latency_seconds"]["buckets"]), len(LATENCY_BUCKETS) + 1
+        )
+        self.assertGreater(put["bytes_per_second"], 0)
+        self.assertEqual(summary["phases"]["verify"]["errors"], 1)
+        self.assertIsNone(summary["phases"]["list"]["latency_seconds"]["mean"])
+
+    def test_write(self):
+        metrics = Metrics()
+        metrics.observe("download", 0.02, 2048)
+        metrics.error("download")
+
+        json_path = os.path.join(self.temp_dir.name, "state", "metrics-download.json")
+        prometheus_directory = os.path.join(self.temp_dir.name, "textfile")
+        metrics.write("download", json_path, prometheus_directory, images=3)
+
+        with open(json_path) as f:
+            summary = json.load(f)
+        self.assertEqual(summary["counts"], {"images": 3})
+        self.assertEqual(summary["phases"]["download"]["bytes"], 2048)
+
+        # No temporary files are left behind
+        self.assertEqual(os.listdir(prometheus_directory), ["winearth_download.prom"])
+        with open(os.path.join(prometheus_directory, "winearth_download.prom")) as f:
+            lines = f.read().splitlines()
+
+        self.assertIn("# TYPE winearth_transfer_duration_seconds histogram", lines)
+        self.assertIn(
+            'winearth_transfer_duration_seconds_bucket{command="download",phase="download",le="0.025"} 1',
+            lines,
+        )
+        self.assertIn(
+            'winearth_transfer_duration_seconds_bucket{command="download",phase="download",le="0.01"} 0',
+            lines,
+        )
+        self.assertIn(
+            'winearth_transfer_duration_seconds_count{command="download",phase="download"} 1',
+            lines,
+        )
+        self.assertIn(
+            'winearth_transfer_bytes_total{command="download",phase="download"} 2048',
+            lines,
+        )
+        self.assertIn(
+            'winearth_transfer_errors_total{command="download",phase="download"} 1',
+            lines,
+        )
+        self.assertIn('winearth_run_count{command="download",name="images"} 3', lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from winearth_copy.metrics import Metrics
+from winearth_copy.profiling import Profiler
+
+
+def work(n):
+    return sum(i * i for i in range(n))
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_profile(self):
+        metrics = Metrics()
+        metrics.observe("download", 0.5, 100)
+
+        profiler = Profiler(self.temp_dir.name, "download")
+        profiler.start()
+        with profiler.stage("transfer"):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(work, [1000] * 4))
+        paths = profiler.stop(metrics)
+
+        self.assertEqual(len(paths), 3)
+
+        # Calls made by the worker threads are in the profile
+        stats = pstats.Stats(os.path.join(self.temp_dir.name, "download.prof"))
+        calls = [value[1] for key, value in stats.stats.items() if key[2] == "work"]
+        self.assertEqual(calls, [4])
+
+        with open(os.path.join(self.temp_dir.name, "download-profile.txt")) as f:
+            self.assertIn("cumulative", f.read())
+
+        with open(os.path.join(self.temp_dir.name, "download-phases.json")) as f:
+            phases = json.load(f)
+        self.assertEqual(phases["command"], "download")
+        self.assertIn("transfer", phases["stages"])
+        self.assertEqual(phases["transfer_phases"]["download"]["count"], 1)
+        self.assertEqual(phases["transfer_phases"]["download"]["seconds"], 0.5)
+
+    def test_profile_off(self):
+        profiler = Profiler(None, "download")
+        profiler.start()
+        with profiler.stage("transfer"):
+            work(10)
+
+        self.assertEqual(profiler.stop(), [])
+        self.assertEqual(profiler.stages, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
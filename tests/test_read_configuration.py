@@ -22,6 +22,35 @@ class TestReadConfiguration(unittest.TestCase):
             "addressing_style": "auto",
             "bucket_name": "",
             "path": "/tmp",
+            "download_concurrency": 4,
+            "download_retries": 5,
+            "connect_timeout": 10,
+            "read_timeout": 60,
+            "image_deadline": 600,
+            "hedge_requests": False,
+            "backfill_day_concurrency": 2,
+            "upload_concurrency": 4,
+            "adaptive_concurrency": False,
+            "max_concurrency": 32,
+            "download_bandwidth": 0,
+            "upload_bandwidth": 0,
+            "multipart_threshold": 67108864,
+            "multipart_chunksize": 16777216,
+            "multipart_concurrency": 4,
+            "read_buffer_size": 1048576,
+            "state_database": "",
+            "validate_images": True,
+            "decode_images": False,
+            "validate_concurrency": 4,
+            "metrics_directory": "",
+            "prometheus_textfile_directory": "",
+            "daemon_interval": 900,
+            "daemon_window_days": 2,
+            "daemon_listen_address": "127.0.0.1",
+            "daemon_port": 9337,
+            "watch_interval": 5,
+            "engine": "threads",
+            "metadata_format": "json",
         }
 
         self.assertEqual(configuration, expected_configuration)
@@ -1,10 +1,28 @@
+import io
 import os
+import base64
 import hashlib
 import tempfile
+import threading
 import unittest
+import botocore.exceptions
+import mock
 from mock import patch
 from botocore.stub import Stubber
-from winearth_copy.s3_upload import S3Upload  # Replace with the correct import path
+from winearth_copy.manifest import Manifest
+from winearth_copy.state import (
+    DELETED,
+    DOWNLOADED,
+    IMAGE,
+    METADATA,
+    UPLOADED,
+    TransferState,
+)
+from winearth_copy.s3_upload import (
+    HashingReader,
+    S3Upload,
+    directory_prefixes,
+)  # Replace with the correct import path
 
 
 class TestS3Upload(unittest.TestCase):
@@ -54,6 +72,37 @@ class TestS3Upload(unittest.TestCase):
         result = self.s3_upload.md5(non_existent_path)
         self.assertIsNone(result)
 
+    def test_hashing_reader(self):
+        data = b"0123456789" * 100
+        f = io.BytesIO(data)
+        reader = HashingReader(f)
+
+        # A partial read, then a retry from the start, is not hashed twice
+        self.assertEqual(reader.read(300), data[:300])
+        reader.seek(0)
+        self.assertEqual(reader.read(500), data[:500])
+        self.assertEqual(reader.tell(), 500)
+
+        # finish hashes the rest of the file
+        self.assertEqual(reader.finish(64), hashlib.md5(data).hexdigest())
+
+    def test_put_file_single_read(self):
+        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            tmp_file.write(b"This is a test upload file.")
+            tmp_file_path = tmp_file.name
+
+        self.stubber.add_response("put_object", {"ETag": '"etag"'})
+
+        # The stubbed client never reads the body, so the file is hashed by finish
+        with patch("builtins.open", wraps=open) as mock_open:
+            response, etag = self.s3_upload.put_file(self.bucket_name, tmp_file_path)
+
+        os.remove(tmp_file_path)
+
+        self.assertEqual(mock_open.call_count, 1)
+        self.assertEqual(response["ETag"], '"etag"')
+        self.assertEqual(etag, hashlib.md5(b"This is a test upload file.").hexdigest())
+
     def test_remove_file(self):
         # Create a temporary file to remove
         with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
@@ -148,17 +197,245 @@ class TestS3Upload(unittest.TestCase):
         # Assert that the upload failed
         self.assertIsNone(result)
 
+    def test_upload_directory_requests_per_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "file.txt")
+            with open(file_path, "wb") as file:
+                file.write(b"File content.")
+            md5 = hashlib.md5(b"File content.")
+
+            self.stubber.add_response(
+                "list_objects_v2",
+                {"Contents": [], "KeyCount": 0},
+                {"Bucket": self.bucket_name, "Prefix": os.path.join(temp_dir, "")},
+            )
+            self.stubber.add_response(
+                "put_object",
+                {"ETag": '"%s"' % md5.hexdigest()},
+                {
+                    "Bucket": self.bucket_name,
+                    "Key": file_path,
+                    "Body": mock.ANY,
+                },
+            )
+
+            result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(result["uploaded"], 1)
+        self.assertEqual(result["requests"], 2)
+        self.assertEqual(result["requests_per_file"], 2.0)
+        self.assertEqual(self.s3_upload.request_counts["PutObject"], 1)
+
     def test_upload_object_non_existent_file(self):
         # Run the upload_object function with a non-existent file
         result = self.s3_upload.upload_object(self.bucket_name, "non_existent_file.txt")
         self.assertIsNone(result)
 
+    def test_expected_etag(self):
+        s3_upload = S3Upload(
+            "fake",
+            "fake",
+            "http://localhost:4566",
+            "path",
+            multipart_threshold=10,
+            multipart_chunksize=8,
+        )
+
+        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            tmp_file.write(b"0123456789abcdefghij")
+            tmp_file_path = tmp_file.name
+
+        # Files at or above the threshold get the composite multipart ETag
+        part_digests = b"".join(
+            hashlib.md5(part).digest() for part in [b"01234567", b"89abcdef", b"ghij"]
+        )
+        result = s3_upload.expected_etag(tmp_file_path)
+        self.assertEqual(result, hashlib.md5(part_digests).hexdigest() + "-3")
+
+        # Files below the threshold get the plain MD5 hash
+        s3_upload.multipart_threshold = 100
+        result = s3_upload.expected_etag(tmp_file_path)
+        self.assertEqual(result, hashlib.md5(b"0123456789abcdefghij").hexdigest())
+
+        os.remove(tmp_file_path)
+
+        self.assertIsNone(s3_upload.expected_etag(tmp_file_path))
+
+    def test_part_size(self):
+        self.assertEqual(self.s3_upload.part_size(1024), 16 * 1024 * 1024)
+        # Parts grow so a file never needs more than 10000 parts
+        size = 16 * 1024 * 1024 * 10001
+        self.assertEqual(self.s3_upload.part_size(size), 32 * 1024 * 1024)
+
+    def test_upload_object_multipart(self):
+        self.s3_upload.multipart_threshold = 10
+        self.s3_upload.multipart_chunksize = 8
+        self.s3_upload.multipart_concurrency = 1
+
+        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            tmp_file.write(b"0123456789abcdefghij")
+            tmp_file_path = tmp_file.name
+
+        self.stubber.add_response(
+            "create_multipart_upload",
+            {"UploadId": "upload-id"},
+            {"Bucket": self.bucket_name, "Key": tmp_file_path},
+        )
+        for part_number, part in enumerate([b"01234567", b"89abcdef", b"ghij"], 1):
+            self.stubber.add_response(
+                "upload_part",
+                {"ETag": '"%s"' % hashlib.md5(part).hexdigest()},
+                {
+                    "Bucket": self.bucket_name,
+                    "Key": tmp_file_path,
+                    "UploadId": "upload-id",
+                    "PartNumber": part_number,
+                    "Body": part,
+                    "ContentMD5": base64.b64encode(hashlib.md5(part).digest()).decode(),
+                },
+            )
+        self.stubber.add_response(
+            "complete_multipart_upload",
+            {"ETag": '"composite-3"'},
+        )
+
+        result = self.s3_upload.upload_object(self.bucket_name, tmp_file_path)
+
+        os.remove(tmp_file_path)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(result["ETag"], '"composite-3"')
+
+    def test_upload_object_multipart_abort(self):
+        self.s3_upload.multipart_threshold = 10
+        self.s3_upload.multipart_chunksize = 8
+        self.s3_upload.multipart_concurrency = 1
+
+        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            tmp_file.write(b"0123456789abcdefghij")
+            tmp_file_path = tmp_file.name
+
+        self.stubber.add_response("create_multipart_upload", {"UploadId": "upload-id"})
+        self.stubber.add_client_error(
+            "upload_part",
+            service_error_code="500",
+            service_message="Internal Server Error",
+        )
+        self.stubber.add_response(
+            "abort_multipart_upload",
+            {},
+            {"Bucket": self.bucket_name, "Key": tmp_file_path, "UploadId": "upload-id"},
+        )
+
+        result = self.s3_upload.upload_object(self.bucket_name, tmp_file_path)
+
+        os.remove(tmp_file_path)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertIsNone(result)
+
+    def test_upload_stream(self):
+        data = b"0123456789"
+        self.stubber.add_response(
+            "put_object",
+            {"ETag": '"%s"' % hashlib.md5(data).hexdigest()},
+            {
+                "Bucket": self.bucket_name,
+                "Key": self.object_name,
+                "Body": data,
+                "ContentMD5": base64.b64encode(hashlib.md5(data).digest()).decode(),
+            },
+        )
+
+        response, etag, md5 = self.s3_upload.upload_stream(
+            self.bucket_name, self.object_name, [b"01234", b"56789"]
+        )
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(etag, hashlib.md5(data).hexdigest())
+        self.assertEqual(md5, etag)
+
+    def test_upload_stream_multipart(self):
+        self.s3_upload.multipart_threshold = 10
+        self.s3_upload.multipart_chunksize = 8
+
+        self.stubber.add_response(
+            "create_multipart_upload",
+            {"UploadId": "upload-id"},
+            {"Bucket": self.bucket_name, "Key": self.object_name},
+        )
+        parts = [b"01234567", b"89abcdef", b"ghij"]
+        for part_number, part in enumerate(parts, 1):
+            self.stubber.add_response(
+                "upload_part",
+                {"ETag": '"%s"' % hashlib.md5(part).hexdigest()},
+                {
+                    "Bucket": self.bucket_name,
+                    "Key": self.object_name,
+                    "UploadId": "upload-id",
+                    "PartNumber": part_number,
+                    "Body": part,
+                    "ContentMD5": base64.b64encode(hashlib.md5(part).digest()).decode(),
+                },
+            )
+        self.stubber.add_response(
+            "complete_multipart_upload",
+            {"ETag": '"composite-3"'},
+        )
+
+        # The chunks do not line up with the parts
+        response, etag, md5 = self.s3_upload.upload_stream(
+            self.bucket_name,
+            self.object_name,
+            [b"012", b"3456789abcd", b"efghij"],
+        )
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(
+            etag,
+            "%s-3"
+            % hashlib.md5(
+                b"".join(hashlib.md5(part).digest() for part in parts)
+            ).hexdigest(),
+        )
+        self.assertEqual(md5, hashlib.md5(b"".join(parts)).hexdigest())
+
+    def test_upload_stream_abort(self):
+        self.s3_upload.multipart_threshold = 10
+        self.s3_upload.multipart_chunksize = 8
+
+        def chunks():
+            yield b"0123456789"
+            raise IOError("Connection reset")
+
+        self.stubber.add_response("create_multipart_upload", {"UploadId": "upload-id"})
+        self.stubber.add_response(
+            "upload_part", {"ETag": '"%s"' % hashlib.md5(b"01234567").hexdigest()}
+        )
+        self.stubber.add_response(
+            "abort_multipart_upload",
+            {},
+            {
+                "Bucket": self.bucket_name,
+                "Key": self.object_name,
+                "UploadId": "upload-id",
+            },
+        )
+
+        with self.assertRaises(IOError):
+            self.s3_upload.upload_stream(self.bucket_name, self.object_name, chunks())
+
+        self.stubber.assert_no_pending_responses()
+
+    @patch.object(S3Upload, "list_remote_objects", lambda *args: {})
     @patch.object(S3Upload, "get_object_etag")
-    @patch.object(S3Upload, "upload_object")
-    @patch.object(S3Upload, "md5")
-    def test_upload_directory(self, mock_md5, mock_upload_object, mock_get_object_etag):
-        mock_md5.return_value = "fake_md5"
-        mock_get_object_etag.return_value = "fake_md5"
+    @patch.object(S3Upload, "put_file")
+    def test_upload_directory(self, mock_put_file, mock_get_object_etag):
+        mock_put_file.return_value = (
+            {"ETag": '"d41d8cd98f00b204e9800998ecf8427e"'},
+            "d41d8cd98f00b204e9800998ecf8427e",
+        )
 
         # Create a temporary directory with multiple files
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -175,16 +452,27 @@ class TestS3Upload(unittest.TestCase):
 
             result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
 
-        self.assertEqual(result, 0)
+            # Verified files are removed locally
+            self.assertEqual(os.listdir(temp_dir), [])
 
+        self.assertEqual(result["uploaded"], 3)
+        self.assertEqual(result["failed"], 0)
+        self.assertEqual(result["failed_files"], [])
+
+        # The etag comes from the upload response, so no head_object is needed
+        mock_get_object_etag.assert_not_called()
+
+        self.assertEqual(self.s3_upload.metrics.latencies["put"].count, 3)
+        self.assertEqual(self.s3_upload.metrics.latencies["verify"].count, 3)
+        self.assertEqual(self.s3_upload.metrics.latencies["delete"].count, 3)
+
+    @patch.object(S3Upload, "list_remote_objects", lambda *args: {})
     @patch.object(S3Upload, "get_object_etag")
-    @patch.object(S3Upload, "upload_object")
-    @patch.object(S3Upload, "md5")
-    def test_upload_directory_bad_md5(
-        self, mock_md5, mock_upload_object, mock_get_object_etag
-    ):
-        mock_md5.return_value = "fake_md5"
+    @patch.object(S3Upload, "put_file")
+    def test_upload_directory_bad_md5(self, mock_put_file, mock_get_object_etag):
         mock_get_object_etag.return_value = "fake_etag"
+        # The upload response has no etag, so it is looked up with head_object
+        mock_put_file.return_value = ({}, "d41d8cd98f00b204e9800998ecf8427e")
 
         # Create a temporary directory with multiple files
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -201,4 +489,395 @@ class TestS3Upload(unittest.TestCase):
 
             result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
 
-        self.assertIsNone(result)
+            # Files that failed verification are kept locally
+            self.assertEqual(len(os.listdir(temp_dir)), 3)
+
+        self.assertEqual(result["uploaded"], 0)
+        self.assertEqual(result["failed"], 3)
+        self.assertEqual(sorted(result["failed_files"]), file_paths)
+        self.assertEqual(mock_get_object_etag.call_count, 3)
+        self.assertEqual(self.s3_upload.metrics.errors["verify"], 3)
+
+    @patch.object(S3Upload, "list_remote_objects", lambda *args: {})
+    @patch.object(S3Upload, "put_file")
+    def test_upload_directory_concurrent(self, mock_put_file):
+        s3_upload = S3Upload("fake", "fake", "http://localhost:4566", "path", 4)
+
+        # The ETag matches the file content for every file except file_1
+        def put_file(bucket_name, object_name, md5):
+            md5 = s3_upload.md5(object_name)
+            if object_name.endswith("file_1.txt"):
+                return {"ETag": '"bad_etag"'}, md5
+            return {"ETag": '"%s"' % md5}, md5
+
+        mock_put_file.side_effect = put_file
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, "sub"))
+            for i in range(8):
+                file_path = os.path.join(temp_dir, "sub", f"file_{i}.txt")
+                with open(file_path, "w") as file:
+                    file.write(f"File {i} content.")
+
+            result = s3_upload.upload_directory(self.bucket_name, temp_dir)
+
+            self.assertEqual(os.listdir(os.path.join(temp_dir, "sub")), ["file_1.txt"])
+
+        self.assertEqual(result["uploaded"], 7)
+        self.assertEqual(result["failed"], 1)
+        self.assertEqual(mock_put_file.call_count, 8)
+
+    @patch.object(S3Upload, "list_remote_objects", lambda *args: {})
+    @patch.object(S3Upload, "put_file")
+    def test_upload_directory_manifest(self, mock_put_file):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "file.txt")
+            with open(file_path, "wb") as file:
+                file.write(b"File content.")
+            md5 = hashlib.md5(b"File content.").hexdigest()
+
+            manifest = Manifest(temp_dir, "20240101")
+            manifest.record(file_path, md5)
+            manifest.save()
+
+            # In-progress downloads are hidden and skipped
+            with open(os.path.join(temp_dir, ".file.txt.abc.tmp"), "wb") as file:
+                file.write(b"File")
+
+            mock_put_file.return_value = ({"ETag": '"%s"' % md5}, md5)
+
+            result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
+
+        self.assertEqual(result["uploaded"], 1)
+        # The hash from the manifest is passed on so the file is not hashed again
+        mock_put_file.assert_called_once_with(self.bucket_name, file_path, md5)
+
+    def test_put_file_known_md5(self):
+        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            tmp_file.write(b"This is a test upload file.")
+            tmp_file_path = tmp_file.name
+        md5 = hashlib.md5(b"This is a test upload file.")
+
+        self.stubber.add_response(
+            "put_object",
+            {"ETag": '"%s"' % md5.hexdigest()},
+            {
+                "Bucket": self.bucket_name,
+                "Key": tmp_file_path,
+                "Body": mock.ANY,
+                "ContentMD5": base64.b64encode(md5.digest()).decode(),
+            },
+        )
+
+        response, etag = self.s3_upload.put_file(
+            self.bucket_name, tmp_file_path, md5.hexdigest()
+        )
+
+        os.remove(tmp_file_path)
+
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(etag, md5.hexdigest())
+
+    @patch("winearth_copy.s3_upload.read_manifests")
+    @patch.object(S3Upload, "list_remote_objects", lambda *args: {})
+    @patch.object(S3Upload, "put_file")
+    def test_upload_directory_state(self, mock_put_file, mock_read_manifests):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state = TransferState(os.path.join(temp_dir, ".winearth", "state.sqlite3"))
+            self.s3_upload.state = state
+
+            os.makedirs(os.path.join(temp_dir, "ISS"))
+            for file_name in ["ISS070-E-1.JPG", "ISS070-E-2.JPG", "unknown.JPG"]:
+                with open(os.path.join(temp_dir, "ISS", file_name), "wb") as file:
+                    file.write(b"File content.")
+            md5 = hashlib.md5(b"File content.").hexdigest()
+            stat = os.stat(os.path.join(temp_dir, "ISS", "ISS070-E-1.JPG"))
+
+            # Downloaded, with a hash recorded at download time
+            state.set_state(
+                ("ISS070", "E", "1"),
+                IMAGE,
+                DOWNLOADED,
+                path=os.path.join("ISS", "ISS070-E-1.JPG"),
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                md5=md5,
+            )
+            # Uploaded by an earlier run that stopped before removing the file
+            state.set_state(
+                ("ISS070", "E", "2"),
+                IMAGE,
+                UPLOADED,
+                path=os.path.join("ISS", "ISS070-E-2.JPG"),
+            )
+            # Already finished
+            state.set_state(
+                ("ISS070", "E", "3"),
+                METADATA,
+                DELETED,
+                path=os.path.join("ISS", "ISS070-E-3.json"),
+            )
+
+            mock_put_file.return_value = ({"ETag": '"%s"' % md5}, md5)
+
+            result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
+
+            # Only files listed in the state database are uploaded, with the recorded
+            # hash, and the directory is not walked again
+            self.assertEqual(os.listdir(os.path.join(temp_dir, "ISS")), ["unknown.JPG"])
+            mock_put_file.assert_called_once_with(
+                self.bucket_name,
+                os.path.join(temp_dir, "ISS", "ISS070-E-1.JPG"),
+                md5,
+            )
+            self.assertEqual(result["uploaded"], 1)
+            self.assertEqual(result["skipped"], 1)
+            self.assertEqual(state.get(("ISS070", "E", "1"), IMAGE)["state"], DELETED)
+            self.assertEqual(state.get(("ISS070", "E", "2"), IMAGE)["state"], DELETED)
+            self.assertIsNone(state.get_path(os.path.join("ISS", "unknown.JPG")))
+            # The manifests are not read when the state database has the hashes
+            mock_read_manifests.assert_not_called()
+
+            state.close()
+
+    @patch.object(S3Upload, "list_remote_objects", lambda *args: {})
+    @patch.object(S3Upload, "put_file")
+    def test_upload_directory_new_state(self, mock_put_file):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state = TransferState(os.path.join(temp_dir, ".winearth", "state.sqlite3"))
+            self.s3_upload.state = state
+
+            file_path = os.path.join(temp_dir, "ISS070-E-1.JPG")
+            with open(file_path, "wb") as file:
+                file.write(b"File content.")
+            md5 = hashlib.md5(b"File content.").hexdigest()
+            mock_put_file.return_value = ({"ETag": '"%s"' % md5}, md5)
+
+            # A new state database is filled from the directory first
+            result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
+
+            self.assertEqual(result["uploaded"], 1)
+            self.assertEqual(state.get_path("ISS070-E-1.JPG")["state"], DELETED)
+
+            state.close()
+
+    @patch.object(S3Upload, "list_remote_objects", lambda *args: {})
+    @patch.object(S3Upload, "put_file")
+    def test_watch_directory(self, mock_put_file):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state = TransferState(os.path.join(temp_dir, ".winearth", "state.sqlite3"))
+            self.s3_upload.state = state
+            md5 = hashlib.md5(b"File content.").hexdigest()
+            mock_put_file.return_value = ({"ETag": '"%s"' % md5}, md5)
+            stop = threading.Event()
+
+            def add_file(frame, state_name=DOWNLOADED):
+                path = os.path.join("ISS", "ISS070-E-%d.JPG" % frame)
+                os.makedirs(os.path.join(temp_dir, "ISS"), exist_ok=True)
+                with open(os.path.join(temp_dir, path), "wb") as file:
+                    file.write(b"File content.")
+                if state_name is not None:
+                    state.set_state(
+                        ("ISS070", "E", str(frame)), IMAGE, state_name, path=path
+                    )
+                return os.path.join(temp_dir, path)
+
+            # Already downloaded when the watch starts
+            add_file(1)
+
+            def poll_new_file():
+                # Reported before the downloader records it in the state database
+                return [add_file(2, None)]
+
+            def poll_recorded():
+                add_file(2)
+                return []
+
+            def poll_rejected():
+                return [add_file(3), add_file(4, DELETED)]
+
+            def poll_stop():
+                stop.set()
+                return []
+
+            steps = [poll_new_file, poll_recorded, poll_rejected, poll_stop]
+            watcher = mock.Mock()
+            watcher.poll.side_effect = lambda timeout: steps.pop(0)()
+            check = mock.Mock(side_effect=lambda row: row["frame"] != "3")
+
+            result = self.s3_upload.watch_directory(
+                self.bucket_name, temp_dir, stop, watcher, check
+            )
+
+            # The file that failed the check and the deleted file are not uploaded
+            self.assertEqual(result["uploaded"], 2)
+            self.assertEqual(
+                sorted(call.args[1] for call in mock_put_file.call_args_list),
+                [
+                    os.path.join(temp_dir, "ISS", "ISS070-E-1.JPG"),
+                    os.path.join(temp_dir, "ISS", "ISS070-E-2.JPG"),
+                ],
+            )
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(temp_dir, "ISS"))),
+                ["ISS070-E-3.JPG", "ISS070-E-4.JPG"],
+            )
+            self.assertEqual(state.get(("ISS070", "E", "2"), IMAGE)["state"], DELETED)
+            watcher.close.assert_called_once_with()
+
+            state.close()
+
+    def test_list_remote_objects(self):
+        self.stubber.add_response(
+            "list_objects_v2",
+            {
+                "Contents": [{"Key": "/tmp/a", "Size": 1, "ETag": '"etag-a"'}],
+                "IsTruncated": True,
+                "NextContinuationToken": "token",
+            },
+            {"Bucket": self.bucket_name, "Prefix": "/tmp"},
+        )
+        self.stubber.add_response(
+            "list_objects_v2",
+            {
+                "Contents": [{"Key": "/tmp/b", "Size": 2, "ETag": '"etag-b"'}],
+                "IsTruncated": False,
+            },
+            {
+                "Bucket": self.bucket_name,
+                "Prefix": "/tmp",
+                "ContinuationToken": "token",
+            },
+        )
+
+        result = self.s3_upload.list_remote_objects(self.bucket_name, "/tmp")
+
+        self.assertEqual(result, {"/tmp/a": (1, "etag-a"), "/tmp/b": (2, "etag-b")})
+
+    def test_list_remote_objects_client_error(self):
+        self.stubber.add_client_error(
+            "list_objects_v2",
+            service_error_code="AccessDenied",
+            service_message="Access Denied",
+        )
+
+        self.assertEqual(
+            self.s3_upload.list_remote_objects(self.bucket_name, "/tmp"), {}
+        )
+
+    def test_list_remote_objects_connection_error(self):
+        with patch.object(
+            self.s3.meta.client,
+            "get_paginator",
+            side_effect=botocore.exceptions.EndpointConnectionError(
+                endpoint_url="http://localhost:4566"
+            ),
+        ):
+            self.assertEqual(
+                self.s3_upload.list_remote_objects(self.bucket_name, "/tmp"), {}
+            )
+
+    @patch.object(S3Upload, "list_remote_objects", lambda *args: {})
+    @patch.object(S3Upload, "put_file")
+    def test_upload_directory_connection_error(self, mock_put_file):
+        mock_put_file.side_effect = botocore.exceptions.EndpointConnectionError(
+            endpoint_url="http://localhost:4566"
+        )
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "file.txt")
+            with open(file_path, "wb") as file:
+                file.write(b"File content.")
+
+            result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
+
+            # The file is reported as failed and kept for the next run
+            self.assertEqual(result["failed"], 1)
+            self.assertEqual(result["failed_files"], [file_path])
+            self.assertTrue(os.path.exists(file_path))
+
+    def test_directory_prefixes(self):
+        files = [
+            ("/data/ISS/16/a.JPG", None, None),
+            ("/data/ISS/16/b.JPG", None, None),
+            ("/data/ISS/16/AS16/c.JPG", None, None),
+            ("/data/ISS/17/d.JPG", None, None),
+        ]
+
+        # The nested directory is listed with the one that holds it
+        self.assertEqual(directory_prefixes(files), ["/data/ISS/16/", "/data/ISS/17/"])
+        self.assertEqual(directory_prefixes([]), [])
+
+    @patch.object(S3Upload, "put_file")
+    @patch.object(S3Upload, "list_remote_objects")
+    def test_upload_directory_lists_pending_directories(
+        self, mock_list_remote_objects, mock_put_file
+    ):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state = TransferState(os.path.join(temp_dir, "state.sqlite3"))
+            self.s3_upload.state = state
+            for directory in ("ISS/16", "ISS/17", "ISS/18"):
+                os.makedirs(os.path.join(temp_dir, directory))
+            file_path = os.path.join(temp_dir, "ISS/17", "ISS017-E-1.JPG")
+            with open(file_path, "wb") as file:
+                file.write(b"File content.")
+            state.set_state(
+                ("ISS017", "E", "1"),
+                IMAGE,
+                DOWNLOADED,
+                path=os.path.join("ISS/17", "ISS017-E-1.JPG"),
+            )
+            # Uploaded and removed by an earlier run
+            state.set_state(
+                ("ISS016", "E", "1"),
+                IMAGE,
+                DELETED,
+                path=os.path.join("ISS/16", "ISS016-E-1.JPG"),
+            )
+            md5 = hashlib.md5(b"File content.").hexdigest()
+            mock_list_remote_objects.return_value = {}
+            mock_put_file.return_value = ({"ETag": '"%s"' % md5}, md5)
+
+            result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
+            state.close()
+
+        # Only the directory of the pending file is listed, not the whole tree
+        mock_list_remote_objects.assert_called_once_with(
+            self.bucket_name, os.path.join(temp_dir, "ISS/17", "")
+        )
+        self.assertEqual(result["uploaded"], 1)
+
+    @patch.object(S3Upload, "put_file")
+    @patch.object(S3Upload, "list_remote_objects")
+    def test_upload_directory_skip_existing(
+        self, mock_list_remote_objects, mock_put_file
+    ):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_paths = []
+            for i in range(3):
+                file_path = os.path.join(temp_dir, f"file_{i}.txt")
+                with open(file_path, "wb") as file:
+                    file.write(b"File %d content." % i)
+                file_paths.append(file_path)
+
+            md5 = hashlib.md5(b"File 2 content.").hexdigest()
+            mock_list_remote_objects.return_value = {
+                # Same size and ETag, already uploaded
+                file_paths[0]: (15, hashlib.md5(b"File 0 content.").hexdigest()),
+                # Same size, different ETag
+                file_paths[1]: (15, "other_etag"),
+            }
+            mock_put_file.return_value = ({"ETag": '"%s"' % md5}, md5)
+
+            result = self.s3_upload.upload_directory(self.bucket_name, temp_dir)
+
+            self.assertEqual(os.listdir(temp_dir), [])
+
+        self.assertEqual(result["skipped"], 1)
+        self.assertEqual(result["uploaded"], 2)
+        self.assertEqual(result["failed"], 0)
+        # Only the files that are missing or different in the bucket are uploaded
+        self.assertEqual(
+            sorted(call.args[1] for call in mock_put_file.call_args_list),
+            file_paths[1:],
+        )
@@ -1,44 +1,115 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 from mock import patch
 import mock
 import winearth_copy.shell
 from winearth_copy.winearth_download import WinEarthDownload
 from winearth_copy.s3_upload import S3Upload
+from winearth_copy.backfill import Backfill
+from winearth_copy.sync import WinEarthSync
+from winearth_copy.daemon import Daemon
+from winearth_copy.state import TransferState
 
 
 class TestShell(unittest.TestCase):
 
-    @patch.object(WinEarthDownload, "download_images")
-    @patch.object(WinEarthDownload, "save_metadata")
-    @patch.object(WinEarthDownload, "list_images")
+    def test_lazy_imports(self):
+        # Importing the entry points must not load the transfer dependencies
+        modules = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import json, sys, winearth_copy; print(json.dumps(list(sys.modules)))",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+
+        loaded = set(json.loads(modules))
+        for module in ("boto3", "requests", "aiohttp", "urllib3", "PIL"):
+            self.assertNotIn(module, loaded)
+
+    @patch.object(WinEarthDownload, "process_images")
     @patch("winearth_copy.read_configuration.read_configuration")
     @patch("winearth_copy.arguments.parse_arguments")
     def test_download(
         self,
         mock_parse_arguments,
         mock_read_configuration,
-        mock_list_images,
-        mock_save_metadata,
-        mock_download_images,
+        mock_process_images,
     ):
 
         # Test the download function where everything works
         mock_parse_arguments.return_value = mock.Mock(
-            query_date="20240101", configuration_file="config.yml"
+            query_date="20240101",
+            configuration_file="config.yml",
+            profile=None,
+            download_concurrency=None,
+            start_date=None,
         )
-        mock_read_configuration.configuration_file = {}
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        mock_read_configuration.return_value = {
+            "gape_api_key": "mock",
+            "path": temp_dir.name,
+            "download_concurrency": 4,
+            "download_retries": 5,
+            "connect_timeout": 10,
+            "read_timeout": 60,
+            "image_deadline": 600,
+            "hedge_requests": False,
+            "state_database": "",
+            "validate_images": True,
+            "decode_images": False,
+            "validate_concurrency": 4,
+            "metrics_directory": "",
+            "prometheus_textfile_directory": "",
+            "daemon_interval": 900,
+            "daemon_window_days": 2,
+            "daemon_listen_address": "127.0.0.1",
+            "daemon_port": 9337,
+            "watch_interval": 5,
+            "engine": "threads",
+            "metadata_format": "json",
+            "adaptive_concurrency": False,
+            "max_concurrency": 32,
+            "download_bandwidth": 0,
+            "upload_bandwidth": 0,
+        }
 
-        mock_list_images.return_value = []
+        mock_process_images.return_value = {
+            "images": 0,
+            "metadata": 0,
+            "downloaded": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "result": None,
+        }
 
         result = winearth_copy.shell.download()
 
         self.assertEqual(result, 0)
+        # The run summary is written next to the state database
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(temp_dir.name, ".winearth", "metrics-download.json")
+            )
+        )
 
         # Test the download function where results is returned but no error
-        mock_list_images.return_value = {"result": "mock"}
-
-        mock_save_metadata.return_value = 1
-        mock_download_images.return_value = 1
+        mock_process_images.return_value = {
+            "images": 1,
+            "metadata": 1,
+            "downloaded": 1,
+            "timeouts": 0,
+            "hedges": 0,
+            "result": "mock",
+        }
 
         result = winearth_copy.shell.download()
 
@@ -46,7 +117,11 @@ class TestShell(unittest.TestCase):
 
         # Test the download function when no date is provided
         mock_parse_arguments.return_value = mock.Mock(
-            query_date=None, configuration_file="config.yml"
+            query_date=None,
+            configuration_file="config.yml",
+            profile=None,
+            download_concurrency=2,
+            start_date=None,
         )
 
         result = winearth_copy.shell.download()
@@ -54,7 +129,7 @@ class TestShell(unittest.TestCase):
         self.assertEqual(result, 0)
 
         # Test the download function when the API failes to retrieve images
-        mock_list_images.return_value = None
+        mock_process_images.return_value = None
 
         result = winearth_copy.shell.download()
 
@@ -62,16 +137,158 @@ class TestShell(unittest.TestCase):
 
         # Test the download function when no images are found
         mock_parse_arguments.return_value = mock.Mock(
-            query_date="20240101", configuration_file="config.yml"
+            query_date="20240101",
+            configuration_file="config.yml",
+            profile=None,
+            download_concurrency=None,
+            start_date=None,
         )
-        mock_list_images.return_value = {
-            "result": "SQL found no records that match the specified criteria"
+        mock_process_images.return_value = {
+            "images": 0,
+            "metadata": 0,
+            "downloaded": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "result": "SQL found no records that match the specified criteria",
         }
 
         result = winearth_copy.shell.download()
 
         self.assertEqual(result, "No images found for 20240101.")
 
+    @patch("winearth_copy.async_engine.run")
+    @patch("winearth_copy.async_engine.AsyncWinEarthDownload")
+    @patch("winearth_copy.async_engine.available", return_value=True)
+    @patch("winearth_copy.read_configuration.read_configuration")
+    @patch("winearth_copy.arguments.parse_arguments")
+    def test_download_asyncio_adaptive(
+        self,
+        mock_parse_arguments,
+        mock_read_configuration,
+        mock_available,
+        mock_async_download,
+        mock_run,
+    ):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        mock_parse_arguments.return_value = mock.Mock(
+            query_date="20240101",
+            configuration_file="config.yml",
+            profile=None,
+            download_concurrency=None,
+            start_date=None,
+        )
+        mock_read_configuration.return_value = {
+            "gape_api_key": "mock",
+            "path": temp_dir.name,
+            "download_concurrency": 4,
+            "download_retries": 5,
+            "connect_timeout": 10,
+            "read_timeout": 60,
+            "image_deadline": 600,
+            "hedge_requests": False,
+            "state_database": "",
+            "validate_images": False,
+            "decode_images": False,
+            "validate_concurrency": 4,
+            "metrics_directory": "",
+            "prometheus_textfile_directory": "",
+            "watch_interval": 5,
+            "engine": "asyncio",
+            "metadata_format": "json",
+            "adaptive_concurrency": True,
+            "max_concurrency": 32,
+            "download_bandwidth": 0,
+            "upload_bandwidth": 0,
+        }
+        mock_run.return_value = {
+            "images": 1,
+            "metadata": 1,
+            "downloaded": 1,
+            "timeouts": 0,
+            "hedges": 0,
+            "result": None,
+        }
+
+        self.assertEqual(winearth_copy.shell.download(), 0)
+
+        # The asyncio engine has no limiter, so it keeps download_concurrency
+        self.assertEqual(mock_async_download.call_args[0][2], 4)
+
+    @patch.object(Backfill, "run")
+    @patch("winearth_copy.read_configuration.read_configuration")
+    @patch("winearth_copy.arguments.parse_arguments")
+    def test_download_backfill(
+        self, mock_parse_arguments, mock_read_configuration, mock_run
+    ):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        mock_parse_arguments.return_value = mock.Mock(
+            query_date=None,
+            configuration_file="config.yml",
+            profile=None,
+            download_concurrency=None,
+            start_date="20240101",
+            end_date="20240103",
+        )
+        mock_read_configuration.return_value = {
+            "gape_api_key": "mock",
+            "path": temp_dir.name,
+            "download_concurrency": 4,
+            "download_retries": 5,
+            "connect_timeout": 10,
+            "read_timeout": 60,
+            "image_deadline": 600,
+            "hedge_requests": False,
+            "backfill_day_concurrency": 2,
+            "state_database": "",
+            "validate_images": True,
+            "decode_images": False,
+            "validate_concurrency": 4,
+            "metrics_directory": "",
+            "prometheus_textfile_directory": "",
+            "daemon_interval": 900,
+            "daemon_window_days": 2,
+            "daemon_listen_address": "127.0.0.1",
+            "daemon_port": 9337,
+            "watch_interval": 5,
+            "metadata_format": "json",
+            "adaptive_concurrency": False,
+            "max_concurrency": 32,
+            "download_bandwidth": 0,
+            "upload_bandwidth": 0,
+        }
+
+        mock_run.return_value = {
+            "days": 3,
+            "skipped_days": 0,
+            "incomplete_days": [],
+            "metadata": 1,
+            "downloaded": 1,
+            "timeouts": 0,
+            "hedges": 0,
+        }
+
+        result = winearth_copy.shell.download()
+
+        self.assertEqual(result, 0)
+        mock_run.assert_called_with("20240101", "20240103")
+
+        # Test the backfill when some days are incomplete
+        mock_run.return_value = {
+            "days": 3,
+            "skipped_days": 0,
+            "incomplete_days": ["20240102", "20240103"],
+            "metadata": 1,
+            "downloaded": 1,
+            "timeouts": 0,
+            "hedges": 0,
+        }
+
+        result = winearth_copy.shell.download()
+
+        self.assertEqual(result, "Incomplete days: 20240102, 20240103")
+
     @patch.object(S3Upload, "upload_directory")
     @patch("boto3.resource")
     @patch("winearth_copy.read_configuration.read_configuration")
@@ -85,18 +302,238 @@ class TestShell(unittest.TestCase):
     ):
 
         # Test the upload function where everything works
-        mock_parse_arguments.return_value = mock.Mock(configuration_file="config.yml")
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        mock_parse_arguments.return_value = mock.Mock(
+            configuration_file="config.yml",
+            upload_concurrency=None,
+            watch=False,
+            rescan=False,
+            profile=None,
+        )
         mock_read_configuration.return_value = {
             "aws_access_key_id": "mock",
             "aws_secret_access_key": "mock",
             "s3_host": "mock",
             "addressing_style": "auto",
             "bucket_name": "mock",
-            "path": "mock",
+            "path": temp_dir.name,
+            "upload_concurrency": 4,
+            "multipart_threshold": 67108864,
+            "multipart_chunksize": 16777216,
+            "multipart_concurrency": 4,
+            "read_buffer_size": 1048576,
+            "state_database": "",
+            "validate_images": True,
+            "decode_images": False,
+            "validate_concurrency": 4,
+            "metrics_directory": "",
+            "prometheus_textfile_directory": "",
+            "daemon_interval": 900,
+            "daemon_window_days": 2,
+            "daemon_listen_address": "127.0.0.1",
+            "daemon_port": 9337,
+            "watch_interval": 5,
+            "engine": "threads",
+            "metadata_format": "json",
+            "adaptive_concurrency": False,
+            "max_concurrency": 32,
+            "download_bandwidth": 0,
+            "upload_bandwidth": 0,
         }
 
-        mock_upload_directory.return_value = 0
+        mock_upload_directory.return_value = {
+            "uploaded": 1,
+            "skipped": 0,
+            "failed": 0,
+            "failed_files": [],
+            "requests": 1,
+            "requests_per_file": 1.0,
+        }
 
         result = winearth_copy.shell.upload()
 
         self.assertEqual(result, 0)
+
+        # Test the upload function when some files fail to upload
+        mock_upload_directory.return_value = {
+            "uploaded": 1,
+            "skipped": 0,
+            "failed": 2,
+            "failed_files": ["mock/a", "mock/b"],
+            "requests": 3,
+            "requests_per_file": 1.0,
+        }
+
+        result = winearth_copy.shell.upload()
+
+        self.assertEqual(result, "Failed to upload 2 files.")
+
+        # Test the upload function with --profile
+        profile_dir = os.path.join(temp_dir.name, "profile")
+        mock_parse_arguments.return_value = mock.Mock(
+            configuration_file="config.yml",
+            upload_concurrency=None,
+            watch=False,
+            rescan=False,
+            profile=profile_dir,
+        )
+
+        winearth_copy.shell.upload()
+
+        self.assertEqual(
+            sorted(os.listdir(profile_dir)),
+            ["upload-phases.json", "upload-profile.txt", "upload.prof"],
+        )
+
+        # Test the upload function with --watch
+        mock_parse_arguments.return_value = mock.Mock(
+            configuration_file="config.yml",
+            upload_concurrency=None,
+            watch=True,
+            rescan=False,
+            profile=None,
+        )
+        with patch.object(S3Upload, "watch_directory") as mock_watch_directory:
+            mock_watch_directory.return_value = mock_upload_directory.return_value
+
+            result = winearth_copy.shell.upload()
+
+        self.assertEqual(result, "Failed to upload 2 files.")
+        bucket_name, path, stop = mock_watch_directory.call_args.args
+        self.assertEqual((bucket_name, path), ("mock", temp_dir.name))
+        self.assertFalse(stop.is_set())
+        self.assertEqual(mock_watch_directory.call_args.kwargs["interval"], 5)
+
+        # Test the upload function with --rescan, which adds files the state
+        # database does not know about
+        mock_parse_arguments.return_value = mock.Mock(
+            configuration_file="config.yml",
+            upload_concurrency=None,
+            watch=False,
+            rescan=True,
+            profile=None,
+        )
+        with open(os.path.join(temp_dir.name, "ISS070-E-1.json"), "wb") as f:
+            f.write(b"File content.")
+
+        winearth_copy.shell.upload()
+
+        state = TransferState(os.path.join(temp_dir.name, ".winearth", "state.sqlite3"))
+        self.addCleanup(state.close)
+        self.assertEqual(state.get_path("ISS070-E-1.json")["state"], "downloaded")
+
+    @patch.object(WinEarthSync, "process_images")
+    @patch("boto3.resource")
+    @patch("winearth_copy.read_configuration.read_configuration")
+    @patch("winearth_copy.arguments.parse_arguments")
+    def test_sync(
+        self,
+        mock_parse_arguments,
+        mock_read_configuration,
+        mock_boto,
+        mock_process_images,
+    ):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        mock_parse_arguments.return_value = mock.Mock(
+            query_date="20240101",
+            configuration_file="config.yml",
+            profile=None,
+            download_concurrency=None,
+        )
+        mock_read_configuration.return_value = {
+            "gape_api_key": "mock",
+            "aws_access_key_id": "mock",
+            "aws_secret_access_key": "mock",
+            "s3_host": "mock",
+            "addressing_style": "auto",
+            "bucket_name": "mock",
+            "path": temp_dir.name,
+            "download_concurrency": 4,
+            "download_retries": 5,
+            "connect_timeout": 10,
+            "read_timeout": 60,
+            "image_deadline": 600,
+            "hedge_requests": False,
+            "multipart_threshold": 67108864,
+            "multipart_chunksize": 16777216,
+            "multipart_concurrency": 4,
+            "read_buffer_size": 1048576,
+            "state_database": "",
+            "validate_images": True,
+            "decode_images": False,
+            "validate_concurrency": 4,
+            "metrics_directory": "",
+            "prometheus_textfile_directory": "",
+            "daemon_interval": 900,
+            "daemon_window_days": 2,
+            "daemon_listen_address": "127.0.0.1",
+            "daemon_port": 9337,
+            "watch_interval": 5,
+            "metadata_format": "json",
+            "adaptive_concurrency": False,
+            "max_concurrency": 32,
+            "download_bandwidth": 0,
+            "upload_bandwidth": 0,
+        }
+
+        mock_process_images.return_value = {
+            "images": 1,
+            "metadata": 1,
+            "downloaded": 1,
+            "timeouts": 0,
+            "hedges": 0,
+            "result": None,
+        }
+
+        result = winearth_copy.shell.sync()
+
+        self.assertEqual(result, 0)
+
+        # Test the sync function when the API fails to retrieve images
+        mock_process_images.return_value = None
+
+        result = winearth_copy.shell.sync()
+
+        self.assertEqual(result, "Failed to retrieve images from GAPE API.")
+
+        # Test the sync function when no images are found
+        mock_process_images.return_value = {
+            "images": 0,
+            "metadata": 0,
+            "downloaded": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "result": "SQL found no records that match the specified criteria",
+        }
+
+        result = winearth_copy.shell.sync()
+
+        self.assertEqual(result, "No images found for 20240101.")
+
+    @patch.object(Daemon, "run")
+    @patch("winearth_copy.arguments.parse_arguments")
+    def test_daemon(self, mock_parse_arguments, mock_run):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        configuration_file = os.path.join(temp_dir.name, "config.json")
+        with open(configuration_file, "w") as f:
+            json.dump({"path": temp_dir.name, "daemon_port": 0}, f)
+        mock_parse_arguments.return_value = mock.Mock(
+            configuration_file=configuration_file,
+            download_concurrency=None,
+            upload_concurrency=None,
+            profile=None,
+        )
+        mock_run.return_value = 2
+
+        result = winearth_copy.shell.daemon()
+
+        self.assertEqual(result, 0)
+        mock_run.assert_called_once_with()
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(temp_dir.name, ".winearth", "metrics-daemon.json")
+            )
+        )
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from winearth_copy.state import (
+    DELETED,
+    DOWNLOADED,
+    IMAGE,
+    METADATA,
+    METADATA_LINES,
+    UPLOADED,
+    TransferState,
+    filename_key,
+    record_key,
+)
+
+
+class TestTransferState(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.state = TransferState(
+            os.path.join(self.temp_dir.name, ".winearth", "state.sqlite3")
+        )
+        self.key = ("ISS070", "E", "12345")
+
+    def tearDown(self):
+        self.state.close()
+        self.temp_dir.cleanup()
+
+    def test_record_key(self):
+        self.assertEqual(
+            record_key(
+                {
+                    "nadir.mission": "ISS070",
+                    "nadir.roll": "E",
+                    "nadir.frame": 12345,
+                    "images.filename": "other.JPG",
+                }
+            ),
+            ("ISS070", "E", "12345"),
+        )
+        self.assertEqual(
+            record_key({"images.filename": "ISS070-E-12345.JPG"}),
+            ("ISS070", "E", "12345"),
+        )
+
+    def test_filename_key(self):
+        self.assertEqual(filename_key("ISS070-E-12345.json"), ("ISS070", "E", "12345"))
+        self.assertEqual(filename_key("AS16-12345.JPG"), ("AS16", "", "12345"))
+        self.assertEqual(filename_key("file.txt"), ("file", "", ""))
+
+    def test_set_state(self):
+        self.assertIsNone(self.state.get(self.key, IMAGE))
+
+        self.state.set_state(
+            self.key, IMAGE, DOWNLOADED, path="ISS/file.JPG", size=10, md5="fake_md5"
+        )
+        self.state.set_state(self.key, IMAGE, UPLOADED)
+
+        row = self.state.get(self.key, IMAGE)
+        self.assertEqual(row["state"], UPLOADED)
+        # Fields that are not given keep their value
+        self.assertEqual(row["path"], "ISS/file.JPG")
+        self.assertEqual(row["md5"], "fake_md5")
+
+        # The metadata file of the same image is tracked separately
+        self.assertIsNone(self.state.get(self.key, METADATA))
+
+    def test_pending(self):
+        self.state.set_state(self.key, IMAGE, DOWNLOADED, path="b.JPG")
+        self.state.set_state(self.key, METADATA, DELETED, path="b.json")
+        self.state.set_state(("ISS070", "E", "1"), IMAGE, UPLOADED, path="a.JPG")
+
+        rows = self.state.pending([DOWNLOADED, UPLOADED])
+        self.assertEqual([row["path"] for row in rows], ["a.JPG", "b.JPG"])
+        self.assertEqual(self.state.count(), 3)
+
+    def test_import_directory(self):
+        os.makedirs(os.path.join(self.temp_dir.name, "ISS"))
+        for file_name in [
+            "ISS070-E-1.JPG",
+            "ISS070-E-1.json",
+            ".ISS070-E-2.JPG.tmp",
+            "metadata-20240101.jsonl",
+        ]:
+            with open(os.path.join(self.temp_dir.name, "ISS", file_name), "w") as f:
+                f.write("data")
+
+        # Files with the same name in different directories
+        for directory in ["a", "b"]:
+            os.makedirs(os.path.join(self.temp_dir.name, directory))
+            with open(os.path.join(self.temp_dir.name, directory, "img.png"), "w") as f:
+                f.write("data")
+
+        self.assertEqual(self.state.import_directory(self.temp_dir.name), 5)
+        self.assertEqual(self.state.count(), 5)
+
+        row = self.state.get_path(os.path.join("ISS", "ISS070-E-1.json"))
+        self.assertEqual(row["kind"], METADATA)
+        self.assertEqual(row["state"], DOWNLOADED)
+        self.assertEqual(
+            self.state.get_path(os.path.join("b", "img.png"))["kind"], IMAGE
+        )
+
+        row = self.state.get(("ISS", "", "20240101"), METADATA_LINES)
+        self.assertEqual(row["path"], os.path.join("ISS", "metadata-20240101.jsonl"))
+
+        # Only the files the database does not know about are added on later runs
+        self.state.set_state((os.path.join("a", "img.png"), "", ""), IMAGE, UPLOADED)
+        with open(os.path.join(self.temp_dir.name, "ISS", "ISS070-E-3.JPG"), "w") as f:
+            f.write("data")
+
+        self.assertEqual(self.state.import_directory(self.temp_dir.name), 1)
+        self.assertEqual(self.state.count(), 6)
+        self.assertEqual(
+            self.state.get_path(os.path.join("a", "img.png"))["state"], UPLOADED
+        )
+
+    def test_get_path(self):
+        self.assertIsNone(self.state.get_path(os.path.join("ISS", "ISS070-E-1.JPG")))
+
+        row = self.state.import_file(os.path.join("ISS", "ISS070-E-1.JPG"))
+        self.assertEqual(row["state"], DOWNLOADED)
+        self.assertEqual(row["kind"], IMAGE)
+        self.assertEqual(
+            self.state.get_path(os.path.join("ISS", "ISS070-E-1.JPG")), row
+        )
+
+    def test_reopen(self):
+        self.state.set_state(self.key, IMAGE, DOWNLOADED, path="file.JPG")
+        self.state.close()
+
+        self.state = TransferState(self.state.database)
+        self.assertEqual(self.state.get(self.key, IMAGE)["state"], DOWNLOADED)
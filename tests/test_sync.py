@@ -0,0 +1,238 @@
+import botocore.exceptions
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+import mock
+import requests_mock
+from winearth_copy.metrics import Metrics
+from winearth_copy.state import (
+    DELETED,
+    IMAGE,
+    METADATA,
+    METADATA_LINES,
+    TransferState,
+)
+from winearth_copy.sync import WinEarthSync
+
+
+def image_body(filename):
+    # A body with the JPEG start and end of image markers
+    return b"\xff\xd8\xff image " + filename.encode() + b" \xff\xd9"
+
+
+class TestWinEarthSync(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, "data")
+
+        self.state = TransferState(os.path.join(self.temp_dir.name, "state.sqlite3"))
+        self.addCleanup(self.state.close)
+
+        # Record what is sent to S3 instead of uploading it
+        self.uploads = {}
+        self.uploads_lock = threading.Lock()
+        self.s3 = mock.Mock()
+        self.s3.upload_stream.side_effect = self.upload_stream
+        self.s3.metrics = Metrics()
+
+        self.sync = WinEarthSync(
+            "20240508", "fake_api_key", self.s3, "test-bucket", 2, state=self.state
+        )
+        self.addCleanup(self.sync.close)
+
+        self.mocked_json_data = [
+            {
+                "images.directory": "ISS/16/AS16",
+                "images.filename": "AS16-12345.JPG",
+                "nadir.mission": "AS16",
+                "nadir.roll": "",
+                "nadir.frame": "12345",
+            },
+            {
+                "images.directory": "ISS/16/AS16",
+                "images.filename": "AS16-12346.JPG",
+                "nadir.mission": "AS16",
+                "nadir.roll": "",
+                "nadir.frame": "12346",
+            },
+        ]
+
+    def upload_stream(self, bucket_name, object, chunks, size=None):
+        data = b"".join(chunks)
+        md5 = hashlib.md5(data).hexdigest()
+        with self.uploads_lock:
+            self.uploads[object] = data
+
+        return {"ETag": '"%s"' % md5}, md5, md5
+
+    def mock_listing(self, mock):
+        mock.get(self.sync.api_url, json=self.mocked_json_data)
+        for image_data in self.mocked_json_data:
+            mock.get(
+                self.sync.base_download_url
+                + image_data["images.directory"]
+                + "/"
+                + image_data["images.filename"],
+                content=image_body(image_data["images.filename"]),
+            )
+
+    @requests_mock.Mocker()
+    def test_process_images(self, mock):
+        self.mock_listing(mock)
+
+        summary = self.sync.process_images(self.path)
+
+        self.assertEqual(
+            summary,
+            {
+                "images": 2,
+                "metadata": 2,
+                "downloaded": 2,
+                "timeouts": 0,
+                "hedges": 0,
+                "result": None,
+            },
+        )
+
+        # Nothing is written to disk
+        self.assertFalse(os.path.exists(self.path))
+
+        # Objects are named like the files winearth-upload would send
+        object = self.path + "/ISS/16/AS16/AS16-12345.JPG"
+        self.assertEqual(self.uploads[object], image_body("AS16-12345.JPG"))
+        self.assertIn(self.path + "/ISS/16/AS16/AS16-12345.json", self.uploads)
+        self.assertEqual(len(self.uploads), 4)
+
+        row = self.state.get(("AS16", "", "12345"), IMAGE)
+        self.assertEqual(row["state"], DELETED)
+        self.assertEqual(row["path"], "ISS/16/AS16/AS16-12345.JPG")
+        self.assertEqual(
+            row["md5"], hashlib.md5(image_body("AS16-12345.JPG")).hexdigest()
+        )
+        self.assertEqual(
+            self.state.get(("AS16", "", "12346"), METADATA)["state"], DELETED
+        )
+
+        # A second run copies nothing again
+        self.uploads.clear()
+        summary = self.sync.process_images(self.path)
+
+        self.assertEqual(summary["downloaded"], 0)
+        self.assertEqual(summary["metadata"], 0)
+        self.assertEqual(self.uploads, {})
+
+    @requests_mock.Mocker()
+    def test_process_images_trailing_slash(self, mock):
+        self.mock_listing(mock)
+
+        self.sync.process_images(self.path + "/")
+
+        # A trailing slash on the path does not add an empty part to the names
+        self.assertEqual(
+            sorted(self.uploads),
+            [
+                self.path + "/ISS/16/AS16/AS16-12345.JPG",
+                self.path + "/ISS/16/AS16/AS16-12345.json",
+                self.path + "/ISS/16/AS16/AS16-12346.JPG",
+                self.path + "/ISS/16/AS16/AS16-12346.json",
+            ],
+        )
+
+    @requests_mock.Mocker()
+    def test_process_images_metadata_lines(self, mock):
+        self.mock_listing(mock)
+        self.sync = WinEarthSync(
+            "20240508",
+            "fake_api_key",
+            self.s3,
+            "test-bucket",
+            2,
+            state=self.state,
+            metadata_format="jsonl",
+        )
+        self.addCleanup(self.sync.close)
+
+        summary = self.sync.process_images(self.path)
+
+        self.assertEqual(summary["metadata"], 1)
+        object = self.path + "/ISS/16/AS16/metadata-20240508.jsonl"
+        self.assertEqual(len(self.uploads[object].splitlines()), 2)
+        self.assertEqual(len(self.uploads), 3)
+        self.assertEqual(
+            self.state.get(("ISS/16/AS16", "", "20240508"), METADATA_LINES)["state"],
+            DELETED,
+        )
+
+        # An object with the same content is not uploaded again
+        self.uploads.clear()
+        self.assertEqual(self.sync.save_metadata_lines(self.path), 0)
+        self.assertEqual(self.uploads, {})
+
+    @requests_mock.Mocker()
+    def test_process_images_etag_mismatch(self, mock):
+        self.mock_listing(mock)
+        self.s3.upload_stream.side_effect = lambda bucket, object, chunks, size: (
+            {"ETag": '"bad"'},
+            "good",
+            "good",
+        )
+
+        summary = self.sync.process_images(self.path)
+
+        self.assertEqual(summary["downloaded"], 0)
+        self.assertEqual(self.sync.counts["failed"], 2)
+        self.assertIsNone(self.state.get(("AS16", "", "12345"), IMAGE))
+
+    @requests_mock.Mocker()
+    def test_process_images_connection_error(self, mock):
+        self.mock_listing(mock)
+        self.s3.upload_stream.side_effect = botocore.exceptions.EndpointConnectionError(
+            endpoint_url="http://localhost:4566"
+        )
+
+        summary = self.sync.process_images(self.path)
+
+        # Every image and metadata file is counted as failed and nothing is recorded
+        self.assertEqual(summary["downloaded"], 0)
+        self.assertEqual(summary["metadata"], 0)
+        self.assertEqual(self.sync.counts["failed"], 4)
+        self.assertIsNone(self.state.get(("AS16", "", "12345"), IMAGE))
+        self.assertIsNone(self.state.get(("AS16", "", "12345"), METADATA))
+
+    @requests_mock.Mocker()
+    def test_fetch_image_http_error(self, mock):
+        image_data = self.mocked_json_data[0]
+        mock.get(
+            self.sync.base_download_url + "ISS/16/AS16/AS16-12345.JPG", status_code=404
+        )
+
+        self.assertFalse(self.sync.fetch_image(image_data, self.path))
+        self.s3.upload_stream.assert_not_called()
+        self.assertIsNone(self.state.get(("AS16", "", "12345"), IMAGE))
+
+    @requests_mock.Mocker()
+    def test_fetch_image_not_jpeg(self, mock):
+        image_data = self.mocked_json_data[0]
+        url = self.sync.base_download_url + "ISS/16/AS16/AS16-12345.JPG"
+        mock.get(url, content=b"<html>Service Unavailable</html>")
+
+        # An error page is not committed to the bucket
+        self.assertFalse(self.sync.fetch_image(image_data, self.path))
+        self.assertEqual(self.uploads, {})
+        self.assertIsNone(self.state.get(("AS16", "", "12345"), IMAGE))
+
+        # Nor is an image that was cut short
+        mock.get(url, content=image_body("AS16-12345.JPG")[:-2])
+        self.assertFalse(self.sync.fetch_image(image_data, self.path))
+        self.assertEqual(self.uploads, {})
+
+        # Unless validation is turned off
+        self.sync.validate = False
+        self.assertTrue(self.sync.fetch_image(image_data, self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+import os
+import tempfile
+import unittest
+from winearth_copy.state import (
+    COMPLETE,
+    DOWNLOADED,
+    IMAGE,
+    METADATA,
+    QUARANTINED,
+    STARTED,
+    VERIFIED,
+    TransferState,
+    filename_key,
+)
+from winearth_copy.validate import (
+    QUARANTINE_DIRECTORY,
+    ImageValidator,
+    check_image,
+    check_jpeg_stream,
+    decode_available,
+)
+from winearth_copy.winearth_download import WinEarthDownload
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 100 + b"\xff\xd9"
+
+
+class TestValidate(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = self.temp_dir.name
+        self.state = TransferState(
+            os.path.join(self.path, ".winearth", "state.sqlite3")
+        )
+
+    def tearDown(self):
+        self.state.close()
+        self.temp_dir.cleanup()
+
+    def write_image(self, name, data, size=None, query_date="20240101"):
+        os.makedirs(os.path.join(self.path, "ISS"), exist_ok=True)
+        with open(os.path.join(self.path, "ISS", name), "wb") as f:
+            f.write(data)
+
+        self.state.set_state(
+            filename_key(name),
+            IMAGE,
+            DOWNLOADED,
+            path=os.path.join("ISS", name),
+            query_date=query_date,
+            size=len(data) if size is None else size,
+        )
+
+    def test_check_image(self):
+        file_path = os.path.join(self.path, "image.JPG")
+
+        with open(file_path, "wb") as f:
+            f.write(JPEG)
+        self.assertIsNone(check_image(file_path, len(JPEG)))
+
+        # Padding after the end of image marker is allowed
+        with open(file_path, "wb") as f:
+            f.write(JPEG + b"\x00" * 10)
+        self.assertIsNone(check_image(file_path))
+
+        # A size that does not match the download
+        self.assertIn("size", check_image(file_path, len(JPEG)))
+
+        # A truncated image
+        with open(file_path, "wb") as f:
+            f.write(JPEG[:50])
+        self.assertIn("end of image", check_image(file_path))
+
+        # An error page saved as an image
+        with open(file_path, "wb") as f:
+            f.write(b"<html><body>Service Unavailable</body></html>")
+        self.assertIn("start of image", check_image(file_path))
+
+        # A missing file
+        self.assertIsNotNone(check_image(os.path.join(self.path, "missing.JPG")))
+
+    def test_check_jpeg_stream(self):
+        chunks = [JPEG[i : i + 1] for i in range(len(JPEG))]
+        self.assertEqual(b"".join(check_jpeg_stream(chunks)), JPEG)
+        self.assertEqual(
+            b"".join(check_jpeg_stream([JPEG + b"\x00" * 10])), JPEG + b"\x00" * 10
+        )
+
+        # The last piece of a truncated image is held back
+        received = []
+        with self.assertRaisesRegex(ValueError, "end of image"):
+            for chunk in check_jpeg_stream([JPEG[:50], JPEG[50:100]]):
+                received.append(chunk)
+        self.assertEqual(received, [JPEG[:50]])
+
+        # An error page fails as soon as its first bytes arrive
+        with self.assertRaisesRegex(ValueError, "start of image"):
+            next(check_jpeg_stream([b"<", b"html>", JPEG]))
+        with self.assertRaisesRegex(ValueError, "start of image"):
+            list(check_jpeg_stream([b"\xff"]))
+
+    @unittest.skipUnless(decode_available(), "Pillow is not installed")
+    def test_check_image_decode(self):
+        # The markers are intact but the image data is not
+        file_path = os.path.join(self.path, "image.JPG")
+        with open(file_path, "wb") as f:
+            f.write(JPEG)
+
+        self.assertIsNone(check_image(file_path))
+        self.assertIn("decode", check_image(file_path, decode=True))
+
+    def test_validate(self):
+        self.write_image("ISS070-E-1.JPG", JPEG)
+        self.write_image("ISS070-E-2.JPG", JPEG[:50])
+        self.write_image("ISS070-E-3.JPG", JPEG, size=len(JPEG) + 1)
+        self.state.set_day("20240101", COMPLETE, 3)
+        self.state.set_state(
+            ("ISS070", "E", "1"), METADATA, DOWNLOADED, path="ISS/ISS070-E-1.json"
+        )
+
+        summary = ImageValidator(self.path, self.state, 2).validate()
+
+        self.assertEqual(summary["verified"], 1)
+        self.assertEqual(summary["quarantined"], 2)
+        self.assertEqual(
+            sorted(summary["quarantined_files"]),
+            ["ISS/ISS070-E-2.JPG", "ISS/ISS070-E-3.JPG"],
+        )
+
+        self.assertEqual(self.state.get(("ISS070", "E", "1"), IMAGE)["state"], VERIFIED)
+        self.assertEqual(
+            self.state.get(("ISS070", "E", "2"), IMAGE)["state"], QUARANTINED
+        )
+        # Metadata files are not checked
+        self.assertEqual(
+            self.state.get(("ISS070", "E", "1"), METADATA)["state"], DOWNLOADED
+        )
+
+        # Bad images are moved out of the download path and their day is run again
+        self.assertEqual(os.listdir(os.path.join(self.path, "ISS")), ["ISS070-E-1.JPG"])
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(self.path, QUARANTINE_DIRECTORY, "ISS", "ISS070-E-2.JPG")
+            )
+        )
+        self.assertEqual(self.state.get_day("20240101")["state"], STARTED)
+
+        # Files that are not JPEG images are never checked
+        self.write_image("scan.tif", b"II*\x00" + b"\x00" * 100)
+        self.write_image("notes.txt", b"Some notes.")
+
+        summary = ImageValidator(self.path, self.state).validate()
+
+        self.assertEqual(summary["quarantined"], 0)
+        self.assertEqual(
+            self.state.get(filename_key("scan.tif"), IMAGE)["state"], DOWNLOADED
+        )
+        self.assertTrue(os.path.exists(os.path.join(self.path, "ISS", "notes.txt")))
+
+        # Verified images are not checked again
+        summary = ImageValidator(self.path, self.state).validate()
+        self.assertEqual(summary["verified"], 0)
+        self.assertEqual(summary["quarantined"], 0)
+
+    def test_validate_row(self):
+        self.write_image("ISS070-E-1.JPG", JPEG)
+        self.write_image("ISS070-E-2.JPG", JPEG[:50])
+        validator = ImageValidator(self.path, self.state)
+
+        good = self.state.get(filename_key("ISS070-E-1.JPG"), IMAGE)
+        bad = self.state.get(filename_key("ISS070-E-2.JPG"), IMAGE)
+
+        self.assertTrue(validator.validate_row(good))
+        self.assertEqual(
+            self.state.get(filename_key("ISS070-E-1.JPG"), IMAGE)["state"], VERIFIED
+        )
+        self.assertFalse(validator.validate_row(bad))
+        self.assertEqual(
+            self.state.get(filename_key("ISS070-E-2.JPG"), IMAGE)["state"], QUARANTINED
+        )
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(self.path, QUARANTINE_DIRECTORY, "ISS", "ISS070-E-2.JPG")
+            )
+        )
+
+        # Metadata files are not checked
+        self.assertTrue(validator.validate_row({**bad, "kind": METADATA}))
+
+    def test_quarantined_downloaded_again(self):
+        # A quarantined image is downloaded again by the next run
+        self.write_image("AS16-12345.JPG", JPEG[:50])
+        ImageValidator(self.path, self.state).validate()
+
+        win_earth = WinEarthDownload("20240101", "fake_api_key", state=self.state)
+        image_data = {"images.directory": "ISS", "images.filename": "AS16-12345.JPG"}
+
+        self.assertFalse(
+            win_earth.is_saved(
+                image_data,
+                IMAGE,
+                self.path,
+                os.path.join(self.path, "ISS", "AS16-12345.JPG"),
+            )
+        )
+        win_earth.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import tempfile
+import unittest
+from winearth_copy.watch import InotifyWatcher, PollingWatcher, open_watcher
+
+
+def write(path, data=b"File content."):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class TestPollingWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = self.temp_dir.name
+        write(os.path.join(self.path, "ISS", "ISS070-E-1.JPG"))
+        self.watcher = PollingWatcher(self.path, interval=0)
+        self.addCleanup(self.watcher.close)
+
+    def test_poll(self):
+        image = os.path.join(self.path, "ISS", "ISS070-E-2.JPG")
+        metadata = os.path.join(self.path, "ESC", "ISS070-E-3.json")
+        write(image)
+        write(metadata)
+        write(os.path.join(self.path, "ISS", ".ISS070-E-4.JPG.part"))
+
+        # Files are reported once they have not changed between two polls, and the
+        # files there at the start and hidden files are never reported
+        self.assertEqual(self.watcher.poll(0), [])
+        self.assertEqual(sorted(self.watcher.poll(0)), [metadata, image])
+        self.assertEqual(self.watcher.poll(0), [])
+
+    def test_poll_growing_file(self):
+        image = os.path.join(self.path, "ISS", "ISS070-E-2.JPG")
+        write(image, b"start")
+        self.assertEqual(self.watcher.poll(0), [])
+
+        with open(image, "ab") as f:
+            f.write(b" and more")
+        self.assertEqual(self.watcher.poll(0), [])
+        self.assertEqual(self.watcher.poll(0), [image])
+
+    def test_poll_removed_file(self):
+        image = os.path.join(self.path, "ISS", "ISS070-E-1.JPG")
+        os.remove(image)
+        self.assertEqual(self.watcher.poll(0), [])
+
+        # A file written again after it was uploaded and removed is reported
+        write(image)
+        self.watcher.poll(0)
+        self.assertEqual(self.watcher.poll(0), [image])
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify needs Linux")
+class TestInotifyWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = self.temp_dir.name
+        write(os.path.join(self.path, "ISS", "ISS070-E-1.JPG"))
+        self.watcher = InotifyWatcher(self.path)
+        self.addCleanup(self.watcher.close)
+
+    def test_poll(self):
+        part_path = os.path.join(self.path, "ISS", ".ISS070-E-2.JPG.part")
+        image = os.path.join(self.path, "ISS", "ISS070-E-2.JPG")
+        write(part_path)
+
+        # The in-progress download is not reported, the file it is renamed to is
+        self.assertEqual(self.watcher.poll(0.1), [])
+        os.replace(part_path, image)
+        self.assertEqual(self.watcher.poll(1), [image])
+
+        metadata = os.path.join(self.path, "ISS", "ISS070-E-2.json")
+        write(metadata)
+        self.assertEqual(self.watcher.poll(1), [metadata])
+
+    def test_poll_new_directory(self):
+        image = os.path.join(self.path, "ESC", "2024", "ISS070-E-3.JPG")
+        write(image)
+
+        files = []
+        for _ in range(5):
+            files.extend(self.watcher.poll(0.2))
+
+        # Files in a new directory are reported, once when the directory is watched
+        # and again if they are finished after that
+        self.assertIn(image, files)
+        self.assertEqual(set(files), {image})
+
+    def test_open_watcher(self):
+        watcher = open_watcher(self.path)
+        self.addCleanup(watcher.close)
+
+        self.assertIsInstance(watcher, InotifyWatcher)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,115 @@
 import os
+import hashlib
 import unittest
 import json
 import tempfile
+import threading
+import time
 import requests_mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from winearth_copy.manifest import Manifest, read_manifests
+from winearth_copy.state import (
+    DELETED,
+    IMAGE,
+    METADATA,
+    METADATA_LINES,
+    VERIFIED,
+    TransferState,
+)
 from winearth_copy.winearth_download import (
     WinEarthDownload,
+    iter_json_array,
 )  # Replace with the correct import path
 
 
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    failures = {}
+
+    def do_GET(self):
+        # Fail the first request for a path if it is listed in failures
+        if self.failures.pop(self.path, None):
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = b"This is a test image"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    body = b"This is a test image that is sent in two pieces!"
+    ranges = True
+    etag = True
+    truncate = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get("Range"))
+        body = self.body
+        start = 0
+        if self.ranges and self.headers.get("Range"):
+            start = int(self.headers["Range"][len("bytes=") : -1])
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes %d-%d/%d" % (start, len(body) - 1, len(body))
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body) - start))
+        if self.etag:
+            self.send_header("ETag", '"abc123"')
+        self.end_headers()
+
+        # Drop the connection half way through the first response for a path
+        if self.truncate.pop(self.path, None):
+            self.wfile.write(body[start : len(body) // 2])
+            self.close_connection = True
+            return
+
+        self.wfile.write(body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    body = b"This is a test image"
+    # Seconds to wait before answering each request for a path, in order
+    delays = {}
+    # Seconds to wait between each byte of the body
+    trickle = 0
+
+    def do_GET(self):
+        delays = self.delays.get(self.path)
+        if delays:
+            time.sleep(delays.pop(0))
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        try:
+            for byte in range(len(self.body)):
+                time.sleep(self.trickle)
+                self.wfile.write(self.body[byte : byte + 1])
+                self.wfile.flush()
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
 class TestWinEarthDownload(unittest.TestCase):
     def setUp(self):
         self.query_date = "2024-05-08"
@@ -132,3 +234,551 @@ class TestWinEarthDownload(unittest.TestCase):
 
         # Verify the number of downloaded images is 0
         self.assertEqual(downloaded_count, 0)
+
+    @requests_mock.Mocker()
+    def test_download_images_concurrent_failure(self, mock):
+        # One image fails, the other is still downloaded by the worker pool
+        win_earth = WinEarthDownload(self.query_date, self.api_key, concurrency=4)
+        good, bad = self.mocked_json_data
+        mock.get(
+            f"{win_earth.base_download_url}{good['images.directory']}/{good['images.filename']}",
+            content=b"This is a test image",
+        )
+        mock.get(
+            f"{win_earth.base_download_url}{bad['images.directory']}/{bad['images.filename']}",
+            status_code=404,
+        )
+
+        downloaded_count = win_earth.download_images(
+            self.mocked_json_data, self.temp_dir.name
+        )
+
+        self.assertEqual(downloaded_count, 1)
+        directory = os.path.join(self.temp_dir.name, bad["images.directory"])
+        self.assertFalse(
+            os.path.exists(os.path.join(directory, bad["images.filename"]))
+        )
+
+    @requests_mock.Mocker()
+    def test_download_images_interrupted(self, mock):
+        # A download without a validator that fails mid-stream leaves neither the image
+        # nor a part file
+        image_data = self.mocked_json_data[0]
+        image_url = f"{self.win_earth.base_download_url}{image_data['images.directory']}/{image_data['images.filename']}"
+        mock.get(image_url, content=b"This is a test image")
+        directory = os.path.join(self.temp_dir.name, image_data["images.directory"])
+
+        with patch(
+            "requests.models.Response.iter_content",
+            side_effect=OSError("Connection reset"),
+        ):
+            downloaded_count = self.win_earth.download_images(
+                [image_data], self.temp_dir.name
+            )
+
+        self.assertEqual(downloaded_count, 0)
+        self.assertEqual(os.listdir(directory), [])
+
+        # A re-run downloads the image
+        downloaded_count = self.win_earth.download_images(
+            [image_data], self.temp_dir.name
+        )
+        self.assertEqual(downloaded_count, 1)
+        self.assertEqual(os.listdir(directory), [image_data["images.filename"]])
+
+    def download_with_ranges(self, ranges, etag=True):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        image_data = self.mocked_json_data[0]
+        RangeHandler.ranges = ranges
+        RangeHandler.etag = etag
+        RangeHandler.requests = []
+        RangeHandler.truncate = {
+            f"/{image_data['images.directory']}/{image_data['images.filename']}": True
+        }
+
+        try:
+            win_earth = WinEarthDownload(self.query_date, self.api_key)
+            win_earth.base_download_url = "http://127.0.0.1:%d/" % server.server_port
+            # Keep the chunks smaller than the piece sent before the connection drops
+            win_earth.chunk_size = 4
+            downloaded_count = win_earth.download_images(
+                [image_data], self.temp_dir.name
+            )
+            win_earth.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertEqual(downloaded_count, 1)
+        directory = os.path.join(self.temp_dir.name, image_data["images.directory"])
+        self.assertEqual(os.listdir(directory), [image_data["images.filename"]])
+        with open(os.path.join(directory, image_data["images.filename"]), "rb") as f:
+            self.assertEqual(f.read(), RangeHandler.body)
+
+        return RangeHandler.requests
+
+    def test_download_images_resume(self):
+        # The interrupted download is resumed from the bytes already received
+        requests = self.download_with_ranges(True)
+        self.assertEqual(requests, [None, "bytes=%d-" % (len(RangeHandler.body) // 2)])
+
+    def test_download_images_resume_ignored(self):
+        # A server that ignores the Range header sends the whole image again
+        requests = self.download_with_ranges(False)
+        self.assertEqual(requests, [None, "bytes=%d-" % (len(RangeHandler.body) // 2)])
+
+    def test_download_images_resume_without_etag(self):
+        # A part that cannot be resumed is removed and the whole image sent again
+        requests = self.download_with_ranges(True, etag=False)
+        self.assertEqual(requests, [None, None])
+
+    def test_download_images_resume_next_run(self):
+        # A part file with a sidecar left by an earlier run is resumed
+        image_data = self.mocked_json_data[0]
+        image_url = f"{self.win_earth.base_download_url}{image_data['images.directory']}/{image_data['images.filename']}"
+        directory = os.path.join(self.temp_dir.name, image_data["images.directory"])
+        os.makedirs(directory)
+        part_path = os.path.join(directory, ".%s.part" % image_data["images.filename"])
+        with open(part_path, "wb") as f:
+            f.write(b"This is a ")
+        with open(part_path + ".json", "w") as f:
+            json.dump({"length": 20, "etag": '"abc123"', "last_modified": None}, f)
+
+        with requests_mock.Mocker() as mock:
+            mock.get(
+                image_url,
+                status_code=206,
+                content=b"test image",
+                headers={"Content-Range": "bytes 10-19/20"},
+            )
+            downloaded_count = self.win_earth.download_images(
+                [image_data], self.temp_dir.name
+            )
+            request = mock.request_history[0]
+
+        self.assertEqual(downloaded_count, 1)
+        self.assertEqual(request.headers["Range"], "bytes=10-")
+        self.assertEqual(request.headers["If-Range"], '"abc123"')
+        self.assertEqual(os.listdir(directory), [image_data["images.filename"]])
+        with open(os.path.join(directory, image_data["images.filename"]), "rb") as f:
+            self.assertEqual(f.read(), b"This is a test image")
+
+    def download_slowly(self, win_earth, image_data, delays=(), trickle=0):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        SlowHandler.delays = {
+            f"/{image_data['images.directory']}/{image_data['images.filename']}": list(
+                delays
+            )
+        }
+        SlowHandler.trickle = trickle
+
+        try:
+            win_earth.base_download_url = "http://127.0.0.1:%d/" % server.server_port
+            downloaded_count = win_earth.download_images(
+                [image_data], self.temp_dir.name
+            )
+            win_earth.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        return downloaded_count
+
+    def test_download_images_read_timeout(self):
+        # A server that does not answer in time is given up on
+        win_earth = WinEarthDownload(
+            self.query_date, self.api_key, retries=0, timeout=(1, 0.2)
+        )
+        downloaded_count = self.download_slowly(
+            win_earth, self.mocked_json_data[0], delays=[1]
+        )
+
+        self.assertEqual(downloaded_count, 0)
+        self.assertEqual(win_earth.counts["timeouts"], 1)
+
+    def test_download_images_deadline(self):
+        # An image that keeps arriving but takes too long is given up on
+        image_data = self.mocked_json_data[0]
+        win_earth = WinEarthDownload(
+            self.query_date, self.api_key, retries=0, deadline=0.2
+        )
+        win_earth.chunk_size = 1
+        downloaded_count = self.download_slowly(win_earth, image_data, trickle=0.05)
+
+        self.assertEqual(downloaded_count, 0)
+        self.assertEqual(win_earth.counts["timeouts"], 1)
+        directory = os.path.join(self.temp_dir.name, image_data["images.directory"])
+        self.assertEqual(os.listdir(directory), [])
+
+    def test_download_images_hedged(self):
+        # A request slower than the 95th percentile is sent again and the
+        # faster response is kept
+        image_data = self.mocked_json_data[0]
+        win_earth = WinEarthDownload(self.query_date, self.api_key, hedge=True)
+        win_earth.latencies.extend([0.05] * 20)
+        downloaded_count = self.download_slowly(win_earth, image_data, delays=[1])
+
+        self.assertEqual(downloaded_count, 1)
+        self.assertEqual(win_earth.counts["hedges"], 1)
+        self.assertEqual(win_earth.counts["hedge_wins"], 1)
+        directory = os.path.join(self.temp_dir.name, image_data["images.directory"])
+        self.assertEqual(os.listdir(directory), [image_data["images.filename"]])
+        with open(os.path.join(directory, image_data["images.filename"]), "rb") as f:
+            self.assertEqual(f.read(), SlowHandler.body)
+
+    def test_download_images_not_hedged(self):
+        # No request is hedged until enough images have been downloaded
+        win_earth = WinEarthDownload(self.query_date, self.api_key, hedge=True)
+        downloaded_count = self.download_slowly(
+            win_earth, self.mocked_json_data[0], delays=[0.2]
+        )
+
+        self.assertEqual(downloaded_count, 1)
+        self.assertEqual(win_earth.counts["hedges"], 0)
+
+    def test_download_images_connection_reuse_and_retry(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        try:
+            win_earth = WinEarthDownload(self.query_date, self.api_key, concurrency=1)
+            win_earth.base_download_url = "http://127.0.0.1:%d/" % server.server_port
+
+            # The first request for the first image gets a 503 and is retried
+            first = self.mocked_json_data[0]
+            ImageHandler.failures = {
+                f"/{first['images.directory']}/{first['images.filename']}": True
+            }
+
+            downloaded_count = win_earth.download_images(
+                self.mocked_json_data, self.temp_dir.name
+            )
+            stats = win_earth.connection_stats()
+            win_earth.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(downloaded_count, 2)
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reused"], 2)
+
+        # The retried request and both images are in the metrics
+        self.assertEqual(win_earth.metrics.retries["download"], 1)
+        self.assertEqual(win_earth.metrics.latencies["download"].count, 2)
+        self.assertEqual(win_earth.metrics.bytes["download"], 40)
+
+    @requests_mock.Mocker()
+    def test_download_manifest(self, mock):
+        for image_data in self.mocked_json_data:
+            image_url = f"{self.win_earth.base_download_url}{image_data['images.directory']}/{image_data['images.filename']}"
+            mock.get(image_url, content=b"This is a test image")
+
+        manifest = Manifest(self.temp_dir.name, "20240508")
+        win_earth = WinEarthDownload(self.query_date, self.api_key, manifest=manifest)
+        win_earth.save_metadata(self.mocked_json_data, self.temp_dir.name)
+        win_earth.download_images(self.mocked_json_data, self.temp_dir.name)
+        manifest.save()
+
+        entries = read_manifests(self.temp_dir.name)
+        self.assertEqual(len(entries), 4)
+
+        image_data = self.mocked_json_data[0]
+        image_entry = entries[
+            os.path.join(image_data["images.directory"], image_data["images.filename"])
+        ]
+        self.assertEqual(image_entry["size"], len(b"This is a test image"))
+        self.assertEqual(
+            image_entry["md5"], hashlib.md5(b"This is a test image").hexdigest()
+        )
+
+        metadata_file = os.path.join(
+            self.temp_dir.name,
+            image_data["images.directory"],
+            image_data["images.filename"].replace(".JPG", ".json"),
+        )
+        with open(metadata_file, "rb") as f:
+            metadata_md5 = hashlib.md5(f.read()).hexdigest()
+        metadata_entry = entries[os.path.relpath(metadata_file, self.temp_dir.name)]
+        self.assertEqual(metadata_entry["md5"], metadata_md5)
+
+    def test_pool_size(self):
+        win_earth = WinEarthDownload(self.query_date, self.api_key, 4, hedge=True)
+        self.addCleanup(win_earth.close)
+
+        # The listing and two requests for each hedged image
+        adapter = win_earth.session.get_adapter("https://")
+        self.assertEqual(adapter._pool_maxsize, 9)
+
+    def test_download_images_error(self):
+        def download_image(image_data, path):
+            if image_data is self.mocked_json_data[1]:
+                raise OSError("No space left on device")
+            return True
+
+        # An image whose download raises is counted as failed and the rest still count
+        with patch.object(self.win_earth, "download_image", download_image):
+            self.assertEqual(
+                self.win_earth.download_images(
+                    self.mocked_json_data, self.temp_dir.name
+                ),
+                1,
+            )
+
+        self.assertEqual(self.win_earth.counts["downloaded"], 1)
+        self.assertEqual(self.win_earth.counts["failed"], 1)
+
+    @requests_mock.Mocker()
+    def test_download_state(self, mock):
+        for image_data in self.mocked_json_data:
+            image_url = f"{self.win_earth.base_download_url}{image_data['images.directory']}/{image_data['images.filename']}"
+            mock.get(image_url, content=b"This is a test image")
+
+        state = TransferState(os.path.join(self.temp_dir.name, "state.sqlite3"))
+        self.addCleanup(state.close)
+        win_earth = WinEarthDownload(self.query_date, self.api_key, state=state)
+
+        self.assertEqual(
+            win_earth.save_metadata(self.mocked_json_data, self.temp_dir.name), 2
+        )
+        self.assertEqual(
+            win_earth.download_images(self.mocked_json_data, self.temp_dir.name), 2
+        )
+
+        image_data = self.mocked_json_data[0]
+        row = state.get(("AS16", "", "12345"), IMAGE)
+        self.assertEqual(
+            row["path"],
+            os.path.join(image_data["images.directory"], image_data["images.filename"]),
+        )
+        self.assertEqual(row["md5"], hashlib.md5(b"This is a test image").hexdigest())
+        self.assertEqual(row["query_date"], self.query_date)
+
+        # Files that were uploaded and removed locally are not downloaded again
+        state.set_state(("AS16", "", "12345"), IMAGE, DELETED)
+        state.set_state(("AS16", "", "12345"), METADATA, DELETED)
+        directory = os.path.join(self.temp_dir.name, image_data["images.directory"])
+        os.remove(os.path.join(directory, image_data["images.filename"]))
+
+        self.assertEqual(
+            win_earth.save_metadata(self.mocked_json_data, self.temp_dir.name), 0
+        )
+        self.assertEqual(
+            win_earth.download_images(self.mocked_json_data, self.temp_dir.name), 0
+        )
+        self.assertEqual(mock.call_count, 2)
+
+    def test_download_state_existing_files(self):
+        # Files saved before the state database existed are added to it
+        state = TransferState(os.path.join(self.temp_dir.name, "state.sqlite3"))
+        self.addCleanup(state.close)
+        self.win_earth.save_metadata(self.mocked_json_data, self.temp_dir.name)
+
+        win_earth = WinEarthDownload(self.query_date, self.api_key, state=state)
+        self.assertEqual(
+            win_earth.save_metadata(self.mocked_json_data, self.temp_dir.name), 0
+        )
+        self.assertEqual(state.count(), 2)
+
+    @requests_mock.Mocker()
+    def test_download_state_imported_files(self, mock):
+        # Files imported from the directory and since removed are not downloaded again
+        state = TransferState(os.path.join(self.temp_dir.name, "state.sqlite3"))
+        self.addCleanup(state.close)
+        image_data = self.mocked_json_data[0]
+        row = state.import_file(
+            os.path.join(image_data["images.directory"], image_data["images.filename"])
+        )
+        state.set_state(
+            (row["mission"], row["roll"], row["frame"]), row["kind"], DELETED
+        )
+
+        win_earth = WinEarthDownload(self.query_date, self.api_key, state=state)
+        self.assertEqual(win_earth.download_images([image_data], self.temp_dir.name), 0)
+        self.assertEqual(mock.call_count, 0)
+
+    def test_iter_json_array(self):
+        document = json.dumps(self.mocked_json_data + [1, 23.5, "text"]).encode()
+
+        # Elements are yielded however the document is split into chunks
+        for size in [1, 7, len(document)]:
+            chunks = [document[i : i + size] for i in range(0, len(document), size)]
+            self.assertEqual(
+                list(iter_json_array(chunks)), self.mocked_json_data + [1, 23.5, "text"]
+            )
+
+        # Documents that are not arrays are yielded whole
+        self.assertEqual(
+            list(iter_json_array([b'{"result": ', b'"none"}'])), [{"result": "none"}]
+        )
+        self.assertEqual(list(iter_json_array([b" [ ] "])), [])
+
+    def test_iter_json_array_incremental(self):
+        def chunks():
+            yield b'[{"a": 1}, {"b":'
+            # The first element is available before the rest is received
+            self.assertEqual(received, [{"a": 1}])
+            yield b" 2}]"
+
+        received = []
+        for element in iter_json_array(chunks()):
+            received.append(element)
+
+        self.assertEqual(received, [{"a": 1}, {"b": 2}])
+
+    def test_iter_json_array_truncated(self):
+        with self.assertRaises(json.decoder.JSONDecodeError):
+            list(iter_json_array([b'[{"a": 1}, {"b":']))
+        with self.assertRaises(json.decoder.JSONDecodeError):
+            list(iter_json_array([b""]))
+
+    @requests_mock.Mocker()
+    def test_process_images(self, mock):
+        mock.get(self.win_earth.api_url, json=self.mocked_json_data)
+        for image_data in self.mocked_json_data:
+            image_url = f"{self.win_earth.base_download_url}{image_data['images.directory']}/{image_data['images.filename']}"
+            mock.get(image_url, content=b"This is a test image")
+
+        summary = self.win_earth.process_images(self.temp_dir.name)
+
+        self.assertEqual(
+            summary,
+            {
+                "images": 2,
+                "metadata": 2,
+                "downloaded": 2,
+                "timeouts": 0,
+                "hedges": 0,
+                "result": None,
+            },
+        )
+        for image_data in self.mocked_json_data:
+            directory = os.path.join(self.temp_dir.name, image_data["images.directory"])
+            self.assertTrue(
+                os.path.exists(os.path.join(directory, image_data["images.filename"]))
+            )
+
+    @requests_mock.Mocker()
+    def test_process_images_no_records(self, mock):
+        mock.get(
+            self.win_earth.api_url,
+            json={"result": "SQL found no records that match the specified criteria"},
+        )
+
+        summary = self.win_earth.process_images(self.temp_dir.name)
+
+        self.assertEqual(summary["images"], 0)
+        self.assertEqual(
+            summary["result"], "SQL found no records that match the specified criteria"
+        )
+
+    @requests_mock.Mocker()
+    def test_process_images_failure(self, mock):
+        mock.get(self.win_earth.api_url, status_code=500)
+        self.assertIsNone(self.win_earth.process_images(self.temp_dir.name))
+
+        # A listing that ends early is a failure
+        mock.get(self.win_earth.api_url, text='[{"images.directory": "ISS"')
+        self.assertIsNone(self.win_earth.process_images(self.temp_dir.name))
+
+    @requests_mock.Mocker()
+    def test_process_images_backpressure(self, mock):
+        listing = [
+            {"images.directory": "ISS", "images.filename": "ISS070-E-%d.JPG" % i}
+            for i in range(20)
+        ]
+        mock.get(self.win_earth.api_url, json=listing)
+        queued = []
+        waiting = []
+        lock = threading.Lock()
+
+        def save_metadata(json_data, path):
+            with lock:
+                waiting.append(len(queued))
+                queued.append(json_data[0])
+            return 0
+
+        def download_image(image_data, path):
+            time.sleep(0.005)
+            with lock:
+                queued.remove(image_data)
+            return True
+
+        with patch.object(
+            self.win_earth, "save_metadata", side_effect=save_metadata
+        ), patch.object(self.win_earth, "download_image", side_effect=download_image):
+            summary = self.win_earth.process_images(self.temp_dir.name)
+
+        # The listing is only read ahead of the downloads by twice the concurrency
+        self.assertEqual(summary["downloaded"], 20)
+        self.assertLessEqual(max(waiting), 2 * self.win_earth.concurrency)
+
+    @requests_mock.Mocker()
+    def test_process_images_metadata_lines(self, mock):
+        mock.get(self.win_earth.api_url, json=self.mocked_json_data)
+        for image_data in self.mocked_json_data:
+            image_url = f"{self.win_earth.base_download_url}{image_data['images.directory']}/{image_data['images.filename']}"
+            mock.get(image_url, content=b"This is a test image")
+
+        manifest = Manifest(self.temp_dir.name, self.query_date)
+        state = TransferState(os.path.join(self.temp_dir.name, ".state.sqlite3"))
+        self.addCleanup(state.close)
+        win_earth = WinEarthDownload(
+            self.query_date,
+            self.api_key,
+            manifest=manifest,
+            state=state,
+            metadata_format="jsonl",
+        )
+
+        summary = win_earth.process_images(self.temp_dir.name)
+
+        # The metadata of both images is written to one file
+        self.assertEqual(summary["metadata"], 1)
+        self.assertEqual(summary["downloaded"], 2)
+        directory = os.path.join(self.temp_dir.name, "ISS/16/AS16")
+        self.assertEqual(
+            sorted(os.listdir(directory)),
+            ["AS16-12345.JPG", "AS16-12346.JPG", "metadata-2024-05-08.jsonl"],
+        )
+        with open(os.path.join(directory, "metadata-2024-05-08.jsonl"), "rb") as f:
+            data = f.read()
+        self.assertEqual(
+            [json.loads(line) for line in data.splitlines()], self.mocked_json_data
+        )
+
+        relative_path = os.path.join("ISS/16/AS16", "metadata-2024-05-08.jsonl")
+        self.assertEqual(
+            manifest.entries[relative_path]["md5"], hashlib.md5(data).hexdigest()
+        )
+        row = state.get(("ISS/16/AS16", "", self.query_date), METADATA_LINES)
+        self.assertEqual(row["path"], relative_path)
+        self.assertEqual(row["state"], "downloaded")
+
+        # A file with the same content is not written or queued for upload again,
+        # even once it has been uploaded and removed
+        key = ("ISS/16/AS16", "", self.query_date)
+        state.set_state(key, METADATA_LINES, VERIFIED)
+        self.assertEqual(win_earth.save_metadata_lines(self.temp_dir.name), 0)
+        self.assertEqual(state.get(key, METADATA_LINES)["state"], VERIFIED)
+
+        state.set_state(key, METADATA_LINES, DELETED)
+        os.remove(os.path.join(directory, "metadata-2024-05-08.jsonl"))
+        self.assertEqual(win_earth.save_metadata_lines(self.temp_dir.name), 0)
+        self.assertEqual(state.get(key, METADATA_LINES)["state"], DELETED)
+
+        # A file whose content changed is written again
+        win_earth.metadata_lines.add(dict(self.mocked_json_data[0], note="updated"))
+        self.assertEqual(win_earth.save_metadata_lines(self.temp_dir.name), 1)
+        self.assertEqual(state.get(key, METADATA_LINES)["state"], "downloaded")
@@ -10,3 +10,11 @@ def download():
 
 def upload():
     sys.exit(winearth_copy.shell.upload())
+
+
+def sync():
+    sys.exit(winearth_copy.shell.sync())
+
+
+def daemon():
+    sys.exit(winearth_copy.shell.daemon())
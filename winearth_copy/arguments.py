@@ -27,4 +27,61 @@ def parse_arguments(args):
         default=os.environ.get("QUERY_DATE", None),
     )
 
-    return parser.parse_args(args)
+    parser.add_argument(
+        "--start-date",
+        dest="start_date",
+        help="First date of a backfill in YYYYMMDD format",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--end-date",
+        dest="end_date",
+        help="Last date of a backfill in YYYYMMDD format. Defaults to today.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--download-concurrency",
+        dest="download_concurrency",
+        type=int,
+        help="Number of images to download at the same time. Overrides the configuration file.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--upload-concurrency",
+        dest="upload_concurrency",
+        type=int,
+        help="Number of files to upload at the same time. Overrides the configuration file.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--watch",
+        dest="watch",
+        action="store_true",
+        help="Keep uploading new files as they are downloaded until interrupted.",
+    )
+
+    parser.add_argument(
+        "--rescan",
+        dest="rescan",
+        action="store_true",
+        help="Add the files under path that the state database does not know about before uploading.",
+    )
+
+    parser.add_argument(
+        "--profile",
+        metavar="directory",
+        dest="profile",
+        help="Write a cProfile profile of the run and the time spent in each phase to this directory.",
+        default=None,
+    )
+
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.end_date is not None and parsed_args.start_date is None:
+        parser.error("--end-date requires --start-date")
+
+    return parsed_args
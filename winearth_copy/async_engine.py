@@ -0,0 +1,847 @@
+#!/usr/bin/env python
+
+import asyncio
+import base64
+import botocore.exceptions
+import hashlib
+import os
+import random
+import signal
+import tempfile
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+from winearth_copy.metadata import JSON
+from winearth_copy.metrics import PHASE_DOWNLOAD, PHASE_LIST, PHASE_PUT, PHASE_VERIFY
+from winearth_copy.s3_upload import MAX_PARTS, S3Upload, directory_prefixes
+from winearth_copy.state import IMAGE, UPLOADED, DELETED
+from winearth_copy.winearth_download import (
+    DEFAULT_TIMEOUT,
+    JsonArrayParser,
+    WinEarthDownload,
+)
+
+# The asyncio engine is optional: pip install winearth_copy[async]
+try:
+    import aiohttp
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    aiohttp = None
+    AioConfig = None
+    get_session = None
+
+# Responses that are retried, as in WinEarthDownload.create_session
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def available():
+    """
+    Check whether the packages the asyncio engine needs are installed.
+
+    Returns:
+        bool: True if aiohttp and aiobotocore can be imported.
+    """
+    return aiohttp is not None and get_session is not None
+
+
+def run(coroutine):
+    """
+    Run a coroutine in a new event loop until it finishes or is cancelled.
+
+    SIGINT and SIGTERM cancel the coroutine, which cancels every transfer it started
+    so in-progress downloads can remove their temporary files and multipart uploads
+    can be aborted before the loop closes.
+
+    Args:
+        coroutine (coroutine): The coroutine to run.
+
+    Returns:
+        The result of the coroutine, or None if it was cancelled.
+    """
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        handled = []
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, task.cancel)
+                handled.append(signal_number)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Signal handlers can only be set in the main thread on Unix
+                pass
+
+        try:
+            return await coroutine
+        finally:
+            for signal_number in handled:
+                loop.remove_signal_handler(signal_number)
+
+    try:
+        return asyncio.run(main())
+    except asyncio.CancelledError:
+        print("Cancelled")
+        return None
+
+
+async def backoff(attempt):
+    """
+    Wait before a retry, with exponential backoff and jitter.
+
+    Args:
+        attempt (int): The number of attempts made so far, starting at 0.
+
+    Returns:
+        None
+    """
+    await asyncio.sleep(0.5 * 2**attempt + random.uniform(0, 0.5))
+
+
+def remove_temp_file(temp_path):
+    """
+    Remove a temporary file if it was created.
+
+    Args:
+        temp_path (str): The path to the temporary file, or None.
+
+    Returns:
+        None
+    """
+    if temp_path is not None and os.path.exists(temp_path):
+        os.remove(temp_path)
+
+
+class HostLimiter:
+    """
+    Per-host semaphores that limit the transfers in flight to each host.
+
+    Args:
+        concurrency (int): The number of transfers allowed at the same time per host.
+
+    Attributes:
+        concurrency (int): The number of transfers allowed at the same time per host.
+        semaphores (dict): The semaphore for each host.
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = max(1, int(concurrency))
+        self.semaphores = {}
+
+    def __call__(self, url):
+        """
+        Get the semaphore for the host of a URL.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            asyncio.Semaphore: The semaphore for the host.
+        """
+        host = urlsplit(url).netloc
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.concurrency)
+
+        return self.semaphores[host]
+
+
+class AsyncWinEarthDownload(WinEarthDownload):
+    """
+    Downloads the images for a day with aiohttp on a single event loop.
+
+    Every image is a task rather than a thread, so thousands of transfers can wait on
+    the network at once. Transfers to each host are limited by a HostLimiter. Files are
+    written, named and recorded exactly as WinEarthDownload does, and process_images
+    and the download methods are coroutines.
+
+    Args:
+        query_date (str): The date to query in YYYYMMDD format.
+        api_key (str): The GAPE API key.
+        concurrency (int, optional): The number of images downloaded at the same time
+            from each host. Defaults to 1.
+        retries (int, optional): The number of retries for each HTTP request. Defaults to 5.
+        manifest (winearth_copy.manifest.Manifest, optional): The manifest to record
+            files in. Defaults to None.
+        state (winearth_copy.state.TransferState, optional): The state database.
+            Defaults to None.
+        metadata_format (str, optional): The metadata format, "json" for a file per
+            image or "jsonl" for a JSON Lines file per directory. Defaults to "json".
+        timeout (tuple, optional): The connect and socket read timeouts in seconds for
+            every HTTP request. Defaults to (10, 60).
+        deadline (float, optional): The seconds an image may take to download.
+            Defaults to None for no limit.
+        metrics (winearth_copy.metrics.Metrics, optional): The transfer metrics to add
+            to. Defaults to new metrics.
+
+    Attributes:
+        host_limiter (HostLimiter): The per-host semaphores.
+        requests (int): The number of HTTP requests sent.
+        connections (int): The number of connections opened.
+    """
+
+    def __init__(
+        self,
+        query_date,
+        api_key,
+        concurrency=1,
+        retries=5,
+        manifest=None,
+        state=None,
+        metadata_format=JSON,
+        timeout=DEFAULT_TIMEOUT,
+        deadline=None,
+        metrics=None,
+    ):
+        super().__init__(
+            query_date,
+            api_key,
+            concurrency,
+            retries,
+            manifest,
+            state,
+            metadata_format=metadata_format,
+            timeout=timeout,
+            deadline=deadline,
+            metrics=metrics,
+        )
+        self.host_limiter = HostLimiter(self.concurrency)
+        self.requests = 0
+        self.connections = 0
+
+    def create_session(self):
+        """
+        The aiohttp session is created by process_images, inside the event loop.
+
+        Returns:
+            None
+        """
+        return None
+
+    def connection_stats(self):
+        """
+        Count the HTTP requests sent and the connections opened by the last session.
+
+        Returns:
+            dict: The number of requests, new connections and reused connections.
+        """
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reused": self.requests - self.connections,
+        }
+
+    def close(self):
+        """
+        The aiohttp session is closed by process_images.
+        """
+        return None
+
+    def trace_config(self):
+        """
+        Build an aiohttp trace configuration that counts requests and connections.
+
+        Returns:
+            aiohttp.TraceConfig: The trace configuration.
+        """
+
+        async def on_request_start(session, context, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.connections += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+
+        return trace_config
+
+    async def get(self, url, params=None):
+        """
+        Send a GET request, retrying connection errors and 429/5xx responses.
+
+        Args:
+            url (str): The URL.
+            params (dict, optional): The query parameters. Defaults to None.
+
+        Returns:
+            aiohttp.ClientResponse: The response. The body has not been read yet.
+
+        Raises:
+            aiohttp.ClientError: If the last attempt fails to connect.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.session.get(url, params=params)
+            except aiohttp.ClientError:
+                if attempt == self.retries:
+                    raise
+                self.observe_retry(url)
+                await backoff(attempt)
+                continue
+
+            if response.status in RETRY_STATUSES and attempt < self.retries:
+                response.release()
+                self.observe_retry(url)
+                await backoff(attempt)
+                continue
+
+            return response
+
+    async def download_image(self, image_data, path):
+        """
+        Downloads a single image and saves it to the specified path.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            path (str): The path where the image will be saved.
+
+        Returns:
+            bool or None: True if the image was downloaded, False if the download failed,
+            None if the image already exists.
+        """
+        full_path = "%s/%s/" % (path, image_data["images.directory"])
+        filename = image_data["images.filename"]
+
+        if self.is_saved(image_data, IMAGE, path, full_path + filename):
+            return None
+
+        self.make_directory(os.path.dirname(full_path))
+
+        async with self.host_limiter(self.base_download_url):
+            return await self.fetch_image(image_data, path)
+
+    async def fetch_image(self, image_data, path):
+        """
+        Fetches an image from the image host and saves it to the specified path.
+
+        The body is streamed to a temporary file that is fsynced and renamed, as in
+        WinEarthDownload.fetch_image. If the task is cancelled the temporary file is
+        removed before the cancellation is passed on. An image that takes longer than
+        the deadline is given up on.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            path (str): The path where the image will be saved.
+
+        Returns:
+            bool: True if the image was downloaded, False if the download failed.
+        """
+        full_path = "%s/%s/" % (path, image_data["images.directory"])
+        filename = image_data["images.filename"]
+
+        url = self.base_download_url + image_data["images.directory"] + "/" + filename
+        temp_path = None
+        try:
+            with self.metrics.time(PHASE_DOWNLOAD) as timing:
+                async with asyncio.timeout(self.deadline):
+                    async with await self.get(url) as response:
+                        if response.status != 200:
+                            print(f"Download failed: {filename} HTTP {response.status}")
+                            timing.failed = True
+                            return False
+
+                        fd, temp_path = tempfile.mkstemp(
+                            dir=full_path, prefix=f".{filename}.", suffix=".tmp"
+                        )
+                        hash_md5 = hashlib.md5()
+                        with os.fdopen(fd, "wb") as f:
+                            async for chunk in response.content.iter_chunked(
+                                self.chunk_size
+                            ):
+                                f.write(chunk)
+                                hash_md5.update(chunk)
+                                timing.bytes += len(chunk)
+                            f.flush()
+                            await asyncio.to_thread(os.fsync, f.fileno())
+
+                os.replace(temp_path, full_path + filename)
+
+                self.record_file(
+                    image_data, IMAGE, path, full_path + filename, hash_md5.hexdigest()
+                )
+        except asyncio.CancelledError:
+            remove_temp_file(temp_path)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.count("timeouts")
+            print(f"Download failed: {filename} {e}")
+            remove_temp_file(temp_path)
+            return False
+
+        print(f"Downloaded {filename}")
+        return True
+
+    def count_task(self, task):
+        """
+        Add the result of a finished download_image task to ``counts``.
+
+        Args:
+            task (asyncio.Task): The finished task.
+
+        Returns:
+            None
+        """
+        if not task.cancelled():
+            self.count_download(task)
+
+        return None
+
+    async def process_images(self, path):
+        """
+        Stream the image listing for the query date, saving the metadata of each image
+        and starting a download task as soon as its record is received.
+
+        Args:
+            path (str): The base path where files are saved.
+
+        Returns:
+            dict or None: The number of images listed, metadata files saved and images
+            downloaded, and the GAPE API result message if there was one, or None if
+            the listing could not be retrieved.
+        """
+        summary = {
+            "images": 0,
+            "metadata": 0,
+            "downloaded": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "result": None,
+        }
+        counts = self.counts.copy()
+        parser = JsonArrayParser()
+
+        # Connections are limited by the per-host semaphores rather than the pool
+        connector = aiohttp.TCPConnector(limit=0)
+        connect_timeout, read_timeout = self.timeout
+        async with aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=connect_timeout, sock_read=read_timeout
+            ),
+            trace_configs=[self.trace_config()],
+        ) as self.session:
+            async with asyncio.TaskGroup() as tasks:
+                try:
+                    async with await self.get(
+                        self.api_url, params=self.list_params()
+                    ) as response:
+                        if response.status != 200:
+                            return None
+
+                        async for chunk in response.content.iter_chunked(64 * 1024):
+                            for image_data in parser.feed(chunk):
+                                self.start_image(image_data, path, summary, tasks)
+
+                    for image_data in parser.close():
+                        self.start_image(image_data, path, summary, tasks)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    print(f"Failed to read the image listing: {e}")
+                    return None
+
+        summary["metadata"] += self.save_metadata_lines(path)
+        for name in ("downloaded", "timeouts", "hedges"):
+            summary[name] = self.counts[name] - counts[name]
+
+        return summary
+
+    def start_image(self, image_data, path, summary, tasks):
+        """
+        Save the metadata of a listing record and start downloading its image.
+
+        Args:
+            image_data (dict): A record from the image listing.
+            path (str): The base path where files are saved.
+            summary (dict): The summary that process_images returns.
+            tasks (asyncio.TaskGroup): The task group the download is started in.
+
+        Returns:
+            None
+        """
+        if not isinstance(image_data, dict):
+            return None
+        if "images.filename" not in image_data:
+            summary["result"] = image_data.get("result")
+            return None
+
+        summary["images"] += 1
+        summary["metadata"] += self.save_metadata([image_data], path)
+        tasks.create_task(self.download_image(image_data, path)).add_done_callback(
+            self.count_task
+        )
+
+        return None
+
+
+class AsyncS3Upload(S3Upload):
+    """
+    Uploads a directory to S3 with aiobotocore on a single event loop.
+
+    Files are listed, checked against the bucket, verified and removed exactly as
+    S3Upload does, and upload_directory and the upload methods are coroutines. Each
+    file is a task, and the uploads in flight to the S3 host are limited by a
+    HostLimiter. Files are read in a worker thread and hashed in the same pass, so
+    Content-MD5 is always sent.
+
+    Args:
+        aws_access_key_id (str): The AWS access key ID.
+        aws_secret_access_key (str): The AWS secret access key.
+        s3_host (str): The S3 host URL.
+        addressing_style (str, optional): The S3 addressing style. Defaults to "auto".
+        concurrency (int, optional): The number of files uploaded at the same time. Defaults to 1.
+        multipart_threshold (int, optional): Files of at least this many bytes are uploaded
+            with multipart upload. Defaults to 64 MiB.
+        multipart_chunksize (int, optional): The multipart part size in bytes. Defaults to 16 MiB.
+        multipart_concurrency (int, optional): The number of parts of one file uploaded at
+            the same time. Defaults to 4.
+        read_buffer_size (int, optional): The buffer size in bytes for reading files.
+            Defaults to 1 MiB.
+        state (winearth_copy.state.TransferState, optional): The state database that
+            lists the files to upload. Defaults to None, which walks the directory.
+
+    Attributes:
+        host_limiter (HostLimiter): The per-host semaphores.
+        client: The aiobotocore S3 client, while upload_directory is running.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host_limiter = HostLimiter(self.concurrency)
+        self.client = None
+
+    def create_client(self):
+        """
+        Create the aiobotocore S3 client.
+
+        Returns:
+            The client, as an asynchronous context manager.
+        """
+        client = get_session().create_client(
+            "s3",
+            aws_access_key_id=self.aws_access_key_id,
+            aws_secret_access_key=self.aws_secret_access_key,
+            endpoint_url=self.s3_host,
+            config=self.client_config(self.addressing_style, AioConfig),
+        )
+
+        return client
+
+    def read_file(self, object, md5=None):
+        """
+        Read a file and hash it, unless its MD5 hash is already known.
+
+        Args:
+            object (str): The path to the file.
+            md5 (str, optional): The known MD5 hash of the file.
+
+        Returns:
+            tuple: The contents and the MD5 hash of the file.
+        """
+        with open(object, "rb") as f:
+            body = f.read()
+
+        return body, md5 or hashlib.md5(body).hexdigest()
+
+    def read_part(self, object, part_number, part_size):
+        """
+        Read one part of a file.
+
+        Args:
+            object (str): The path to the file.
+            part_number (int): The 1-based part number.
+            part_size (int): The part size in bytes.
+
+        Returns:
+            bytes: The data of the part.
+        """
+        with open(object, "rb") as f:
+            f.seek((part_number - 1) * part_size)
+            return f.read(part_size)
+
+    async def get_object_etag(self, bucket_name, object_name):
+        """
+        Get the ETag of an object in a bucket.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object_name (str): The name of the object.
+
+        Returns:
+            str: The ETag of the object, or None if it can not be read.
+        """
+        try:
+            response = await self.client.head_object(
+                Bucket=bucket_name, Key=object_name
+            )
+        except botocore.exceptions.ClientError as e:
+            print("S3 ClientError: %s" % e)
+            return None
+        except botocore.exceptions.BotoCoreError as e:
+            print("S3 Error: %s" % e)
+            return None
+
+        return response["ETag"].replace('"', "")
+
+    async def put_file(self, bucket_name, object, md5=None):
+        """
+        Upload a file to a bucket.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The path to the file.
+            md5 (str, optional): The known MD5 hash of the file.
+
+        Returns:
+            tuple: The put_object or complete_multipart_upload response and the ETag
+            calculated from the data that was read.
+        """
+        if os.path.getsize(object) >= self.multipart_threshold:
+            return await self.upload_multipart(bucket_name, object)
+
+        body, md5 = await asyncio.to_thread(self.read_file, object, md5)
+        response = await self.client.put_object(
+            Bucket=bucket_name,
+            Key=object,
+            Body=body,
+            ContentMD5=base64.b64encode(bytes.fromhex(md5)).decode(),
+        )
+
+        return response, md5
+
+    async def upload_part(
+        self, bucket_name, object, upload_id, part_number, part_size, limiter=None
+    ):
+        """
+        Read and upload one part of a multipart upload.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The path to the object.
+            upload_id (str): The multipart upload ID.
+            part_number (int): The 1-based part number.
+            part_size (int): The part size in bytes.
+            limiter (asyncio.Semaphore, optional): The semaphore for the parts of this
+                file. Defaults to None.
+
+        Returns:
+            tuple: The part number and ETag of the uploaded part and the MD5 digest of
+            the part.
+        """
+        async with limiter if limiter is not None else nullcontext():
+            body = await asyncio.to_thread(
+                self.read_part, object, part_number, part_size
+            )
+            digest = hashlib.md5(body).digest()
+            response = await self.client.upload_part(
+                Bucket=bucket_name,
+                Key=object,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+                ContentMD5=base64.b64encode(digest).decode(),
+            )
+
+        return {"ETag": response["ETag"], "PartNumber": part_number}, digest
+
+    async def upload_multipart(self, bucket_name, object):
+        """
+        Upload an object to a bucket with multipart upload.
+
+        Up to multipart_concurrency parts are in flight at once. The multipart upload
+        is aborted if any part fails or the upload is cancelled.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The path to the object.
+
+        Returns:
+            tuple: The complete_multipart_upload response and the composite multipart
+            ETag calculated from the parts that were read.
+        """
+        size = os.path.getsize(object)
+        part_size = self.part_size(size)
+        part_count = min(MAX_PARTS, max(1, -(-size // part_size)))
+        limiter = asyncio.Semaphore(self.multipart_concurrency)
+
+        upload_id = (
+            await self.client.create_multipart_upload(Bucket=bucket_name, Key=object)
+        )["UploadId"]
+
+        try:
+            results = await asyncio.gather(
+                *[
+                    self.upload_part(
+                        bucket_name, object, upload_id, part_number, part_size, limiter
+                    )
+                    for part_number in range(1, part_count + 1)
+                ]
+            )
+
+            response = await self.client.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=object,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [part for part, digest in results]},
+            )
+        except BaseException:
+            await asyncio.shield(
+                self.client.abort_multipart_upload(
+                    Bucket=bucket_name, Key=object, UploadId=upload_id
+                )
+            )
+            raise
+
+        etag = "%s-%d" % (
+            hashlib.md5(b"".join(digest for part, digest in results)).hexdigest(),
+            len(results),
+        )
+
+        return response, etag
+
+    async def list_remote_objects(self, bucket_name, prefix):
+        """
+        List the objects under a prefix with paginated ListObjectsV2 requests.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            prefix (str): The key prefix to list.
+
+        Returns:
+            dict: The size and ETag of each object keyed by object name, or an empty
+            dictionary if the bucket can not be listed.
+        """
+        remote_objects = {}
+
+        with self.metrics.time(PHASE_LIST) as timing:
+            try:
+                paginator = self.client.get_paginator("list_objects_v2")
+                async for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+                    for item in page.get("Contents", []):
+                        remote_objects[item["Key"]] = (
+                            item["Size"],
+                            item["ETag"].replace('"', ""),
+                        )
+            except botocore.exceptions.ClientError as e:
+                print("S3 ClientError: %s" % e)
+                timing.failed = True
+                return {}
+            except botocore.exceptions.BotoCoreError as e:
+                print("S3 Error: %s" % e)
+                timing.failed = True
+                return {}
+
+        return remote_objects
+
+    async def upload_file(self, bucket_name, object, md5=None, row=None, remote=None):
+        """
+        Upload a file to a bucket, verify it and remove the local copy.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The path to the file.
+            md5 (str, optional): The known MD5 hash of the file, from a download manifest.
+            row (dict, optional): The state database row of the file. Files already marked
+                as uploaded are only removed.
+            remote (tuple, optional): The size and ETag of the object already in the
+                bucket. Files that match it are only removed.
+
+        Returns:
+            bool or None: True if the file was uploaded and verified, False if the upload
+            failed, None if the file was already in the bucket.
+        """
+        if row is not None and row["state"] == UPLOADED:
+            uploaded = None
+        elif remote is not None and await asyncio.to_thread(
+            self.matches_remote, object, md5, remote
+        ):
+            print("upload_object: Already uploaded %s" % object)
+            uploaded = None
+        else:
+            try:
+                async with self.host_limiter(self.s3_host):
+                    with self.metrics.time(PHASE_PUT) as timing:
+                        timing.bytes = os.path.getsize(object)
+                        response, local_md5sum = await self.put_file(
+                            bucket_name, object, md5
+                        )
+            except (
+                botocore.exceptions.BotoCoreError,
+                botocore.exceptions.ClientError,
+                OSError,
+            ) as e:
+                print("Upload Object Failed: %s %s" % (object, e))
+                return False
+
+            with self.metrics.time(PHASE_VERIFY) as timing:
+                etag = response.get("ETag", "").replace('"', "")
+                if not etag:
+                    etag = await self.get_object_etag(bucket_name, object)
+                timing.failed = local_md5sum != etag
+
+            if local_md5sum != etag:
+                print("Upload Object Failed: %s %s %s" % (object, local_md5sum, etag))
+                return False
+
+            print("upload_object: Ok %s" % object)
+            uploaded = True
+
+        self.set_file_state(row, UPLOADED)
+
+        self.remove_file(object)
+        self.set_file_state(row, DELETED)
+
+        return uploaded
+
+    async def upload_directory(self, bucket_name, path):
+        """
+        Upload a directory to a bucket.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            path (str): The path to the directory.
+
+        Returns:
+            dict: A summary with the number of uploaded, skipped and failed files, the
+            paths of the files that failed and the number of S3 requests made per file.
+        """
+        summary = {"uploaded": 0, "skipped": 0, "failed": 0, "failed_files": []}
+        request_count = sum(self.request_counts.values())
+
+        files = self.list_files(path)
+
+        async with self.create_client() as self.client:
+            self.client.meta.events.register(
+                "before-parameter-build.s3", self.count_request
+            )
+            self.client.meta.events.register("needs-retry.s3", self.observe_retry)
+
+            remote_objects = {}
+            for prefix in directory_prefixes(files):
+                remote_objects.update(
+                    await self.list_remote_objects(bucket_name, prefix)
+                )
+
+            async with asyncio.TaskGroup() as tasks:
+                uploads = {
+                    tasks.create_task(
+                        self.upload_file(
+                            bucket_name, object, md5, row, remote_objects.get(object)
+                        )
+                    ): object
+                    for object, md5, row in files
+                }
+
+        for task, object in uploads.items():
+            result = task.result()
+            if result:
+                summary["uploaded"] += 1
+            elif result is None:
+                summary["skipped"] += 1
+            else:
+                summary["failed"] += 1
+                summary["failed_files"].append(object)
+
+        summary["requests"] = sum(self.request_counts.values()) - request_count
+        summary["requests_per_file"] = summary["requests"] / max(1, len(files))
+
+        return summary
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from winearth_copy.metadata import JSON
+from winearth_copy.metrics import Metrics
+from winearth_copy.state import COMPLETE, STARTED
+from winearth_copy.winearth_download import (
+    DEFAULT_TIMEOUT,
+    NO_RECORDS,
+    WinEarthDownload,
+    pool_size,
+)
+
+
+def date_range(start_date, end_date):
+    """
+    List the days from start_date to end_date, inclusive.
+
+    Args:
+        start_date (str): The first date in YYYYMMDD format.
+        end_date (str): The last date in YYYYMMDD format.
+
+    Returns:
+        list: The dates in YYYYMMDD format.
+
+    Raises:
+        ValueError: If a date is not in YYYYMMDD format.
+
+    """
+    start = datetime.strptime(start_date, "%Y%m%d")
+    end = datetime.strptime(end_date, "%Y%m%d")
+
+    return [
+        (start + timedelta(days=day)).strftime("%Y%m%d")
+        for day in range((end - start).days + 1)
+    ]
+
+
+class Backfill:
+    """
+    Downloads the images for a range of days.
+
+    Several days are queried and downloaded at the same time. Every day shares one
+    HTTP session and one semaphore, so no more than ``concurrency`` images are
+    transferred at once across all days. A day is checkpointed in the state database
+    once all of its images are saved, and checkpointed days are skipped when the
+    backfill is run again.
+
+    Args:
+        api_key (str): The GAPE API key.
+        path (str): The base path where files are saved.
+        state (winearth_copy.state.TransferState): The state database.
+        concurrency (int, optional): The number of images transferred at the same time
+            across all days. Defaults to 4.
+        day_concurrency (int, optional): The number of days processed at the same time.
+            Defaults to 2.
+        retries (int, optional): The number of retries for each HTTP request. Defaults to 5.
+        metadata_format (str, optional): The metadata format, "json" for a file per
+            image or "jsonl" for a JSON Lines file per directory and day. Defaults to
+            "json".
+        limiter (optional): The context manager, such as an AdaptiveLimiter, that every
+            image transfer holds. Defaults to a semaphore of ``concurrency``.
+        bandwidth (winearth_copy.limits.TokenBucket, optional): The bandwidth limit
+            shared by all days. Defaults to None.
+        timeout (tuple, optional): The connect and read timeouts in seconds for every
+            HTTP request. Defaults to (10, 60).
+        deadline (float, optional): The seconds an image may take to download.
+            Defaults to None for no limit.
+        hedge (bool, optional): Whether slow image requests are hedged. Defaults to
+            False.
+        metrics (winearth_copy.metrics.Metrics, optional): The transfer metrics shared
+            by all days. Defaults to new metrics.
+
+    Attributes:
+        api_key (str): The GAPE API key.
+        path (str): The base path where files are saved.
+        state (winearth_copy.state.TransferState): The state database.
+        concurrency (int): The number of images transferred at the same time.
+        day_concurrency (int): The number of days processed at the same time.
+        retries (int): The number of retries for each HTTP request.
+        metadata_format (str): The metadata format.
+        downloader (WinEarthDownload): The downloader that owns the shared session.
+        limiter: The semaphore or AdaptiveLimiter shared by all days.
+        bandwidth (winearth_copy.limits.TokenBucket): The bandwidth limit, or None.
+        timeout (tuple): The connect and read timeouts in seconds.
+        deadline (float): The seconds an image may take to download, or None.
+        hedge (bool): Whether slow image requests are hedged.
+        metrics (winearth_copy.metrics.Metrics): The transfer metrics.
+
+    """
+
+    def __init__(
+        self,
+        api_key,
+        path,
+        state,
+        concurrency=4,
+        day_concurrency=2,
+        retries=5,
+        metadata_format=JSON,
+        limiter=None,
+        bandwidth=None,
+        timeout=DEFAULT_TIMEOUT,
+        deadline=None,
+        hedge=False,
+        metrics=None,
+    ):
+        self.api_key = api_key
+        self.path = path
+        self.state = state
+        self.concurrency = max(1, int(concurrency))
+        self.day_concurrency = max(1, int(day_concurrency))
+        self.retries = retries
+        self.metadata_format = metadata_format
+        self.bandwidth = bandwidth
+        self.timeout = timeout
+        self.deadline = deadline
+        self.hedge = hedge
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        if limiter is None:
+            limiter = threading.BoundedSemaphore(self.concurrency)
+        self.limiter = limiter
+        # Every day streams its listing and downloads its images over the session
+        self.downloader = WinEarthDownload(
+            None,
+            api_key,
+            self.concurrency,
+            retries,
+            limiter=self.limiter,
+            metrics=self.metrics,
+            pool_maxsize=pool_size(self.concurrency, self.hedge, self.day_concurrency),
+        )
+
+    def run_day(self, query_date):
+        """
+        Query and download the images for one day.
+
+        Args:
+            query_date (str): The date in YYYYMMDD format.
+
+        Returns:
+            dict: The number of images found, metadata files saved, images downloaded,
+            requests that timed out and requests that were hedged, and whether the
+            day is complete.
+
+        """
+        result = {
+            "query_date": query_date,
+            "images": 0,
+            "metadata": 0,
+            "downloaded": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "complete": False,
+        }
+
+        gape = WinEarthDownload(
+            query_date,
+            self.api_key,
+            self.concurrency,
+            self.retries,
+            state=self.state,
+            session=self.downloader.session,
+            limiter=self.limiter,
+            metadata_format=self.metadata_format,
+            bandwidth=self.bandwidth,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            hedge=self.hedge,
+            metrics=self.metrics,
+        )
+
+        self.state.set_day(query_date, STARTED)
+
+        summary = gape.process_images(self.path)
+
+        if summary is None:
+            print(f"Failed to retrieve images for {query_date} from GAPE API.")
+            return result
+
+        if summary["result"] == NO_RECORDS:
+            print(f"No images found for {query_date}.")
+            self.state.set_day(query_date, COMPLETE, 0)
+            result["complete"] = True
+            return result
+
+        result["images"] = summary["images"]
+        result["metadata"] = summary["metadata"]
+        result["downloaded"] = summary["downloaded"]
+        result["timeouts"] = summary["timeouts"]
+        result["hedges"] = summary["hedges"]
+
+        if gape.counts["failed"] == 0:
+            self.state.set_day(query_date, COMPLETE, summary["images"])
+            result["complete"] = True
+
+        print(
+            f"{query_date}: found {result['images']} images, downloaded {result['downloaded']}"
+        )
+
+        return result
+
+    def run(self, start_date, end_date, recheck=False):
+        """
+        Query and download the images for every day from start_date to end_date.
+
+        Args:
+            start_date (str): The first date in YYYYMMDD format.
+            end_date (str): The last date in YYYYMMDD format.
+            recheck (bool, optional): Whether days that are already complete are
+                queried again for images published since. Defaults to False.
+
+        Returns:
+            dict: A summary with the number of days, the days skipped because they were
+            already complete, the days that are still incomplete and the number of
+            metadata files saved, images downloaded, requests that timed out and
+            requests that were hedged.
+
+        """
+        days = date_range(start_date, end_date)
+        pending_days = [
+            query_date
+            for query_date in days
+            if recheck
+            or (self.state.get_day(query_date) or {}).get("state") != COMPLETE
+        ]
+
+        summary = {
+            "days": len(days),
+            "skipped_days": len(days) - len(pending_days),
+            "incomplete_days": [],
+            "metadata": 0,
+            "downloaded": 0,
+            "timeouts": 0,
+            "hedges": 0,
+        }
+
+        with ThreadPoolExecutor(max_workers=self.day_concurrency) as executor:
+            for result in executor.map(self.run_day, pending_days):
+                summary["metadata"] += result["metadata"]
+                summary["downloaded"] += result["downloaded"]
+                summary["timeouts"] += result["timeouts"]
+                summary["hedges"] += result["hedges"]
+                if not result["complete"]:
+                    summary["incomplete_days"].append(result["query_date"])
+
+        return summary
+
+    def close(self):
+        """
+        Close the shared HTTP session.
+        """
+        self.downloader.close()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+import json
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Cycles a daemon may miss before its health check fails
+STALE_CYCLES = 3
+
+
+class Daemon:
+    """
+    Downloads and uploads new images on a schedule, keeping the HTTP session and S3
+    client warm between runs.
+
+    Every ``interval`` seconds a cycle queries today and the ``window`` days before
+    it, so images that are published late are still found, downloads what is new,
+    validates the images and uploads them. The transfer state database makes each
+    cycle skip the files earlier cycles already handled, including metadata files
+    whose records have not changed, so a quiet cycle costs one listing per day. A
+    failed cycle is reported and the next one runs on schedule.
+
+    Args:
+        backfill (winearth_copy.backfill.Backfill): Downloads the days of a cycle.
+        s3 (winearth_copy.s3_upload.S3Upload): Uploads the downloaded files.
+        bucket_name (str): The S3 bucket name.
+        path (str): The base path where files are saved.
+        interval (float, optional): The seconds from the start of one cycle to the
+            start of the next. Defaults to 900.
+        window (int, optional): The number of days before today that are queried
+            again. Defaults to 2.
+        validator (winearth_copy.validate.ImageValidator, optional): Checks the
+            downloaded images before they are uploaded. Defaults to None.
+        metrics (winearth_copy.metrics.Metrics, optional): The transfer metrics of
+            every cycle. Defaults to the metrics of the backfill.
+
+    Attributes:
+        backfill (winearth_copy.backfill.Backfill): Downloads the days of a cycle.
+        s3 (winearth_copy.s3_upload.S3Upload): Uploads the downloaded files.
+        bucket_name (str): The S3 bucket name.
+        path (str): The base path where files are saved.
+        interval (float): The seconds between the starts of two cycles.
+        window (int): The number of days before today that are queried again.
+        validator (winearth_copy.validate.ImageValidator): The validator, or None.
+        metrics (winearth_copy.metrics.Metrics): The transfer metrics.
+        started (float): The time.time() the daemon was created at.
+        counts (dict): The cycles run and failed, and the images downloaded and files
+            uploaded by all of them.
+        last_cycle (dict): The start, end, duration and error of the last cycle, or
+            None before the first one ends.
+        last_success (float): The time.time() the last successful cycle ended at, or
+            None.
+        stopping (threading.Event): Set to stop the daemon.
+    """
+
+    def __init__(
+        self,
+        backfill,
+        s3,
+        bucket_name,
+        path,
+        interval=900,
+        window=2,
+        validator=None,
+        metrics=None,
+    ):
+        self.backfill = backfill
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.path = path
+        self.interval = max(1, interval)
+        self.window = max(0, int(window))
+        self.validator = validator
+        self.metrics = metrics if metrics is not None else backfill.metrics
+        self.started = time.time()
+        self.counts = {
+            "cycles": 0,
+            "failed_cycles": 0,
+            "downloaded": 0,
+            "uploaded": 0,
+            "failed_uploads": 0,
+        }
+        self.last_cycle = None
+        self.last_success = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def query_dates(self, today=None):
+        """
+        List the days a cycle queries.
+
+        Args:
+            today (datetime.date, optional): The current date. Defaults to today.
+
+        Returns:
+            tuple: The first and last date in YYYYMMDD format.
+        """
+        if today is None:
+            today = datetime.today()
+
+        return (
+            (today - timedelta(days=self.window)).strftime("%Y%m%d"),
+            today.strftime("%Y%m%d"),
+        )
+
+    def run_cycle(self):
+        """
+        Download, validate and upload the images of today and the trailing window.
+
+        Returns:
+            dict: The start, end and duration of the cycle, the images downloaded, the
+            files uploaded and failed, and the error that ended the cycle, or None.
+        """
+        cycle = {
+            "started": time.time(),
+            "finished": None,
+            "seconds": None,
+            "downloaded": 0,
+            "uploaded": 0,
+            "failed_uploads": 0,
+            "error": None,
+        }
+
+        try:
+            start_date, end_date = self.query_dates()
+            summary = self.backfill.run(start_date, end_date, recheck=True)
+            cycle["downloaded"] = summary["downloaded"]
+            if summary["incomplete_days"]:
+                cycle["error"] = "Incomplete days: %s" % ", ".join(
+                    summary["incomplete_days"]
+                )
+
+            if self.validator is not None:
+                self.validator.validate()
+
+            summary = self.s3.upload_directory(self.bucket_name, self.path)
+            cycle["uploaded"] = summary["uploaded"]
+            cycle["failed_uploads"] = summary["failed"]
+            if summary["failed"] > 0 and cycle["error"] is None:
+                cycle["error"] = "Failed to upload %d files." % summary["failed"]
+        except Exception as e:
+            traceback.print_exc()
+            cycle["error"] = "%s: %s" % (type(e).__name__, e)
+
+        cycle["finished"] = time.time()
+        cycle["seconds"] = cycle["finished"] - cycle["started"]
+
+        with self.lock:
+            self.counts["cycles"] += 1
+            self.counts["downloaded"] += cycle["downloaded"]
+            self.counts["uploaded"] += cycle["uploaded"]
+            self.counts["failed_uploads"] += cycle["failed_uploads"]
+            if cycle["error"] is None:
+                self.last_success = cycle["finished"]
+            else:
+                self.counts["failed_cycles"] += 1
+            self.last_cycle = cycle
+
+        print(
+            f"Cycle {self.counts['cycles']}: downloaded {cycle['downloaded']} images, "
+            f"uploaded {cycle['uploaded']} files in {cycle['seconds']:.1f} seconds"
+        )
+        if cycle["error"] is not None:
+            print(f"Cycle {self.counts['cycles']} failed: {cycle['error']}")
+
+        return cycle
+
+    def run(self, cycles=None):
+        """
+        Run a cycle every interval seconds until stop is called. A cycle that runs
+        longer than the interval is followed straight away by the next one.
+
+        Args:
+            cycles (int, optional): The number of cycles to run before returning.
+                Defaults to None, which runs until stopped.
+
+        Returns:
+            int: The number of cycles run.
+        """
+        run = 0
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            self.run_cycle()
+            run += 1
+            if cycles is not None and run >= cycles:
+                break
+            self.stopping.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+        return run
+
+    def stop(self, *args):
+        """
+        Stop the daemon after the cycle in progress. Can be installed as a signal
+        handler.
+
+        Returns:
+            None
+        """
+        self.stopping.set()
+
+        return None
+
+    def health(self):
+        """
+        Check whether the daemon is keeping up.
+
+        The daemon is healthy until its first cycle ends, and afterwards while a cycle
+        has succeeded in the last STALE_CYCLES intervals.
+
+        Returns:
+            dict: Whether the daemon is healthy, its uptime, the counts, the time of
+            the last successful cycle and the last cycle.
+        """
+        now = time.time()
+        with self.lock:
+            if self.last_success is not None:
+                since = self.last_success
+            elif self.last_cycle is None:
+                since = self.started
+            else:
+                since = None
+
+            return {
+                "healthy": since is not None
+                and now - since <= STALE_CYCLES * self.interval,
+                "uptime_seconds": now - self.started,
+                "counts": dict(self.counts),
+                "last_success": self.last_success,
+                "last_cycle": self.last_cycle,
+            }
+
+    def prometheus(self):
+        """
+        Format the transfer metrics and the counts of the daemon in the Prometheus
+        text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        with self.lock:
+            counts = dict(self.counts, last_success_timestamp=self.last_success or 0)
+
+        return self.metrics.prometheus("daemon", self.metrics.summary(**counts))
+
+    def serve(self, address="127.0.0.1", port=9337):
+        """
+        Serve /healthz and /metrics in a background thread.
+
+        /healthz answers the health as JSON, with status 200 when healthy and 503 when
+        not. /metrics answers the Prometheus metrics.
+
+        Args:
+            address (str, optional): The address to listen on. Defaults to 127.0.0.1.
+            port (int, optional): The port to listen on, or 0 for any free port.
+                Defaults to 9337.
+
+        Returns:
+            http.server.ThreadingHTTPServer: The server, to shut down when done.
+        """
+        server = ThreadingHTTPServer((address, port), make_handler(self))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        return server
+
+
+def make_handler(daemon):
+    """
+    Create the request handler class of the health and metrics endpoint.
+
+    Args:
+        daemon (Daemon): The daemon to report on.
+
+    Returns:
+        type: A BaseHTTPRequestHandler subclass.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/healthz":
+                health = daemon.health()
+                body = (json.dumps(health, indent=4) + "\n").encode()
+                status = 200 if health["healthy"] else 503
+                content_type = "application/json"
+            elif self.path == "/metrics":
+                body = daemon.prometheus().encode()
+                status = 200
+                content_type = "text/plain; version=0.0.4"
+            else:
+                body = b"Not found\n"
+                status = 404
+                content_type = "text/plain"
+
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import time
+from urllib3.util.retry import Retry
+
+# Responses that mean the server wants fewer requests
+THROTTLE_STATUSES = (429, 503)
+
+
+class AdaptiveLimiter:
+    """
+    A concurrency limit that adapts to the server with additive increase,
+    multiplicative decrease (AIMD).
+
+    Used as a context manager around each transfer, like a semaphore. Each transfer
+    that finishes within ``latency_factor`` times the fastest one seen so far raises
+    the limit by 1 / limit, so the limit grows by about one for every ``limit``
+    transfers. backoff, called on a throttling response, a timeout, a connection
+    error or a failed transfer, halves the limit, at most once per ``cooldown``
+    seconds so a burst of failures from the same moment only counts once. A transfer
+    that backed off does not raise the limit when it ends.
+
+    Args:
+        initial (int): The starting limit.
+        maximum (int): The largest limit.
+        minimum (int, optional): The smallest limit. Defaults to 1.
+        decrease (float, optional): The factor the limit is multiplied by on backoff.
+            Defaults to 0.5.
+        latency_factor (float, optional): Transfers slower than this many times the
+            fastest one do not raise the limit. Defaults to 2.
+        cooldown (float, optional): The seconds after a decrease in which further
+            backoff calls are ignored. Defaults to 1.
+
+    Attributes:
+        limit (float): The current limit.
+        active (int): The number of transfers in progress.
+        decreases (int): The number of times the limit was decreased.
+    """
+
+    def __init__(
+        self,
+        initial,
+        maximum,
+        minimum=1,
+        decrease=0.5,
+        latency_factor=2.0,
+        cooldown=1.0,
+    ):
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.limit = float(min(max(int(initial), self.minimum), self.maximum))
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.active = 0
+        self.decreases = 0
+        self.fastest = None
+        self.last_decrease = None
+        self.started = threading.local()
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+        self.started.time = time.monotonic()
+        self.started.failed = False
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        latency = time.monotonic() - self.started.time
+
+        with self.condition:
+            self.active -= 1
+            if exc_type is None and not self.started.failed:
+                self.increase(latency)
+            self.condition.notify_all()
+
+        return False
+
+    def increase(self, latency):
+        """
+        Raise the limit after a transfer that finished in good time. Called with the
+        condition held.
+
+        Args:
+            latency (float): The seconds the transfer took.
+
+        Returns:
+            None
+        """
+        if self.fastest is None or latency < self.fastest:
+            self.fastest = latency
+
+        if latency <= self.fastest * self.latency_factor:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+        return None
+
+    def backoff(self):
+        """
+        Reduce the limit after a sign of overload, and keep the transfer of the
+        calling thread from raising it.
+
+        Returns:
+            None
+        """
+        now = time.monotonic()
+        self.started.failed = True
+
+        with self.condition:
+            if (
+                self.last_decrease is not None
+                and now - self.last_decrease < self.cooldown
+            ):
+                return None
+
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self.last_decrease = now
+            self.decreases += 1
+
+        return None
+
+
+class AdaptiveRetry(Retry):
+    """
+    A urllib3 Retry that tells an AdaptiveLimiter about every throttling response,
+    timeout and connection error before it is retried.
+
+    Args:
+        limiter (AdaptiveLimiter, optional): The limiter to notify. Defaults to None.
+        on_retry (callable, optional): Called with the URL of every request that is
+            retried. Defaults to None.
+    """
+
+    def __init__(self, *args, limiter=None, on_retry=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+        self.on_retry = on_retry
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.limiter = self.limiter
+        retry.on_retry = self.on_retry
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, **kwargs):
+        if self.limiter is not None:
+            if error is not None or (
+                response is not None and response.status in THROTTLE_STATUSES
+            ):
+                self.limiter.backoff()
+
+        retry = super().increment(method, url, response, error, **kwargs)
+        if self.on_retry is not None:
+            self.on_retry(url)
+
+        return retry
+
+
+class TokenBucket:
+    """
+    A bytes-per-second limit shared by the threads of a transfer.
+
+    consume takes tokens for the bytes about to be sent or received and sleeps
+    until the bucket has refilled enough to pay for them.
+
+    Args:
+        rate (int): The bytes per second allowed.
+        burst (int, optional): The bytes that can be transferred at once after a
+            pause. Defaults to one second at ``rate``.
+
+    Attributes:
+        rate (int): The bytes per second allowed.
+        capacity (int): The size of the bucket in bytes.
+        tokens (float): The bytes that can be transferred without waiting.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        Take tokens for a number of bytes, waiting until they are available.
+
+        Args:
+            amount (int): The number of bytes.
+
+        Returns:
+            float: The seconds spent waiting.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+
+class ThrottledReader:
+    """
+    A read-only file wrapper that limits how fast the file is read with a TokenBucket.
+
+    Args:
+        f (file): The file to wrap, opened in binary mode.
+        bandwidth (TokenBucket): The bandwidth limit.
+    """
+
+    def __init__(self, f, bandwidth):
+        self.f = f
+        self.bandwidth = bandwidth
+
+    def read(self, size=-1):
+        chunk = self.f.read(size)
+        self.bandwidth.consume(len(chunk))
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+
+def bandwidth_limit(rate):
+    """
+    Create a TokenBucket for a bytes-per-second rate.
+
+    Args:
+        rate (int): The bytes per second allowed, or 0 for no limit.
+
+    Returns:
+        TokenBucket: The bandwidth limit, or None if rate is 0.
+    """
+    if not rate:
+        return None
+
+    return TokenBucket(rate)
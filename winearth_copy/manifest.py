@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import glob
+import json
+import os
+import tempfile
+import threading
+
+# Directory under the download path that holds state kept between runs
+STATE_DIRECTORY = ".winearth"
+
+
+class Manifest:
+    """
+    A per-day record of the size, modification time and MD5 hash of downloaded files.
+
+    The manifest is written to ``<path>/.winearth/manifest-<query_date>.json`` and is
+    keyed by the path of each file relative to ``path``.
+
+    Args:
+        path (str): The base path files are downloaded to.
+        query_date (str): The date the files were queried for in YYYYMMDD format.
+
+    Attributes:
+        path (str): The base path files are downloaded to.
+        query_date (str): The date the files were queried for.
+        manifest_file (str): The path to the manifest file.
+        entries (dict): The manifest entries keyed by relative path.
+
+    """
+
+    def __init__(self, path, query_date):
+        self.path = path
+        self.query_date = query_date
+        self.manifest_file = os.path.join(
+            path, STATE_DIRECTORY, "manifest-%s.json" % query_date
+        )
+        self.entries = read_manifest(self.manifest_file)
+        self.lock = threading.Lock()
+
+    def record(self, file_path, md5):
+        """
+        Record the size, modification time and MD5 hash of a file.
+
+        Args:
+            file_path (str): The path to the file.
+            md5 (str): The MD5 hash of the file.
+
+        Returns:
+            None
+
+        """
+        stat = os.stat(file_path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5": md5}
+
+        with self.lock:
+            self.entries[os.path.relpath(file_path, self.path)] = entry
+
+    def save(self):
+        """
+        Write the manifest file, replacing any previous version atomically.
+
+        Returns:
+            None
+
+        """
+        with self.lock:
+            if not self.entries:
+                return None
+
+            directory = os.path.dirname(self.manifest_file)
+            os.makedirs(directory, exist_ok=True)
+
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.manifest_file)
+
+        return None
+
+
+def read_manifest(manifest_file):
+    """
+    Read a manifest file.
+
+    Args:
+        manifest_file (str): The path to the manifest file.
+
+    Returns:
+        dict: The manifest entries, or an empty dictionary if the file is missing or
+        not valid JSON.
+
+    """
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.decoder.JSONDecodeError:
+        return {}
+
+
+def read_manifests(path):
+    """
+    Read and merge every manifest under a download path.
+
+    Args:
+        path (str): The base path files are downloaded to.
+
+    Returns:
+        dict: The merged manifest entries keyed by relative path.
+
+    """
+    entries = {}
+    for manifest_file in sorted(
+        glob.glob(os.path.join(path, STATE_DIRECTORY, "manifest-*.json"))
+    ):
+        entries.update(read_manifest(manifest_file))
+
+    return entries
+
+
+def lookup_md5(entries, path, file_path):
+    """
+    Look up the MD5 hash of a file in manifest entries.
+
+    The hash is only trusted if the size and modification time of the file still
+    match the manifest entry.
+
+    Args:
+        entries (dict): The manifest entries keyed by relative path.
+        path (str): The base path the entries are relative to.
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The MD5 hash of the file, or None if it is unknown or out of date.
+
+    """
+    entry = entries.get(os.path.relpath(file_path, path))
+    if entry is None:
+        return None
+
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+        return None
+
+    return entry["md5"]
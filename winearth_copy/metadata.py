@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# Values of the metadata_format configuration key
+JSON = "json"
+JSON_LINES = "jsonl"
+METADATA_FORMATS = (JSON, JSON_LINES)
+
+
+def metadata_lines_name(query_date):
+    """
+    Get the name of the JSON Lines metadata file for a query date.
+
+    Args:
+        query_date (str): The date in YYYYMMDD format.
+
+    Returns:
+        str: The file name.
+    """
+    return "metadata-%s.jsonl" % query_date
+
+
+def metadata_lines_date(file_name):
+    """
+    Get the query date from the name of a JSON Lines metadata file.
+
+    Args:
+        file_name (str): The file name.
+
+    Returns:
+        str: The date in YYYYMMDD format, or None if the name is not a JSON Lines
+        metadata file name.
+    """
+    if file_name.startswith("metadata-") and file_name.endswith(".jsonl"):
+        return file_name[len("metadata-") : -len(".jsonl")]
+
+    return None
+
+
+class MetadataLines:
+    """
+    Collects the metadata records for a query date into one JSON Lines file per
+    image directory.
+
+    Records are encoded compactly as they are added and each file is written in a
+    single buffered write to a temporary file that atomically replaces
+    ``<path>/<images.directory>/metadata-<query_date>.jsonl``.
+
+    Args:
+        query_date (str): The date the records were queried for in YYYYMMDD format.
+
+    Attributes:
+        query_date (str): The date the records were queried for.
+        lines (dict): The encoded records for each image directory.
+    """
+
+    def __init__(self, query_date):
+        self.query_date = query_date
+        self.lines = {}
+        self.lock = threading.Lock()
+
+    def add(self, image_data):
+        """
+        Add the metadata record of an image.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+
+        Returns:
+            None
+        """
+        line = json.dumps(image_data, separators=(",", ":")).encode() + b"\n"
+
+        with self.lock:
+            self.lines.setdefault(image_data["images.directory"], []).append(line)
+
+    def documents(self):
+        """
+        Join the records of each image directory into a JSON Lines document.
+
+        Returns:
+            dict: The document for each image directory.
+        """
+        with self.lock:
+            return {
+                directory: b"".join(lines) for directory, lines in self.lines.items()
+            }
+
+    def save(self, path, unchanged=None):
+        """
+        Write the JSON Lines file for each image directory.
+
+        Args:
+            path (str): The base path where files are saved.
+            unchanged (callable, optional): Called with the image directory, the path
+                to the file and the MD5 hash of its new content. Files it returns True
+                for are not written again. Defaults to None.
+
+        Returns:
+            list: Tuples of the image directory, the path to the file and its MD5 hash,
+            for the files that were written.
+        """
+        saved = []
+
+        for directory, document in self.documents().items():
+            full_path = os.path.join(path, directory)
+            file_path = os.path.join(full_path, metadata_lines_name(self.query_date))
+            md5 = hashlib.md5(document).hexdigest()
+            if unchanged is not None and unchanged(directory, file_path, md5):
+                continue
+
+            os.makedirs(full_path, exist_ok=True)
+
+            fd, temp_path = tempfile.mkstemp(
+                dir=full_path, prefix=".metadata-", suffix=".tmp"
+            )
+            with os.fdopen(fd, "wb") as f:
+                f.write(document)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, file_path)
+
+            saved.append((directory, file_path, md5))
+
+        return saved
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Phases of a transfer, in the order a file moves through them
+PHASE_LIST = "list"
+PHASE_METADATA = "metadata"
+PHASE_DOWNLOAD = "download"
+PHASE_HASH = "hash"
+PHASE_PUT = "put"
+PHASE_VERIFY = "verify"
+PHASE_DELETE = "delete"
+PHASES = (
+    PHASE_LIST,
+    PHASE_METADATA,
+    PHASE_DOWNLOAD,
+    PHASE_HASH,
+    PHASE_PUT,
+    PHASE_VERIFY,
+    PHASE_DELETE,
+)
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+
+class Histogram:
+    """
+    A cumulative latency histogram with fixed buckets, as Prometheus exposes them.
+
+    Args:
+        buckets (tuple, optional): The upper bounds of the buckets in seconds.
+            Defaults to LATENCY_BUCKETS.
+
+    Attributes:
+        buckets (tuple): The upper bounds of the buckets.
+        counts (list): The number of observations in each bucket, not cumulative,
+            with a last bucket for observations above the largest bound.
+        count (int): The number of observations.
+        sum (float): The sum of the observations.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Add an observation.
+
+        Args:
+            value (float): The observed latency in seconds.
+
+        Returns:
+            None
+        """
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+        return None
+
+    def cumulative(self):
+        """
+        Get the cumulative count of each bucket.
+
+        Returns:
+            list: Tuples of the upper bound, "+Inf" for the last bucket, and the number
+            of observations less than or equal to it.
+        """
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            cumulative.append((bound, total))
+
+        return cumulative
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimated latency in seconds, or None if nothing was observed.
+        """
+        if self.count == 0:
+            return None
+
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound if bound != "+Inf" else self.buckets[-1]
+
+        return self.buckets[-1]
+
+
+class Timing:
+    """
+    The measurement of one operation, returned by Metrics.time.
+
+    Attributes:
+        bytes (int): The bytes transferred, set by the caller.
+        failed (bool): Set by the caller when the operation failed without raising.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.failed = False
+
+    def count(self, chunks):
+        """
+        Add the size of each chunk of a stream to bytes as it passes through.
+
+        Args:
+            chunks (iterable): The data as an iterable of bytes.
+
+        Yields:
+            bytes: The chunks.
+        """
+        for chunk in chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+
+class Metrics:
+    """
+    Transfer metrics for a run, shared by the downloaders and uploaders of a command.
+
+    Each phase (list, metadata, download, hash, put, verify and delete) has a latency
+    histogram of the operations that succeeded, and counts of the bytes transferred,
+    errors and retries. The metrics can be written as a JSON run summary and as a
+    Prometheus textfile collector file.
+
+    Attributes:
+        started (float): The time.time() the run started at.
+        latencies (dict): The Histogram of each phase.
+        bytes (dict): The bytes transferred in each phase.
+        errors (dict): The number of failed operations in each phase.
+        retries (dict): The number of retried requests in each phase.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.latencies = {phase: Histogram() for phase in PHASES}
+        self.bytes = dict.fromkeys(PHASES, 0)
+        self.errors = dict.fromkeys(PHASES, 0)
+        self.retries = dict.fromkeys(PHASES, 0)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def time(self, phase):
+        """
+        Measure an operation. An operation that raises, or whose Timing is marked as
+        failed, counts as an error instead of adding to the latency histogram.
+
+        Args:
+            phase (str): The phase of the operation.
+
+        Yields:
+            Timing: The measurement, to set the bytes transferred on.
+        """
+        timing = Timing()
+        start = time.monotonic()
+        try:
+            yield timing
+        except BaseException:
+            self.error(phase)
+            raise
+
+        if timing.failed:
+            self.error(phase)
+        else:
+            self.observe(phase, time.monotonic() - start, timing.bytes)
+
+    def observe(self, phase, seconds, size=0):
+        """
+        Record an operation that succeeded.
+
+        Args:
+            phase (str): The phase of the operation.
+            seconds (float): How long the operation took.
+            size (int, optional): The bytes transferred. Defaults to 0.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.latencies[phase].observe(seconds)
+            self.bytes[phase] += size
+
+        return None
+
+    def error(self, phase):
+        """
+        Record an operation that failed.
+
+        Args:
+            phase (str): The phase of the operation.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.errors[phase] += 1
+
+        return None
+
+    def retry(self, phase):
+        """
+        Record a request that is retried.
+
+        Args:
+            phase (str): The phase of the request.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.retries[phase] += 1
+
+        return None
+
+    def summary(self, **counts):
+        """
+        Build the run summary.
+
+        Args:
+            **counts: Totals from the command, such as the number of images found,
+                included as they are.
+
+        Returns:
+            dict: The start and end of the run, its duration, the totals and, for each
+            phase, the number of operations, errors and retries, bytes, throughput and
+            latency quantiles and histogram buckets.
+        """
+        finished = time.time()
+        seconds = max(finished - self.started, 1e-9)
+        phases = {}
+
+        with self.lock:
+            for phase in PHASES:
+                histogram = self.latencies[phase]
+                phases[phase] = {
+                    "count": histogram.count,
+                    "errors": self.errors[phase],
+                    "retries": self.retries[phase],
+                    "bytes": self.bytes[phase],
+                    "bytes_per_second": self.bytes[phase] / seconds,
+                    "files_per_second": histogram.count / seconds,
+                    "latency_seconds": {
+                        "sum": histogram.sum,
+                        "mean": (
+                            histogram.sum / histogram.count if histogram.count else None
+                        ),
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95),
+                        "p99": histogram.quantile(0.99),
+                        "buckets": {
+                            str(bound): total for bound, total in histogram.cumulative()
+                        },
+                    },
+                }
+
+        return {
+            "started": self.started,
+            "finished": finished,
+            "seconds": seconds,
+            "counts": counts,
+            "phases": phases,
+        }
+
+    def prometheus(self, command, summary):
+        """
+        Format a run summary in the Prometheus text exposition format.
+
+        Args:
+            command (str): The command, used as the command label.
+            summary (dict): The run summary from summary.
+
+        Returns:
+            str: The metrics.
+        """
+        phases = summary["phases"]
+        lines = []
+
+        def header(metric, kind, help):
+            lines.append(f"# HELP {metric} {help}")
+            lines.append(f"# TYPE {metric} {kind}")
+
+        def sample(metric, value, **labels):
+            labels = ",".join(
+                f'{key}="{label}"'
+                for key, label in {"command": command, **labels}.items()
+            )
+            lines.append(f"{metric}{{{labels}}} {value}")
+
+        name = "winearth_transfer_duration_seconds"
+        header(name, "histogram", "Latency of the file operations of each phase.")
+        for phase in PHASES:
+            latency = phases[phase]["latency_seconds"]
+            for bound, total in latency["buckets"].items():
+                sample(f"{name}_bucket", total, phase=phase, le=bound)
+            sample(f"{name}_sum", latency["sum"], phase=phase)
+            sample(f"{name}_count", phases[phase]["count"], phase=phase)
+
+        for key, help in (
+            ("bytes", "Bytes transferred by each phase."),
+            ("errors", "Failed operations of each phase."),
+            ("retries", "Retried requests of each phase."),
+        ):
+            name = f"winearth_transfer_{key}_total"
+            header(name, "counter", help)
+            for phase in PHASES:
+                sample(name, phases[phase][key], phase=phase)
+
+        header("winearth_run_duration_seconds", "gauge", "Duration of the last run.")
+        sample("winearth_run_duration_seconds", summary["seconds"])
+        header(
+            "winearth_run_finished_timestamp_seconds",
+            "gauge",
+            "Time the last run finished.",
+        )
+        sample("winearth_run_finished_timestamp_seconds", summary["finished"])
+
+        header("winearth_run_count", "gauge", "Totals reported by the last run.")
+        for key, value in summary["counts"].items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                sample("winearth_run_count", value, name=key)
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, command, json_path=None, prometheus_directory=None, **counts):
+        """
+        Write the JSON run summary and the Prometheus textfile collector file.
+
+        Both files are written to a temporary file that atomically replaces the
+        previous one, so a collector never reads a partial file.
+
+        Args:
+            command (str): The command, such as "download".
+            json_path (str, optional): The path to write the JSON summary to.
+            prometheus_directory (str, optional): The textfile collector directory to
+                write ``winearth_<command>.prom`` to.
+            **counts: Totals from the command, passed to summary.
+
+        Returns:
+            dict: The run summary.
+        """
+        summary = self.summary(**counts)
+
+        if json_path:
+            write_atomic(json_path, json.dumps(summary, indent=4) + "\n")
+        if prometheus_directory:
+            write_atomic(
+                os.path.join(prometheus_directory, f"winearth_{command}.prom"),
+                self.prometheus(command, summary),
+            )
+
+        return summary
+
+
+def write_atomic(path, text):
+    """
+    Write a text file by atomically replacing it with a temporary file.
+
+    Args:
+        path (str): The path to the file.
+        text (str): The contents.
+
+    Returns:
+        None
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return None
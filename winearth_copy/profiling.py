@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Functions listed in the text report, by cumulative time
+REPORT_LIMIT = 50
+
+
+class Profiler:
+    """
+    Profiles a command run with cProfile and times its stages.
+
+    With a directory, start enables cProfile for the calling thread and every thread
+    started afterwards, such as the download and upload workers, and stop writes
+    ``<command>.prof`` for pstats, snakeviz or gprof2dot, ``<command>-profile.txt``
+    with the functions that took the most cumulative time, and
+    ``<command>-phases.json`` with the wall-clock time of each stage and transfer
+    phase. Without one, every method does nothing, so a run that is not profiled
+    pays nothing for it.
+
+    Args:
+        directory (str): The directory to write the profile to, or None to not profile.
+        command (str): The command, such as "download", used to name the files.
+
+    Attributes:
+        directory (str): The directory to write the profile to, or None.
+        command (str): The command.
+        stages (dict): The wall-clock seconds of each stage.
+    """
+
+    def __init__(self, directory, command):
+        self.directory = directory
+        self.command = command
+        self.stages = {}
+        self.profile = None
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        self.started = None
+
+    def start(self):
+        """
+        Start profiling.
+
+        Returns:
+            None
+        """
+        if self.directory is None:
+            return None
+
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+        # cProfile only follows the thread that enables it before Python 3.12
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.profile_thread)
+
+        return None
+
+    def profile_thread(self, frame, event, arg):
+        """
+        Give a new thread its own cProfile profile. Installed with threading.setprofile,
+        so it is called once at the start of each thread, and replaced by the profile
+        it enables.
+
+        Returns:
+            None
+        """
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+        return None
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Add the wall-clock time the context is open to a stage.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def stage(self, name):
+        """
+        Time a stage of the command, such as the transfers or the image validation.
+
+        Args:
+            name (str): The name of the stage.
+
+        Returns:
+            A context manager that adds the wall-clock time it is open to the stage.
+        """
+        if self.directory is None:
+            return nullcontext()
+
+        return self.timer(name)
+
+    def stop(self, metrics=None):
+        """
+        Stop profiling and write the profile, the report and the phase timers.
+
+        Args:
+            metrics (winearth_copy.metrics.Metrics, optional): The transfer metrics of
+                the run, whose time in each phase is added to the phase timers.
+
+        Returns:
+            list: The paths of the files written, empty when not profiling.
+        """
+        if self.profile is None:
+            return []
+
+        threading.setprofile(None)
+        self.profile.disable()
+        seconds = time.perf_counter() - self.started
+
+        stats = pstats.Stats(self.profile)
+        with self.lock:
+            for profile in self.thread_profiles:
+                stats.add(profile)
+        self.profile = None
+        self.thread_profiles = []
+
+        phases = {"command": self.command, "seconds": seconds, "stages": self.stages}
+        if metrics is not None:
+            summary = metrics.summary()
+            phases["transfer_phases"] = {
+                phase: {
+                    "count": values["count"],
+                    "errors": values["errors"],
+                    "seconds": values["latency_seconds"]["sum"],
+                }
+                for phase, values in summary["phases"].items()
+            }
+
+        os.makedirs(self.directory, exist_ok=True)
+        prof_path = os.path.join(self.directory, f"{self.command}.prof")
+        report_path = os.path.join(self.directory, f"{self.command}-profile.txt")
+        phases_path = os.path.join(self.directory, f"{self.command}-phases.json")
+
+        stats.dump_stats(prof_path)
+
+        report = io.StringIO()
+        stats.stream = report
+        stats.sort_stats("cumulative").print_stats(REPORT_LIMIT)
+        with open(report_path, "w") as f:
+            f.write(report.getvalue())
+
+        with open(phases_path, "w") as f:
+            json.dump(phases, f, indent=4)
+            f.write("\n")
+
+        print(f"Wrote profile to {prof_path}")
+
+        return [prof_path, report_path, phases_path]
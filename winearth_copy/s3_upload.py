@@ -1,9 +1,117 @@
 #!/usr/bin/env python
 
-import boto3
-import botocore
+import base64
+import botocore.exceptions
 import hashlib
 import os
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from winearth_copy.limits import THROTTLE_STATUSES, AdaptiveLimiter, ThrottledReader
+from winearth_copy.manifest import lookup_md5, read_manifests
+from winearth_copy.metrics import (
+    PHASE_DELETE,
+    PHASE_HASH,
+    PHASE_LIST,
+    PHASE_PUT,
+    PHASE_VERIFY,
+    Metrics,
+)
+from winearth_copy.state import DELETED, DOWNLOADED, UPLOADED, VERIFIED
+from winearth_copy.watch import open_watcher
+
+# S3 allows at most 10000 parts in a multipart upload
+MAX_PARTS = 10000
+
+# Seconds a watched file waits for the downloader to record it in the state database
+# before it is added as a file from another source
+WATCH_SETTLE = 60
+
+
+def directory_prefixes(files):
+    """
+    Get the key prefixes to list for the directories of a set of files.
+
+    A directory that is inside another one in the set is left out, since listing
+    the outer prefix also lists its objects.
+
+    Args:
+        files (list): Tuples that start with the path to a file, as returned by
+            S3Upload.list_files.
+
+    Returns:
+        list: The sorted prefixes, each ending with a separator.
+
+    """
+    prefixes = []
+    for prefix in sorted(
+        {os.path.join(os.path.dirname(file[0]), "") for file in files}
+    ):
+        if not prefixes or not prefix.startswith(prefixes[-1]):
+            prefixes.append(prefix)
+
+    return prefixes
+
+
+class HashingReader:
+    """
+    A read-only file wrapper that calculates the MD5 hash of the data as it is read.
+
+    Reads that go back over data already hashed, such as a retry after seek(0), are
+    not hashed twice.
+
+    Args:
+        f (file): The file to wrap, opened in binary mode.
+
+    Attributes:
+        f (file): The wrapped file.
+        hash_md5 (hashlib.md5): The hash of the data read so far.
+        hashed (int): The number of bytes from the start of the file that are hashed.
+
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.hash_md5 = hashlib.md5()
+        self.hashed = 0
+        self.position = 0
+
+    def read(self, size=-1):
+        chunk = self.f.read(size)
+        start = self.position
+        self.position += len(chunk)
+
+        if start <= self.hashed < self.position:
+            self.hash_md5.update(chunk[self.hashed - start :])
+            self.hashed = self.position
+
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.position = self.f.seek(offset, whence)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def finish(self, buffer_size):
+        """
+        Hash whatever part of the file has not been read yet.
+
+        Args:
+            buffer_size (int): The read size in bytes.
+
+        Returns:
+            str: The MD5 hash of the whole file.
+
+        """
+        self.seek(self.hashed)
+        while self.read(buffer_size):
+            pass
+
+        return self.hash_md5.hexdigest()
 
 
 class S3Upload:
@@ -15,27 +123,154 @@ class S3Upload:
         aws_secret_access_key (str): The AWS secret access key.
         s3_host (str): The S3 host URL.
         addressing_style (str, optional): The S3 addressing style. Defaults to "auto".
+        concurrency (int, optional): The number of files uploaded at the same time. Defaults to 1.
+        multipart_threshold (int, optional): Files of at least this many bytes are uploaded
+            with multipart upload. Defaults to 64 MiB.
+        multipart_chunksize (int, optional): The multipart part size in bytes. Defaults to 16 MiB.
+        multipart_concurrency (int, optional): The number of parts of one file uploaded at
+            the same time. Defaults to 4.
+        read_buffer_size (int, optional): The buffer size in bytes for reading files.
+            Defaults to 1 MiB.
+        state (winearth_copy.state.TransferState, optional): The state database that
+            lists the files to upload. Defaults to None, which walks the directory.
+        limiter (optional): A context manager, such as an AdaptiveLimiter, held while a
+            file is uploaded. Defaults to None.
+        bandwidth (winearth_copy.limits.TokenBucket, optional): The upload bandwidth
+            limit. Defaults to None.
+        metrics (winearth_copy.metrics.Metrics, optional): The transfer metrics to add
+            to. Defaults to new metrics.
 
     Attributes:
         aws_access_key_id (str): The AWS access key ID.
         aws_secret_access_key (str): The AWS secret access key.
         s3_host (str): The S3 host URL.
         addressing_style (str): The S3 addressing style.
-        s3 (boto3.resources.factory.s3.ServiceResource): The S3 resource.
+        concurrency (int): The number of files uploaded at the same time.
+        multipart_threshold (int): The multipart upload threshold in bytes.
+        multipart_chunksize (int): The multipart part size in bytes.
+        multipart_concurrency (int): The number of parts of one file uploaded at the same time.
+        read_buffer_size (int): The buffer size in bytes for reading files.
+        state (winearth_copy.state.TransferState): The state database, or None.
+        limiter: The context manager held while a file is uploaded, or None.
+        bandwidth (winearth_copy.limits.TokenBucket): The upload bandwidth limit, or None.
+        metrics (winearth_copy.metrics.Metrics): The transfer metrics.
+        s3 (boto3.resources.factory.s3.ServiceResource): The S3 resource, created
+            the first time it is used.
+        request_counts (collections.Counter): The number of S3 API calls made, by operation.
 
     """
 
     def __init__(
-        self, aws_access_key_id, aws_secret_access_key, s3_host, addressing_style
+        self,
+        aws_access_key_id,
+        aws_secret_access_key,
+        s3_host,
+        addressing_style,
+        concurrency=1,
+        multipart_threshold=64 * 1024 * 1024,
+        multipart_chunksize=16 * 1024 * 1024,
+        multipart_concurrency=4,
+        read_buffer_size=1024 * 1024,
+        state=None,
+        limiter=None,
+        bandwidth=None,
+        metrics=None,
     ):
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
         self.s3_host = s3_host
         self.addressing_style = addressing_style
+        self.concurrency = max(1, int(concurrency))
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.multipart_concurrency = max(1, int(multipart_concurrency))
+        self.read_buffer_size = read_buffer_size
+        self.state = state
+        self.limiter = limiter
+        self.bandwidth = bandwidth
+        self.metrics = metrics if metrics is not None else Metrics()
 
-        self.s3 = self.s3_auth(
-            aws_access_key_id, aws_secret_access_key, s3_host, addressing_style
-        )
+        self.resource = None
+        self.resource_lock = threading.Lock()
+
+        self.request_counts = Counter()
+        self.request_counts_lock = threading.Lock()
+
+    @property
+    def s3(self):
+        """
+        The S3 resource. Building it loads the botocore service models, which is most
+        of the cost of starting an upload, so it is done on the first request rather
+        than when the uploader is created.
+
+        Returns:
+            boto3.resources.factory.s3.ServiceResource: The S3 resource.
+
+        """
+        with self.resource_lock:
+            if self.resource is None:
+                resource = self.s3_auth(
+                    self.aws_access_key_id,
+                    self.aws_secret_access_key,
+                    self.s3_host,
+                    self.addressing_style,
+                )
+                events = resource.meta.client.meta.events
+                events.register("before-parameter-build.s3", self.count_request)
+                events.register("needs-retry.s3", self.observe_retry)
+                self.resource = resource
+
+        return self.resource
+
+    def count_request(self, model, **kwargs):
+        """
+        Count an S3 API call. Registered as a botocore event handler.
+
+        Args:
+            model (botocore.model.OperationModel): The operation being called.
+
+        Returns:
+            None
+
+        """
+        with self.request_counts_lock:
+            self.request_counts[model.name] += 1
+
+    def observe_retry(
+        self, response=None, caught_exception=None, operation=None, **kwargs
+    ):
+        """
+        Tell an AdaptiveLimiter about throttling responses and connection errors, and
+        count them and server errors as retries in ``metrics``. Registered as a
+        botocore event handler; it never changes whether the request is retried.
+
+        Args:
+            response (tuple, optional): The HTTP response and the parsed response.
+            caught_exception (Exception, optional): The error raised by the request.
+            operation (botocore.model.OperationModel, optional): The operation called.
+
+        Returns:
+            None
+
+        """
+        status = None
+        if response is not None:
+            status = response[1].get("ResponseMetadata", {}).get("HTTPStatusCode")
+
+        if caught_exception is not None or status in THROTTLE_STATUSES:
+            if isinstance(self.limiter, AdaptiveLimiter):
+                self.limiter.backoff()
+
+        if caught_exception is not None or (status is not None and status >= 500):
+            name = operation.name if operation is not None else None
+            if name == "ListObjectsV2":
+                self.metrics.retry(PHASE_LIST)
+            elif name == "HeadObject":
+                self.metrics.retry(PHASE_VERIFY)
+            else:
+                self.metrics.retry(PHASE_PUT)
+
+        return None
 
     def md5(self, path):
         """
@@ -49,15 +284,78 @@ class S3Upload:
 
         """
         hash_md5 = hashlib.md5()
+        with self.metrics.time(PHASE_HASH) as timing:
+            try:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(self.read_buffer_size), b""):
+                        hash_md5.update(chunk)
+                        timing.bytes += len(chunk)
+            except Exception as e:
+                print("MD5 error: %s" % e)
+                timing.failed = True
+                return None
+
+        return hash_md5.hexdigest()
+
+    def part_size(self, size):
+        """
+        Calculate the multipart part size for a file.
+
+        Args:
+            size (int): The size of the file in bytes.
+
+        Returns:
+            int: multipart_chunksize, or a larger part size if the file would otherwise
+            need more than 10000 parts.
+
+        """
+        part_size = self.multipart_chunksize
+        while part_size * MAX_PARTS < size:
+            part_size *= 2
+
+        return part_size
+
+    def expected_etag(self, path):
+        """
+        Calculate the ETag S3 will report for a file once it is uploaded.
+
+        Files below multipart_threshold get the MD5 hash of the file. Larger files get
+        the MD5 hash of the concatenated part MD5 digests followed by "-" and the number
+        of parts, which is the ETag S3 assigns to multipart objects.
+
+        Args:
+            path (str): The path to the file.
+
+        Returns:
+            str: The expected ETag of the file.
+
+        """
         try:
-            with open(path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-        except Exception as e:
+            size = os.path.getsize(path)
+        except OSError as e:
             print("MD5 error: %s" % e)
             return None
 
-        return hash_md5.hexdigest()
+        if size < self.multipart_threshold:
+            return self.md5(path)
+
+        part_size = self.part_size(size)
+        part_digests = []
+        with self.metrics.time(PHASE_HASH) as timing:
+            try:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(part_size), b""):
+                        part_digests.append(hashlib.md5(chunk).digest())
+                        timing.bytes += len(chunk)
+            except Exception as e:
+                print("MD5 error: %s" % e)
+                timing.failed = True
+                return None
+
+        return "%s-%d" % (
+            hashlib.md5(b"".join(part_digests)).hexdigest(),
+            len(part_digests),
+        )
 
     def remove_file(self, path):
         """
@@ -70,10 +368,12 @@ class S3Upload:
             None
 
         """
-        try:
-            os.remove(path)
-        except Exception as e:
-            print("Remove file error: %s" % e)
+        with self.metrics.time(PHASE_DELETE) as timing:
+            try:
+                os.remove(path)
+            except Exception as e:
+                print("Remove file error: %s" % e)
+                timing.failed = True
 
         return None
 
@@ -96,24 +396,75 @@ class S3Upload:
         except botocore.exceptions.ClientError as e:
             print("S3 ClientError: %s" % e)
             return None
+        except botocore.exceptions.BotoCoreError as e:
+            print("S3 Error: %s" % e)
+            return None
 
         return etag
 
-    def upload_object(self, bucket_name, object):
+    def put_file(self, bucket_name, object, md5=None):
+        """
+        Upload a file to a bucket, hashing it while it is sent.
+
+        Files of at least multipart_threshold bytes are sent with upload_multipart. The
+        file is read from disk once.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The path to the file.
+            md5 (str, optional): The known MD5 hash of the file. When given, the file is
+                not hashed again and Content-MD5 is sent so S3 rejects the upload if the
+                body it receives does not match.
+
+        Returns:
+            tuple: The put_object or complete_multipart_upload response and the ETag
+            calculated from the data that was read.
+
+        Raises:
+            botocore.exceptions.ClientError: If S3 rejects a request.
+            OSError: If the file can not be read.
+
+        """
+        if os.path.getsize(object) >= self.multipart_threshold:
+            return self.upload_multipart(bucket_name, object)
+
+        # The low-level client is thread-safe, unlike the resource objects
+        with open(object, "rb", buffering=self.read_buffer_size) as f:
+            if self.bandwidth is not None:
+                f = ThrottledReader(f, self.bandwidth)
+
+            if md5 is not None:
+                response = self.s3.meta.client.put_object(
+                    Bucket=bucket_name,
+                    Key=object,
+                    Body=f,
+                    ContentMD5=base64.b64encode(bytes.fromhex(md5)).decode(),
+                )
+                return response, md5
+
+            reader = HashingReader(f)
+            response = self.s3.meta.client.put_object(
+                Bucket=bucket_name, Key=object, Body=reader
+            )
+            etag = reader.finish(self.read_buffer_size)
+
+        return response, etag
+
+    def upload_object(self, bucket_name, object, md5=None):
         """
         Upload an object to a bucket.
 
         Args:
             bucket_name (str): The name of the bucket.
             object (str): The path to the object.
+            md5 (str, optional): The known MD5 hash of the object.
 
         Returns:
-            boto3.resources.factory.s3.Object: The uploaded object.
+            dict: The put_object or complete_multipart_upload response.
 
         """
         try:
-            self.s3.Object(bucket_name, object).put(Body=open(object, "rb"))
-            uploaded_object = self.s3.Object(bucket_name, object)
+            uploaded_object, etag = self.put_file(bucket_name, object, md5)
         except botocore.exceptions.ClientError as e:
             print("S3 ClientError: %s" % e)
             return None
@@ -123,6 +474,211 @@ class S3Upload:
 
         return uploaded_object
 
+    def upload_part(self, bucket_name, object, upload_id, part_number, part_size):
+        """
+        Upload one part of a multipart upload.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The path to the object.
+            upload_id (str): The multipart upload ID.
+            part_number (int): The 1-based part number.
+            part_size (int): The part size in bytes.
+
+        Returns:
+            tuple: The part number and ETag of the uploaded part and the MD5 digest of
+            the part.
+
+        """
+        with open(object, "rb") as f:
+            f.seek((part_number - 1) * part_size)
+            body = f.read(part_size)
+
+        return self.put_part(bucket_name, object, upload_id, part_number, body)
+
+    def put_part(self, bucket_name, object, upload_id, part_number, body):
+        """
+        Send the body of one part of a multipart upload with its Content-MD5.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The name of the object.
+            upload_id (str): The multipart upload ID.
+            part_number (int): The 1-based part number.
+            body (bytes): The data of the part.
+
+        Returns:
+            tuple: The part number and ETag of the uploaded part and the MD5 digest of
+            the part.
+
+        """
+        if self.bandwidth is not None:
+            self.bandwidth.consume(len(body))
+
+        digest = hashlib.md5(body).digest()
+        response = self.s3.meta.client.upload_part(
+            Bucket=bucket_name,
+            Key=object,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body,
+            ContentMD5=base64.b64encode(digest).decode(),
+        )
+
+        return {"ETag": response["ETag"], "PartNumber": part_number}, digest
+
+    def upload_stream(self, bucket_name, object, chunks, size=None):
+        """
+        Upload a stream of data to a bucket without writing it to disk.
+
+        The data is collected in memory until it reaches multipart_threshold bytes.
+        Shorter streams are sent with one put_object request. Longer streams are sent
+        with multipart upload as each part fills up, so no more than
+        multipart_threshold bytes are buffered at once. The multipart upload is aborted
+        if any request fails or the stream raises an error.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The name of the object.
+            chunks (iterable): The data as an iterable of bytes.
+            size (int, optional): The expected size of the data in bytes, used to pick a
+                part size that stays within 10000 parts. Defaults to None.
+
+        Returns:
+            tuple: The put_object or complete_multipart_upload response, the ETag
+            calculated from the data that was sent and the MD5 hash of the data.
+
+        Raises:
+            botocore.exceptions.ClientError: If S3 rejects a request.
+            ValueError: If the stream needs more than 10000 parts.
+
+        """
+        client = self.s3.meta.client
+        hash_md5 = hashlib.md5()
+        buffer = bytearray()
+        chunks = iter(chunks)
+
+        for chunk in chunks:
+            hash_md5.update(chunk)
+            buffer += chunk
+            if len(buffer) >= self.multipart_threshold:
+                break
+        else:
+            if self.bandwidth is not None:
+                self.bandwidth.consume(len(buffer))
+
+            md5 = hash_md5.hexdigest()
+            response = client.put_object(
+                Bucket=bucket_name,
+                Key=object,
+                Body=bytes(buffer),
+                ContentMD5=base64.b64encode(bytes.fromhex(md5)).decode(),
+            )
+            return response, md5, md5
+
+        part_size = self.part_size(size or 0)
+        upload_id = client.create_multipart_upload(Bucket=bucket_name, Key=object)[
+            "UploadId"
+        ]
+
+        parts = []
+        digests = []
+
+        def send(body):
+            if len(parts) == MAX_PARTS:
+                raise ValueError("%s needs more than %d parts" % (object, MAX_PARTS))
+            part, digest = self.put_part(
+                bucket_name, object, upload_id, len(parts) + 1, bytes(body)
+            )
+            parts.append(part)
+            digests.append(digest)
+
+        try:
+            while True:
+                while len(buffer) >= part_size:
+                    send(buffer[:part_size])
+                    del buffer[:part_size]
+
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                hash_md5.update(chunk)
+                buffer += chunk
+
+            if buffer:
+                send(buffer)
+
+            response = client.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=object,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except Exception:
+            client.abort_multipart_upload(
+                Bucket=bucket_name, Key=object, UploadId=upload_id
+            )
+            raise
+
+        etag = "%s-%d" % (hashlib.md5(b"".join(digests)).hexdigest(), len(digests))
+
+        return response, etag, hash_md5.hexdigest()
+
+    def upload_multipart(self, bucket_name, object):
+        """
+        Upload an object to a bucket with multipart upload.
+
+        Parts are uploaded by a pool of up to multipart_concurrency worker threads. The
+        multipart upload is aborted if any part fails.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The path to the object.
+
+        Returns:
+            tuple: The complete_multipart_upload response and the composite multipart
+            ETag calculated from the parts that were read.
+
+        """
+        client = self.s3.meta.client
+        size = os.path.getsize(object)
+        part_size = self.part_size(size)
+        part_count = max(1, -(-size // part_size))
+
+        upload_id = client.create_multipart_upload(Bucket=bucket_name, Key=object)[
+            "UploadId"
+        ]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.multipart_concurrency) as executor:
+                results = list(
+                    executor.map(
+                        lambda part_number: self.upload_part(
+                            bucket_name, object, upload_id, part_number, part_size
+                        ),
+                        range(1, part_count + 1),
+                    )
+                )
+
+            response = client.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=object,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [part for part, digest in results]},
+            )
+        except Exception:
+            client.abort_multipart_upload(
+                Bucket=bucket_name, Key=object, UploadId=upload_id
+            )
+            raise
+
+        etag = "%s-%d" % (
+            hashlib.md5(b"".join(digest for part, digest in results)).hexdigest(),
+            len(results),
+        )
+
+        return response, etag
+
     def s3_auth(
         self, aws_access_key_id, aws_secret_access_key, s3_host, addressing_style="auto"
     ):
@@ -139,53 +695,451 @@ class S3Upload:
             boto3.resources.factory.s3.ServiceResource: The S3 resource.
 
         """
+        # boto3 is imported here so commands that never upload do not load it
+        import boto3
+
         s3 = boto3.resource(
             "s3",
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
             endpoint_url=s3_host,
-            config=botocore.client.Config(
-                signature_version="s3", s3={"addressing_style": addressing_style}
-            ),
+            config=self.client_config(addressing_style),
         )
 
         return s3
 
+    def client_config(self, addressing_style="auto", config_class=None):
+        """
+        Build the botocore configuration for the S3 client.
+
+        Args:
+            addressing_style (str, optional): The S3 addressing style. Defaults to "auto".
+            config_class (type, optional): The configuration class, such as a subclass
+                of botocore.client.Config. Defaults to botocore.client.Config.
+
+        Returns:
+            botocore.client.Config: The client configuration.
+
+        """
+        if config_class is None:
+            import botocore.client
+
+            config_class = botocore.client.Config
+
+        return config_class(
+            signature_version="s3",
+            s3={"addressing_style": addressing_style},
+            max_pool_connections=max(10, self.concurrency),
+            # Avoid an extra pass over each body for optional checksums
+            request_checksum_calculation="when_required",
+            response_checksum_validation="when_required",
+        )
+
+    def set_file_state(self, row, state):
+        """
+        Update the state of a file in the state database, if there is one.
+
+        Args:
+            row (dict): The state database row of the file, or None.
+            state (str): The new state of the file.
+
+        Returns:
+            None
+
+        """
+        if self.state is not None and row is not None:
+            self.state.set_state(
+                (row["mission"], row["roll"], row["frame"]), row["kind"], state
+            )
+
+        return None
+
+    def list_remote_objects(self, bucket_name, prefix):
+        """
+        List the objects under a prefix with paginated ListObjectsV2 requests.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            prefix (str): The key prefix to list.
+
+        Returns:
+            dict: The size and ETag of each object keyed by object name, or an empty
+            dictionary if the bucket can not be listed.
+
+        """
+        remote_objects = {}
+
+        with self.metrics.time(PHASE_LIST) as timing:
+            try:
+                paginator = self.s3.meta.client.get_paginator("list_objects_v2")
+                for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+                    for item in page.get("Contents", []):
+                        remote_objects[item["Key"]] = (
+                            item["Size"],
+                            item["ETag"].replace('"', ""),
+                        )
+            except botocore.exceptions.ClientError as e:
+                print("S3 ClientError: %s" % e)
+                timing.failed = True
+                return {}
+            except botocore.exceptions.BotoCoreError as e:
+                print("S3 Error: %s" % e)
+                timing.failed = True
+                return {}
+
+        return remote_objects
+
+    def list_pending_objects(self, bucket_name, files):
+        """
+        List the objects in the directories of the files that will be uploaded.
+
+        Only the directories that hold pending files are listed, so the requests
+        depend on the files to upload rather than on everything already in the bucket.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            files (list): The files to upload, as returned by list_files.
+
+        Returns:
+            dict: The size and ETag of each object keyed by object name.
+
+        """
+        remote_objects = {}
+        for prefix in directory_prefixes(files):
+            remote_objects.update(self.list_remote_objects(bucket_name, prefix))
+
+        return remote_objects
+
+    def matches_remote(self, object, md5, remote):
+        """
+        Check whether a file is already in the bucket.
+
+        Args:
+            object (str): The path to the file.
+            md5 (str): The known MD5 hash of the file, or None.
+            remote (tuple): The size and ETag of the object in the bucket.
+
+        Returns:
+            bool: True if the size and ETag of the object match the file.
+
+        """
+        size, etag = remote
+
+        try:
+            if os.path.getsize(object) != size:
+                return False
+        except OSError:
+            return False
+
+        if "-" in etag:
+            return self.expected_etag(object) == etag
+
+        if md5 is None:
+            md5 = self.md5(object)
+
+        return md5 == etag
+
+    def upload_file(self, bucket_name, object, md5=None, row=None, remote=None):
+        """
+        Upload a file to a bucket, verify it and remove the local copy.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object (str): The path to the file.
+            md5 (str, optional): The known MD5 hash of the file, from a download manifest.
+            row (dict, optional): The state database row of the file. Files already marked
+                as uploaded are only removed.
+            remote (tuple, optional): The size and ETag of the object already in the
+                bucket. Files that match it are only removed.
+
+        Returns:
+            bool or None: True if the file was uploaded and verified, False if the upload
+            failed, None if the file was already in the bucket.
+
+        """
+        if row is not None and row["state"] == UPLOADED:
+            uploaded = None
+        elif remote is not None and self.matches_remote(object, md5, remote):
+            print("upload_object: Already uploaded %s" % object)
+            uploaded = None
+        else:
+            # Upload the file and get its md5 hash, or composite multipart ETag, from
+            # the same read
+            try:
+                with self.limiter if self.limiter is not None else nullcontext():
+                    with self.metrics.time(PHASE_PUT) as timing:
+                        timing.bytes = os.path.getsize(object)
+                        response, local_md5sum = self.put_file(bucket_name, object, md5)
+            except (
+                botocore.exceptions.ClientError,
+                botocore.exceptions.BotoCoreError,
+                OSError,
+            ) as e:
+                print("Upload Object Failed: %s %s" % (object, e))
+                return False
+
+            # Use the etag from the upload response, and only ask S3 for it when the
+            # response does not include one
+            with self.metrics.time(PHASE_VERIFY) as timing:
+                etag = response.get("ETag", "").replace('"', "")
+                if not etag:
+                    etag = self.get_object_etag(bucket_name, object)
+                timing.failed = local_md5sum != etag
+
+            # Verify the original and s3 md5 hashes match
+            if local_md5sum != etag:
+                print("Upload Object Failed: %s %s %s" % (object, local_md5sum, etag))
+                return False
+
+            print("upload_object: Ok %s" % object)
+            uploaded = True
+
+        self.set_file_state(row, UPLOADED)
+
+        # Remove the uploaded file
+        self.remove_file(object)
+        self.set_file_state(row, DELETED)
+
+        return uploaded
+
+    def list_files(self, path):
+        """
+        List the files under a directory that need to be uploaded.
+
+        With a state database, the files are the ones it lists as downloaded,
+        verified or uploaded, and their MD5 hashes come from the database; a new
+        database is first filled from the directory.
+        Without one, the directory is walked, skipping hidden files such as in-progress
+        downloads and manifests, and the hashes come from the download manifests.
+
+        Args:
+            path (str): The path to the directory.
+
+        Returns:
+            list: Tuples of the file path, its MD5 hash if known and its state
+            database row, or None.
+
+        """
+        if self.state is None:
+            manifest_entries = read_manifests(path)
+            files = []
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names[:] = [
+                    dir_name for dir_name in dir_names if not dir_name.startswith(".")
+                ]
+                for file_name in file_names:
+                    if not file_name.startswith("."):
+                        object = os.path.join(dir_path, file_name)
+                        files.append(
+                            (object, lookup_md5(manifest_entries, path, object), None)
+                        )
+
+            return files
+
+        if self.state.count() == 0:
+            self.state.import_directory(path)
+
+        files = []
+        for row in self.state.pending([DOWNLOADED, VERIFIED, UPLOADED]):
+            object = os.path.join(path, row["path"])
+            files.append((object, lookup_md5({row["path"]: row}, path, object), row))
+
+        return files
+
     def upload_directory(self, bucket_name, path):
         """
         Upload a directory to a bucket.
 
+        The objects already in the directories of the pending files are listed
+        first, and files whose size and ETag match are removed locally without being
+        uploaded again. The other files are uploaded by a pool of up to
+        ``concurrency`` worker threads that share one low-level S3 client. MD5 hashes
+        recorded at download time are used instead of hashing a file again, as long
+        as its size and modification time have not changed.
+
         Args:
             bucket_name (str): The name of the bucket.
             path (str): The path to the directory.
 
         Returns:
-            int: 0 if successful.
+            dict: A summary with the number of uploaded, skipped and failed files, the
+            paths of the files that failed and the number of S3 requests made per file.
 
         """
-        for dir_path, dir_names, file_names in os.walk(path):
-            for file_name in file_names:
+        summary = {"uploaded": 0, "skipped": 0, "failed": 0, "failed_files": []}
+        request_count = sum(self.request_counts.values())
 
-                # Get the full path of the object
-                object = os.path.join(dir_path, file_name)
+        files = self.list_files(path)
+        remote_objects = self.list_pending_objects(bucket_name, files)
 
-                # Get md5 hash of the file
-                local_md5sum = self.md5(object)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {
+                executor.submit(
+                    self.upload_file,
+                    bucket_name,
+                    object,
+                    md5,
+                    row,
+                    remote_objects.get(object),
+                ): object
+                for object, md5, row in files
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                if result:
+                    summary["uploaded"] += 1
+                elif result is None:
+                    summary["skipped"] += 1
+                else:
+                    summary["failed"] += 1
+                    summary["failed_files"].append(futures[future])
 
-                # Upload the file
-                self.upload_object(bucket_name, object)
+        summary["requests"] = sum(self.request_counts.values()) - request_count
+        summary["requests_per_file"] = summary["requests"] / max(1, len(files))
 
-                # Get the etag of the uploaded file
-                etag = self.get_object_etag(bucket_name, object)
+        return summary
 
-                # Verify the original and s3 md5 hashes match
-                if local_md5sum == etag:
-                    print("upload_object: Ok")
-                else:
-                    print("Upload Object Failed: %s %s" % (local_md5sum, etag))
-                    return None
+    def watched_file(self, path, object, seen, settle=WATCH_SETTLE):
+        """
+        Look up a file reported by a watcher in the state database.
+
+        The downloader records a file just after it is renamed into place, so a file
+        the database does not list as downloaded yet is kept waiting. One that is
+        still unknown after ``settle`` seconds was not downloaded by winearth-download
+        and is added to the database, as import_directory would.
+
+        Args:
+            path (str): The path to the watched directory.
+            object (str): The path to the file.
+            seen (float): The time.monotonic() the file was reported at.
+            settle (float, optional): The seconds to wait for the downloader.
+                Defaults to WATCH_SETTLE.
+
+        Returns:
+            tuple: The MD5 hash of the file if known, its state database row or None,
+            and whether it is ready to upload, or None if it should be dropped.
+
+        """
+        if not os.path.exists(object):
+            return None
+
+        if self.state is None:
+            return None, None, True
+
+        relative_path = os.path.relpath(object, path)
+        row = self.state.get_path(relative_path)
+        if row is None and time.monotonic() - seen >= settle:
+            row = self.state.import_file(relative_path)
+
+        if row is None:
+            return None, None, False
+        if row["state"] in (DOWNLOADED, VERIFIED, UPLOADED):
+            return lookup_md5({row["path"]: row}, path, object), row, True
+        if row["state"] == DELETED or time.monotonic() - seen >= settle:
+            return None
+
+        return None, row, False
+
+    def watch_directory(
+        self, bucket_name, path, stop, watcher=None, check=None, interval=5
+    ):
+        """
+        Upload the files in a directory and then every file that is finished in it,
+        until stop is set.
+
+        The files already in the directory are uploaded as upload_directory would.
+        After that, new files are found with inotify, or by polling the directory
+        every ``interval`` seconds where inotify is not available, so the directory
+        is never walked again. Hidden files, such as downloads in progress, are
+        ignored, and a file is queued for upload as soon as it is finished, so
+        uploads overlap with the downloads that produce them.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            path (str): The path to the directory.
+            stop (threading.Event): Set to stop watching. The uploads in progress
+                are finished first.
+            watcher (optional): The watcher that reports finished files. Defaults to
+                open_watcher(path, interval).
+            check (callable, optional): Called with the state database row of each
+                new file, and the file is only uploaded if it returns True, such as
+                ImageValidator.validate_row. Defaults to None.
+            interval (float, optional): The seconds between polls when inotify is not
+                available. Defaults to 5.
+
+        Returns:
+            dict: A summary with the number of uploaded, skipped and failed files, the
+            paths of the files that failed and the number of S3 requests made per file.
+
+        """
+        summary = {"uploaded": 0, "skipped": 0, "failed": 0, "failed_files": []}
+        request_count = sum(self.request_counts.values())
+        file_count = 0
+
+        # Watch before listing, so no file is missed in between
+        if watcher is None:
+            watcher = open_watcher(path, interval)
+
+        def record(future, object):
+            result = future.result()
+            if result:
+                summary["uploaded"] += 1
+            elif result is None:
+                summary["skipped"] += 1
+            else:
+                summary["failed"] += 1
+                summary["failed_files"].append(object)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                files = self.list_files(path)
+                remote_objects = self.list_pending_objects(bucket_name, files)
+                futures = {
+                    executor.submit(
+                        self.upload_file,
+                        bucket_name,
+                        object,
+                        md5,
+                        row,
+                        remote_objects.get(object),
+                    ): object
+                    for object, md5, row in files
+                }
+                file_count += len(files)
+                waiting = {}
+
+                while not stop.is_set():
+                    for object in watcher.poll(min(1, interval)):
+                        if object not in futures.values():
+                            waiting.setdefault(object, time.monotonic())
+
+                    for object, seen in list(waiting.items()):
+                        watched = self.watched_file(path, object, seen)
+                        if watched is None:
+                            del waiting[object]
+                            continue
+                        md5, row, ready = watched
+                        if not ready:
+                            continue
+                        del waiting[object]
+                        if check is not None and row is not None and not check(row):
+                            continue
+                        futures[
+                            executor.submit(
+                                self.upload_file, bucket_name, object, md5, row
+                            )
+                        ] = object
+                        file_count += 1
+
+                    for future in [future for future in futures if future.done()]:
+                        record(future, futures.pop(future))
+
+                for future in as_completed(futures):
+                    record(future, futures[future])
+        finally:
+            watcher.close()
 
-                # Remove random file
-                self.remove_file(object)
+        summary["requests"] = sum(self.request_counts.values()) - request_count
+        summary["requests_per_file"] = summary["requests"] / max(1, file_count)
 
-        return 0
+        return summary
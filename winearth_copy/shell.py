@@ -1,11 +1,230 @@
 #!/usr/bin/env python
 
+import os
+import signal
 import sys
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import winearth_copy.arguments
 import winearth_copy.read_configuration
-from winearth_copy.winearth_download import WinEarthDownload
-from winearth_copy.s3_upload import S3Upload
+from winearth_copy.manifest import STATE_DIRECTORY
+from winearth_copy.metadata import METADATA_FORMATS
+from winearth_copy.metrics import Metrics
+from winearth_copy.profiling import Profiler
+from winearth_copy.read_configuration import ASYNCIO
+from winearth_copy.state import TransferState
+
+# The transfer modules import requests, boto3 or aiohttp, and the limits and
+# validation modules urllib3 and Pillow, which take most of the startup time, so
+# each command only imports the ones it uses
+
+ASYNC_ENGINE_MISSING = (
+    'The "asyncio" engine needs aiohttp and aiobotocore: '
+    "pip install winearth_copy[async]"
+)
+DECODE_MISSING = "decode_images needs Pillow: pip install winearth_copy[validate]"
+
+
+def open_state(configuration):
+    """
+    Open the transfer state database named in the configuration.
+
+    :param configuration: Configuration dictionary
+    :return: TransferState for state_database, or for .winearth/state.sqlite3 under
+        path when state_database is empty
+    """
+    database = configuration["state_database"]
+    if not database:
+        database = os.path.join(configuration["path"], STATE_DIRECTORY, "state.sqlite3")
+
+    return TransferState(database)
+
+
+def async_engine_missing(configuration):
+    """
+    Check whether the asyncio engine is configured but can not be used.
+
+    :param configuration: Configuration dictionary
+    :return: True if engine is asyncio and aiohttp or aiobotocore is not installed
+    """
+    if configuration["engine"] != ASYNCIO:
+        return False
+
+    from winearth_copy import async_engine
+
+    return not async_engine.available()
+
+
+def decode_missing(configuration):
+    """
+    Check whether decoding images is configured but Pillow is not installed.
+
+    :param configuration: Configuration dictionary
+    :return: True if validate_images and decode_images are on and PIL can not be
+        imported
+    """
+    if not (configuration["validate_images"] and configuration["decode_images"]):
+        return False
+
+    from winearth_copy.validate import decode_available
+
+    return not decode_available()
+
+
+def validate_images(configuration, state):
+    """
+    Check the downloaded images before they can be uploaded, quarantining bad ones.
+
+    :param configuration: Configuration dictionary
+    :param state: TransferState that lists the downloaded images
+    :return: Summary from ImageValidator.validate, or None when validate_images is off
+    """
+    if not configuration["validate_images"]:
+        return None
+
+    from winearth_copy.validate import ImageValidator
+
+    validator = ImageValidator(
+        configuration["path"],
+        state,
+        configuration["validate_concurrency"],
+        configuration["decode_images"],
+    )
+    summary = validator.validate()
+    print(
+        f"Verified {summary['verified']} images, quarantined {summary['quarantined']} to download again"
+    )
+
+    return summary
+
+
+def adaptive_limiter(configuration, concurrency):
+    """
+    Create the adaptive concurrency limit described by the configuration.
+
+    :param configuration: Configuration dictionary
+    :param concurrency: Number of transfers to start with
+    :return: AdaptiveLimiter that grows up to max_concurrency, or None when
+        adaptive_concurrency is off
+    """
+    if not configuration["adaptive_concurrency"]:
+        return None
+
+    from winearth_copy.limits import AdaptiveLimiter
+
+    return AdaptiveLimiter(concurrency, configuration["max_concurrency"])
+
+
+def download_timeouts(configuration):
+    """
+    Read the HTTP timeouts for downloads from the configuration.
+
+    :param configuration: Configuration dictionary
+    :return: Tuple of the connect and read timeouts, and the seconds each image may
+        take or None when image_deadline is 0
+    """
+    return (
+        (configuration["connect_timeout"], configuration["read_timeout"]),
+        configuration["image_deadline"] or None,
+    )
+
+
+def print_timeouts(summary):
+    """
+    Print how many requests timed out and how many were hedged.
+
+    :param summary: Summary returned by process_images or Backfill.run
+    """
+    print(
+        f"Timed out {summary['timeouts']} requests, hedged {summary['hedges']} requests"
+    )
+
+
+def write_metrics(configuration, command, metrics, summary):
+    """
+    Write the JSON run summary and, when prometheus_textfile_directory is set, the
+    Prometheus textfile collector file of a command.
+
+    :param configuration: Configuration dictionary
+    :param command: Name of the command, such as download
+    :param metrics: Metrics shared by the transfers of the command
+    :param summary: Summary returned by the command, whose numbers are added to the
+        run summary, or None
+    :return: The run summary, or None if it could not be written
+    """
+    directory = configuration["metrics_directory"]
+    if not directory:
+        directory = os.path.join(configuration["path"], STATE_DIRECTORY)
+
+    counts = {
+        name: value
+        for name, value in (summary or {}).items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+    try:
+        return metrics.write(
+            command,
+            os.path.join(directory, "metrics-%s.json" % command),
+            configuration["prometheus_textfile_directory"] or None,
+            **counts,
+        )
+    except OSError as e:
+        print(f"Failed to write metrics: {e}")
+        return None
+
+
+def print_limiter(limiter):
+    """
+    Print where an adaptive concurrency limit ended up.
+
+    :param limiter: AdaptiveLimiter or None
+    """
+    if limiter is not None:
+        print(
+            f"Adaptive concurrency ended at {int(limiter.limit)} after {limiter.decreases} backoffs"
+        )
+
+
+def open_s3(
+    configuration,
+    concurrency,
+    state=None,
+    uploader=None,
+    limiter=None,
+    metrics=None,
+):
+    """
+    Create the S3 uploader described by the configuration.
+
+    :param configuration: Configuration dictionary
+    :param concurrency: Number of files to upload at the same time
+    :param state: TransferState that lists the files to upload, or None
+    :param uploader: S3Upload or a subclass of it, or None for S3Upload
+    :param limiter: AdaptiveLimiter held while each file is uploaded, or None
+    :param metrics: Metrics to add the transfers to, or None for new metrics
+    :return: The uploader
+    """
+    from winearth_copy.limits import bandwidth_limit
+
+    if uploader is None:
+        from winearth_copy.s3_upload import S3Upload as uploader
+
+    return uploader(
+        configuration["aws_access_key_id"],
+        configuration["aws_secret_access_key"],
+        configuration["s3_host"],
+        configuration["addressing_style"],
+        concurrency,
+        configuration["multipart_threshold"],
+        configuration["multipart_chunksize"],
+        configuration["multipart_concurrency"],
+        configuration["read_buffer_size"],
+        state,
+        limiter,
+        bandwidth_limit(configuration["upload_bandwidth"]),
+        metrics,
+    )
 
 
 def download():
@@ -23,50 +242,508 @@ def download():
         args.configuration_file
     )
 
+    if args.download_concurrency is None:
+        download_concurrency = configuration["download_concurrency"]
+    else:
+        download_concurrency = args.download_concurrency
+
+    if configuration["metadata_format"] not in METADATA_FORMATS:
+        return "Unknown metadata_format: %s" % configuration["metadata_format"]
+
+    if decode_missing(configuration):
+        return DECODE_MISSING
+
+    # The asyncio engine does not hold the limiter, so it keeps the fixed
+    # concurrency rather than starting max_concurrency transfers
+    limiter = None
+    if args.start_date is not None or configuration["engine"] != ASYNCIO:
+        limiter = adaptive_limiter(configuration, download_concurrency)
+        if limiter is not None:
+            download_concurrency = configuration["max_concurrency"]
+
+    if args.start_date is not None:
+        return backfill(args, configuration, download_concurrency, limiter)
+
+    if async_engine_missing(configuration):
+        return ASYNC_ENGINE_MISSING
+
+    from winearth_copy.limits import bandwidth_limit
+    from winearth_copy.winearth_download import NO_RECORDS, WinEarthDownload
+
     start_time = datetime.now()
 
-    gape = WinEarthDownload(query_date, configuration["gape_api_key"])
-    results = gape.list_images()
+    metrics = Metrics()
+    profiler = Profiler(args.profile, "download")
+    profiler.start()
+    timeout, deadline = download_timeouts(configuration)
+    state = open_state(configuration)
+    if configuration["engine"] == ASYNCIO:
+        from winearth_copy import async_engine
+
+        gape = async_engine.AsyncWinEarthDownload(
+            query_date,
+            configuration["gape_api_key"],
+            download_concurrency,
+            configuration["download_retries"],
+            state=state,
+            metadata_format=configuration["metadata_format"],
+            timeout=timeout,
+            deadline=deadline,
+            metrics=metrics,
+        )
+        with profiler.stage("transfer"):
+            summary = async_engine.run(gape.process_images(configuration["path"]))
+    else:
+        gape = WinEarthDownload(
+            query_date,
+            configuration["gape_api_key"],
+            download_concurrency,
+            configuration["download_retries"],
+            state=state,
+            limiter=limiter,
+            metadata_format=configuration["metadata_format"],
+            bandwidth=bandwidth_limit(configuration["download_bandwidth"]),
+            timeout=timeout,
+            deadline=deadline,
+            hedge=configuration["hedge_requests"],
+            metrics=metrics,
+        )
+        with profiler.stage("transfer"):
+            summary = gape.process_images(configuration["path"])
+    with profiler.stage("validate"):
+        validate_images(configuration, state)
+    state.close()
+    write_metrics(configuration, "download", metrics, summary)
+    profiler.stop(metrics)
 
-    if results is None:
+    if summary is None:
         return "Failed to retrieve images from GAPE API."
-    if "result" in results:
-        if (
-            results["result"]
-            == "SQL found no records that match the specified criteria"
-        ):
-            return "No images found for %s." % args.query_date
+    if summary["result"] == NO_RECORDS:
+        return "No images found for %s." % args.query_date
+
+    print(f"Found {summary['images']} images for {query_date}")
 
-    print(f"Found {len(results)} images for {query_date}")
+    meta_data_count = summary["metadata"]
+    download_count = summary["downloaded"]
 
-    meta_data_count = gape.save_metadata(results, configuration["path"])
-    download_count = gape.download_images(results, configuration["path"])
+    connection_stats = gape.connection_stats()
+    gape.close()
 
     end_time = datetime.now()
 
     print(f"Saved {meta_data_count} metadata files to {configuration['path']}")
     print(f"Downloaded {download_count} images to {configuration['path']}")
+    print(
+        f"Reused a connection for {connection_stats['reused']} of {connection_stats['requests']} HTTP requests"
+    )
+    print_timeouts(summary)
+    print_limiter(limiter)
     print(f"Time elapsed: {end_time - start_time}")
 
     return 0
 
 
+def backfill(args, configuration, download_concurrency, limiter=None):
+    """
+    Download the images for every day from --start-date to --end-date.
+
+    :param args: Commandline arguments parsed by argparse
+    :param configuration: Configuration dictionary
+    :param download_concurrency: Number of images to download at the same time
+    :param limiter: AdaptiveLimiter shared by every day, or None
+    :return: 0 if successful otherwise return an error message as a string
+    """
+    if args.end_date is None:
+        end_date = datetime.today().strftime("%Y%m%d")
+    else:
+        end_date = args.end_date
+
+    from winearth_copy.backfill import Backfill
+    from winearth_copy.limits import bandwidth_limit
+
+    start_time = datetime.now()
+
+    metrics = Metrics()
+    profiler = Profiler(args.profile, "backfill")
+    profiler.start()
+    timeout, deadline = download_timeouts(configuration)
+    state = open_state(configuration)
+    runner = Backfill(
+        configuration["gape_api_key"],
+        configuration["path"],
+        state,
+        download_concurrency,
+        configuration["backfill_day_concurrency"],
+        configuration["download_retries"],
+        configuration["metadata_format"],
+        limiter,
+        bandwidth_limit(configuration["download_bandwidth"]),
+        timeout,
+        deadline,
+        configuration["hedge_requests"],
+        metrics,
+    )
+
+    try:
+        with profiler.stage("transfer"):
+            summary = runner.run(args.start_date, end_date)
+        with profiler.stage("validate"):
+            validate_images(configuration, state)
+    except ValueError as e:
+        return "Invalid backfill date: %s" % e
+    finally:
+        runner.close()
+        state.close()
+        profiler.stop(metrics)
+    write_metrics(configuration, "backfill", metrics, summary)
+
+    end_time = datetime.now()
+
+    print(
+        f"Skipped {summary['skipped_days']} of {summary['days']} days already complete"
+    )
+    print(f"Saved {summary['metadata']} metadata files to {configuration['path']}")
+    print(f"Downloaded {summary['downloaded']} images to {configuration['path']}")
+    print_timeouts(summary)
+    print_limiter(limiter)
+    print(f"Time elapsed: {end_time - start_time}")
+
+    if summary["incomplete_days"]:
+        return "Incomplete days: %s" % ", ".join(summary["incomplete_days"])
+
+    return 0
+
+
+@contextmanager
+def handle_signals(handler):
+    """
+    Call a handler on SIGINT and SIGTERM, instead of stopping, while the context is
+    open, and restore the previous handlers afterwards.
+
+    :param handler: Signal handler, such as a function that sets a threading.Event
+    """
+    previous = {
+        signal_number: signal.signal(signal_number, handler)
+        for signal_number in (signal.SIGINT, signal.SIGTERM)
+    }
+    try:
+        yield
+    finally:
+        for signal_number, previous_handler in previous.items():
+            signal.signal(signal_number, previous_handler)
+
+
+def watch_directory(configuration, s3, state):
+    """
+    Upload the files in path, and then every new file as it is finished, until
+    SIGINT or SIGTERM.
+
+    :param configuration: Configuration dictionary
+    :param s3: S3Upload to upload the files with
+    :param state: TransferState that lists the files to upload
+    :return: Summary returned by S3Upload.watch_directory
+    """
+    stop = threading.Event()
+
+    # New images are checked one at a time before they are uploaded
+    check = None
+    if configuration["validate_images"]:
+        from winearth_copy.validate import ImageValidator
+
+        check = ImageValidator(
+            configuration["path"],
+            state,
+            configuration["validate_concurrency"],
+            configuration["decode_images"],
+        ).validate_row
+
+    print(f"Watching {configuration['path']} for new files")
+
+    with handle_signals(lambda *args: stop.set()):
+        return s3.watch_directory(
+            configuration["bucket_name"],
+            configuration["path"],
+            stop,
+            check=check,
+            interval=configuration["watch_interval"],
+        )
+
+
 def upload():
+    """
+    :return: 0 if successful otherwise return an error message as a string
+    """
     args = winearth_copy.arguments.parse_arguments(sys.argv[1:])
 
     configuration = winearth_copy.read_configuration.read_configuration(
         args.configuration_file
     )
 
-    aws_access_key_id = configuration["aws_access_key_id"]
-    aws_secret_access_key = configuration["aws_secret_access_key"]
-    s3_host = configuration["s3_host"]
-    addressing_style = configuration["addressing_style"]
     bucket_name = configuration["bucket_name"]
     path = configuration["path"]
 
-    s3 = S3Upload(aws_access_key_id, aws_secret_access_key, s3_host, addressing_style)
+    if args.upload_concurrency is None:
+        upload_concurrency = configuration["upload_concurrency"]
+    else:
+        upload_concurrency = args.upload_concurrency
+
+    if async_engine_missing(configuration):
+        return ASYNC_ENGINE_MISSING
+
+    if decode_missing(configuration):
+        return DECODE_MISSING
+
+    # Quarantine bad images so they are not uploaded and removed
+    metrics = Metrics()
+    profiler = Profiler(args.profile, "upload")
+    profiler.start()
+    state = open_state(configuration)
+    if args.rescan:
+        import_count = state.import_directory(path)
+        print(f"Added {import_count} files found under {path} to the state database")
+    with profiler.stage("validate"):
+        validate_images(configuration, state)
+
+    if configuration["engine"] == ASYNCIO and not args.watch:
+        from winearth_copy import async_engine
+
+        s3 = open_s3(
+            configuration,
+            upload_concurrency,
+            state,
+            async_engine.AsyncS3Upload,
+            metrics=metrics,
+        )
+        with profiler.stage("transfer"):
+            summary = async_engine.run(s3.upload_directory(bucket_name, path))
+    else:
+        limiter = adaptive_limiter(configuration, upload_concurrency)
+        if limiter is not None:
+            upload_concurrency = configuration["max_concurrency"]
+        s3 = open_s3(
+            configuration, upload_concurrency, state, limiter=limiter, metrics=metrics
+        )
+        with profiler.stage("transfer"):
+            if args.watch:
+                summary = watch_directory(configuration, s3, state)
+            else:
+                summary = s3.upload_directory(bucket_name, path)
+        print_limiter(limiter)
+    state.close()
+    write_metrics(configuration, "upload", metrics, summary)
+    profiler.stop(metrics)
+
+    if summary is None:
+        return "Upload cancelled."
+
+    print(f"Uploaded {summary['uploaded']} files from {path}")
+    print(f"Skipped {summary['skipped']} files already in {bucket_name}")
+    print(f"S3 requests per file: {summary['requests_per_file']:.2f}")
+
+    if summary["failed"] > 0:
+        return "Failed to upload %d files." % summary["failed"]
+
+    return 0
+
+
+def sync():
+    """
+    Copy the images for a day from NASA to S3 without saving them to disk.
+
+    :return: 0 if successful otherwise return an error message as a string
+    """
+    args = winearth_copy.arguments.parse_arguments(sys.argv[1:])
+
+    if args.query_date is None:
+        query_date = datetime.today().strftime("%Y%m%d")
+    else:
+        query_date = args.query_date
+
+    configuration = winearth_copy.read_configuration.read_configuration(
+        args.configuration_file
+    )
+
+    if args.download_concurrency is None:
+        download_concurrency = configuration["download_concurrency"]
+    else:
+        download_concurrency = args.download_concurrency
+
+    if configuration["metadata_format"] not in METADATA_FORMATS:
+        return "Unknown metadata_format: %s" % configuration["metadata_format"]
+
+    from winearth_copy.limits import bandwidth_limit
+    from winearth_copy.sync import WinEarthSync
+    from winearth_copy.winearth_download import NO_RECORDS
+
+    start_time = datetime.now()
+
+    limiter = adaptive_limiter(configuration, download_concurrency)
+    if limiter is not None:
+        download_concurrency = configuration["max_concurrency"]
+
+    metrics = Metrics()
+    profiler = Profiler(args.profile, "sync")
+    profiler.start()
+    timeout, deadline = download_timeouts(configuration)
+    state = open_state(configuration)
+    s3 = open_s3(configuration, download_concurrency, limiter=limiter, metrics=metrics)
+    gape = WinEarthSync(
+        query_date,
+        configuration["gape_api_key"],
+        s3,
+        configuration["bucket_name"],
+        download_concurrency,
+        configuration["download_retries"],
+        state,
+        limiter=limiter,
+        metadata_format=configuration["metadata_format"],
+        bandwidth=bandwidth_limit(configuration["download_bandwidth"]),
+        timeout=timeout,
+        deadline=deadline,
+        validate=configuration["validate_images"],
+    )
+    with profiler.stage("transfer"):
+        summary = gape.process_images(configuration["path"])
+    gape.close()
+    state.close()
+    write_metrics(configuration, "sync", metrics, summary)
+    profiler.stop(metrics)
+
+    if summary is None:
+        return "Failed to retrieve images from GAPE API."
+    if summary["result"] == NO_RECORDS:
+        return "No images found for %s." % query_date
+
+    end_time = datetime.now()
+
+    print(f"Found {summary['images']} images for {query_date}")
+    print(
+        f"Copied {summary['metadata']} metadata files to {configuration['bucket_name']}"
+    )
+    print(f"Copied {summary['downloaded']} images to {configuration['bucket_name']}")
+    print_timeouts(summary)
+    print_limiter(limiter)
+    print(f"Time elapsed: {end_time - start_time}")
+
+    if gape.counts["failed"] > 0:
+        return "Failed to copy %d files." % gape.counts["failed"]
+
+    return 0
+
+
+def daemon():
+    """
+    Download and upload the new images of today and the last daemon_window_days days
+    every daemon_interval seconds until SIGINT or SIGTERM, serving /healthz and
+    /metrics on daemon_listen_address and daemon_port.
+
+    :return: 0 once stopped otherwise return an error message as a string
+    """
+    args = winearth_copy.arguments.parse_arguments(sys.argv[1:])
+
+    configuration = winearth_copy.read_configuration.read_configuration(
+        args.configuration_file
+    )
+
+    if args.download_concurrency is None:
+        download_concurrency = configuration["download_concurrency"]
+    else:
+        download_concurrency = args.download_concurrency
+
+    if args.upload_concurrency is None:
+        upload_concurrency = configuration["upload_concurrency"]
+    else:
+        upload_concurrency = args.upload_concurrency
 
-    result = s3.upload_directory(bucket_name, path)
+    if configuration["metadata_format"] not in METADATA_FORMATS:
+        return "Unknown metadata_format: %s" % configuration["metadata_format"]
 
-    return result
+    if decode_missing(configuration):
+        return DECODE_MISSING
+
+    from winearth_copy.backfill import Backfill
+    from winearth_copy.daemon import Daemon
+    from winearth_copy.limits import bandwidth_limit
+
+    download_limiter = adaptive_limiter(configuration, download_concurrency)
+    if download_limiter is not None:
+        download_concurrency = configuration["max_concurrency"]
+    upload_limiter = adaptive_limiter(configuration, upload_concurrency)
+    if upload_limiter is not None:
+        upload_concurrency = configuration["max_concurrency"]
+
+    metrics = Metrics()
+    timeout, deadline = download_timeouts(configuration)
+    state = open_state(configuration)
+    runner = Backfill(
+        configuration["gape_api_key"],
+        configuration["path"],
+        state,
+        download_concurrency,
+        configuration["backfill_day_concurrency"],
+        configuration["download_retries"],
+        configuration["metadata_format"],
+        download_limiter,
+        bandwidth_limit(configuration["download_bandwidth"]),
+        timeout,
+        deadline,
+        configuration["hedge_requests"],
+        metrics,
+    )
+    s3 = open_s3(
+        configuration,
+        upload_concurrency,
+        state,
+        limiter=upload_limiter,
+        metrics=metrics,
+    )
+    validator = None
+    if configuration["validate_images"]:
+        from winearth_copy.validate import ImageValidator
+
+        validator = ImageValidator(
+            configuration["path"],
+            state,
+            configuration["validate_concurrency"],
+            configuration["decode_images"],
+        )
+    scheduler = Daemon(
+        runner,
+        s3,
+        configuration["bucket_name"],
+        configuration["path"],
+        configuration["daemon_interval"],
+        configuration["daemon_window_days"],
+        validator,
+        metrics,
+    )
+
+    server = None
+    if configuration["daemon_port"]:
+        address = configuration["daemon_listen_address"]
+        try:
+            server = scheduler.serve(address, configuration["daemon_port"])
+        except OSError as e:
+            runner.close()
+            state.close()
+            return "Failed to listen on %s:%s: %s" % (
+                address,
+                configuration["daemon_port"],
+                e,
+            )
+        print(f"Serving /healthz and /metrics on {address}:{server.server_port}")
+
+    try:
+        with handle_signals(scheduler.stop):
+            cycles = scheduler.run()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        runner.close()
+        state.close()
+    write_metrics(configuration, "daemon", metrics, scheduler.counts)
+
+    print(f"Stopped after {cycles} cycles")
+
+    return 0
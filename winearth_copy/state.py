@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+import threading
+import time
+from winearth_copy.metadata import metadata_lines_date
+
+# Transfer states, in the order a file moves through them
+DOWNLOADED = "downloaded"
+VERIFIED = "verified"
+UPLOADED = "uploaded"
+DELETED = "deleted"
+
+# State of an image that failed validation and has to be downloaded again
+QUARANTINED = "quarantined"
+
+# States of a day in a backfill
+STARTED = "started"
+COMPLETE = "complete"
+
+# Kinds of file kept for each image
+IMAGE = "image"
+METADATA = "metadata"
+
+# Kind of the JSON Lines file that holds the metadata of a directory for a day
+METADATA_LINES = "metadata_lines"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    mission TEXT NOT NULL,
+    roll TEXT NOT NULL,
+    frame TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT,
+    query_date TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    md5 TEXT,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (mission, roll, frame, kind)
+);
+CREATE INDEX IF NOT EXISTS files_state ON files (state);
+CREATE INDEX IF NOT EXISTS files_query_date ON files (query_date, kind);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE TABLE IF NOT EXISTS days (
+    query_date TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    image_count INTEGER,
+    updated REAL NOT NULL
+);
+"""
+
+
+def record_key(image_data):
+    """
+    Get the mission, roll and frame that identify an image.
+
+    The nadir.mission, nadir.roll and nadir.frame fields of a GAPE record are used
+    when present, otherwise they are taken from a file name such as ISS070-E-12345.JPG.
+
+    Args:
+        image_data (dict): A dictionary containing image data.
+
+    Returns:
+        tuple: The mission, roll and frame of the image.
+
+    """
+    if all(
+        field in image_data for field in ("nadir.mission", "nadir.roll", "nadir.frame")
+    ):
+        return (
+            str(image_data["nadir.mission"]),
+            str(image_data["nadir.roll"]),
+            str(image_data["nadir.frame"]),
+        )
+
+    return filename_key(image_data["images.filename"])
+
+
+def filename_key(filename):
+    """
+    Split an image file name such as ISS070-E-12345.JPG into mission, roll and frame.
+
+    Args:
+        filename (str): The file name.
+
+    Returns:
+        tuple: The mission, roll and frame of the image.
+
+    """
+    parts = os.path.splitext(os.path.basename(filename))[0].split("-", 2)
+    if len(parts) == 3:
+        return tuple(parts)
+    if len(parts) == 2:
+        return parts[0], "", parts[1]
+
+    return parts[0], "", ""
+
+
+def path_key(path):
+    """
+    Get the key of a file that was not saved by the downloader, such as a file from a
+    run made before the state database existed. Different directories can hold files
+    with the same name, so the file is keyed by its path rather than its name.
+
+    Args:
+        path (str): The path to the file, relative to the download path.
+
+    Returns:
+        tuple: The path in place of the mission, and an empty roll and frame.
+
+    """
+    return path, "", ""
+
+
+def metadata_lines_key(directory, query_date):
+    """
+    Get the key of the JSON Lines metadata file of an image directory for a day.
+
+    Args:
+        directory (str): The image directory, relative to the download path.
+        query_date (str): The date in YYYYMMDD format.
+
+    Returns:
+        tuple: The directory in place of the mission, an empty roll and the date in
+        place of the frame.
+
+    """
+    return directory, "", query_date
+
+
+class TransferState:
+    """
+    An SQLite database of the files downloaded and uploaded for each image.
+
+    Each file is keyed by the mission, roll and frame of its image and its kind (image
+    or metadata) and moves through the downloaded, verified, uploaded and deleted
+    states. Every change is committed immediately, so a run that is interrupted can be
+    repeated and picks up where it stopped.
+
+    Args:
+        database (str): The path to the SQLite database file.
+
+    Attributes:
+        database (str): The path to the SQLite database file.
+        connection (sqlite3.Connection): The database connection.
+
+    """
+
+    def __init__(self, database):
+        self.database = database
+
+        directory = os.path.dirname(database)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # One connection is shared by the worker threads and serialised with a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            database, check_same_thread=False, isolation_level=None
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def get(self, key, kind):
+        """
+        Get the state of a file.
+
+        Args:
+            key (tuple): The mission, roll and frame of the image.
+            kind (str): The kind of file, IMAGE or METADATA.
+
+        Returns:
+            dict: The database row for the file, or None if it is not known.
+
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM files WHERE mission = ? AND roll = ? AND frame = ? AND kind = ?",
+                (*key, kind),
+            ).fetchone()
+
+        return None if row is None else dict(row)
+
+    def get_path(self, path):
+        """
+        Get the state of a file by its path.
+
+        Args:
+            path (str): The path to the file, relative to the download path.
+
+        Returns:
+            dict: The database row for the file, or None if it is not known.
+
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM files WHERE path = ?", (path,)
+            ).fetchone()
+
+        return None if row is None else dict(row)
+
+    def set_state(
+        self,
+        key,
+        kind,
+        state,
+        path=None,
+        query_date=None,
+        size=None,
+        mtime_ns=None,
+        md5=None,
+    ):
+        """
+        Insert a file or update its state. Fields that are not given keep their value.
+
+        Args:
+            key (tuple): The mission, roll and frame of the image.
+            kind (str): The kind of file, IMAGE or METADATA.
+            state (str): The new state of the file.
+            path (str, optional): The path of the file relative to the download path.
+            query_date (str, optional): The date the image was queried for.
+            size (int, optional): The size of the file in bytes.
+            mtime_ns (int, optional): The modification time of the file in nanoseconds.
+            md5 (str, optional): The MD5 hash of the file.
+
+        Returns:
+            None
+
+        """
+        with self.lock:
+            self.connection.execute(
+                """
+                INSERT INTO files (
+                    mission, roll, frame, kind, path, query_date, size, mtime_ns, md5,
+                    state, updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (mission, roll, frame, kind) DO UPDATE SET
+                    path = COALESCE(excluded.path, path),
+                    query_date = COALESCE(excluded.query_date, query_date),
+                    size = COALESCE(excluded.size, size),
+                    mtime_ns = COALESCE(excluded.mtime_ns, mtime_ns),
+                    md5 = COALESCE(excluded.md5, md5),
+                    state = excluded.state,
+                    updated = excluded.updated
+                """,
+                (
+                    *key,
+                    kind,
+                    path,
+                    query_date,
+                    size,
+                    mtime_ns,
+                    md5,
+                    state,
+                    time.time(),
+                ),
+            )
+
+        return None
+
+    def get_day(self, query_date):
+        """
+        Get the checkpoint of a day.
+
+        Args:
+            query_date (str): The date in YYYYMMDD format.
+
+        Returns:
+            dict: The database row for the day, or None if it has not been started.
+
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM days WHERE query_date = ?", (query_date,)
+            ).fetchone()
+
+        return None if row is None else dict(row)
+
+    def set_day(self, query_date, state, image_count=None):
+        """
+        Checkpoint a day.
+
+        Args:
+            query_date (str): The date in YYYYMMDD format.
+            state (str): The state of the day, STARTED or COMPLETE.
+            image_count (int, optional): The number of images found for the day.
+
+        Returns:
+            None
+
+        """
+        with self.lock:
+            self.connection.execute(
+                """
+                INSERT INTO days (query_date, state, image_count, updated)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (query_date) DO UPDATE SET
+                    state = excluded.state,
+                    image_count = COALESCE(excluded.image_count, image_count),
+                    updated = excluded.updated
+                """,
+                (query_date, state, image_count, time.time()),
+            )
+
+        return None
+
+    def pending(self, states):
+        """
+        List the files in any of the given states.
+
+        Args:
+            states (list): The states to list.
+
+        Returns:
+            list: The database rows of the files.
+
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM files WHERE state IN (%s) ORDER BY path"
+                % ", ".join("?" * len(states)),
+                tuple(states),
+            ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def count(self):
+        """
+        Count the files in the database.
+
+        Returns:
+            int: The number of files.
+
+        """
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def import_directory(self, path):
+        """
+        Add the files under a download path that the database does not know about as
+        downloaded.
+
+        Used when the database is new, so files from runs made before it existed are
+        still uploaded, and by winearth-upload --rescan for files copied into the
+        directory by hand. It walks the whole tree, so it is not run otherwise.
+
+        Args:
+            path (str): The base path files are downloaded to.
+
+        Returns:
+            int: The number of files added.
+
+        """
+        import_count = 0
+
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names[:] = [
+                dir_name for dir_name in dir_names if not dir_name.startswith(".")
+            ]
+            for file_name in file_names:
+                if file_name.startswith("."):
+                    continue
+
+                relative_path = os.path.relpath(os.path.join(dir_path, file_name), path)
+                if self.get_path(relative_path) is not None:
+                    continue
+
+                self.import_file(relative_path)
+                import_count += 1
+
+        return import_count
+
+    def import_file(self, path):
+        """
+        Add a file that is not in the database as downloaded, keyed by its path and
+        with its kind worked out from its name.
+
+        Args:
+            path (str): The path to the file, relative to the download path.
+
+        Returns:
+            dict: The database row for the file.
+
+        """
+        file_name = os.path.basename(path)
+        query_date = metadata_lines_date(file_name)
+        if query_date is not None:
+            key = metadata_lines_key(os.path.dirname(path), query_date)
+            kind = METADATA_LINES
+        else:
+            key = path_key(path)
+            kind = METADATA if file_name.endswith(".json") else IMAGE
+
+        self.set_state(key, kind, DOWNLOADED, path=path)
+
+        return self.get(key, kind)
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self.lock:
+            self.connection.close()
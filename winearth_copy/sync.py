@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+import botocore.exceptions
+import hashlib
+import json
+import os
+import requests
+import time
+from winearth_copy.metadata import JSON, metadata_lines_name
+from winearth_copy.metrics import PHASE_DOWNLOAD, PHASE_METADATA, PHASE_VERIFY
+from winearth_copy.state import (
+    DELETED,
+    IMAGE,
+    METADATA,
+    METADATA_LINES,
+    QUARANTINED,
+    metadata_lines_key,
+    record_key,
+)
+from winearth_copy.validate import JPEG_EXTENSIONS, check_jpeg_stream
+from winearth_copy.winearth_download import (
+    DEFAULT_TIMEOUT,
+    WinEarthDownload,
+    is_timeout,
+)
+
+
+class WinEarthSync(WinEarthDownload):
+    """
+    Copies the images for a day from the image host straight to S3.
+
+    Each image response body is passed to S3Upload.upload_stream as it is received,
+    so nothing is written to local disk and at most multipart_threshold bytes of each
+    image are held in memory. Objects get the same names winearth-upload gives the
+    files under ``path``, and every image and metadata file is checkpointed in the
+    state database once it is in the bucket, so a run that is interrupted can be
+    repeated without copying anything twice.
+
+    Args:
+        query_date (str): The date to query in YYYYMMDD format.
+        api_key (str): The GAPE API key.
+        s3 (winearth_copy.s3_upload.S3Upload): The uploader that sends the objects.
+        bucket_name (str): The name of the bucket.
+        concurrency (int, optional): The number of images copied at the same time.
+            Defaults to 1.
+        retries (int, optional): The number of retries for each HTTP request. Defaults to 5.
+        state (winearth_copy.state.TransferState, optional): The state database.
+            Defaults to None.
+        session (requests.Session, optional): The HTTP session. Defaults to a new one.
+        limiter (optional): A context manager, such as a semaphore, held while an image
+            is copied. Defaults to None.
+        metadata_format (str, optional): The metadata format, "json" for an object per
+            image or "jsonl" for a JSON Lines object per directory. Defaults to "json".
+        bandwidth (winearth_copy.limits.TokenBucket, optional): The download
+            bandwidth limit. Defaults to None.
+        timeout (tuple, optional): The connect and read timeouts in seconds for every
+            HTTP request. Defaults to (10, 60).
+        deadline (float, optional): The seconds an image may take to copy. Defaults to
+            None for no limit.
+        metrics (winearth_copy.metrics.Metrics, optional): The transfer metrics.
+            Defaults to the metrics of ``s3``.
+        validate (bool, optional): Whether JPEG images are checked for their start
+            and end of image markers before they are committed. Defaults to True.
+
+    Attributes:
+        s3 (winearth_copy.s3_upload.S3Upload): The uploader that sends the objects.
+        bucket_name (str): The name of the bucket.
+        validate (bool): Whether JPEG images are checked.
+
+    """
+
+    def __init__(
+        self,
+        query_date,
+        api_key,
+        s3,
+        bucket_name,
+        concurrency=1,
+        retries=5,
+        state=None,
+        session=None,
+        limiter=None,
+        metadata_format=JSON,
+        bandwidth=None,
+        timeout=DEFAULT_TIMEOUT,
+        deadline=None,
+        metrics=None,
+        validate=True,
+    ):
+        super().__init__(
+            query_date,
+            api_key,
+            concurrency,
+            retries,
+            state=state,
+            session=session,
+            limiter=limiter,
+            metadata_format=metadata_format,
+            bandwidth=bandwidth,
+            timeout=timeout,
+            deadline=deadline,
+            metrics=metrics if metrics is not None else s3.metrics,
+        )
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.validate = validate
+
+    def make_directory(self, directory):
+        """
+        Nothing is written to disk, so no directories are created.
+        """
+        return None
+
+    def is_saved(self, image_data, kind, path, file_path):
+        """
+        Check whether a file for an image has already been copied.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            kind (str): The kind of file, IMAGE or METADATA.
+            path (str): The base path object names are built from.
+            file_path (str): The object name.
+
+        Returns:
+            bool: True if the state database knows about the file and it has not been
+            quarantined.
+        """
+        if self.state is None:
+            return False
+
+        row = self.state.get(record_key(image_data), kind)
+        # A file imported from the directory is keyed by its path
+        if row is None:
+            row = self.state.get_path(os.path.relpath(file_path, path))
+        return row is not None and row["state"] != QUARANTINED
+
+    def record_file(self, image_data, kind, path, file_path, md5, size=None):
+        """
+        Checkpoint a file copied to the bucket in the state database, if it is set.
+
+        There is no local copy, so the file goes straight to the deleted state.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            kind (str): The kind of file, IMAGE or METADATA.
+            path (str): The base path object names are built from.
+            file_path (str): The object name.
+            md5 (str): The MD5 hash of the file.
+            size (int, optional): The size of the file in bytes.
+
+        Returns:
+            None
+        """
+        if self.state is not None:
+            self.state.set_state(
+                record_key(image_data),
+                kind,
+                DELETED,
+                path=os.path.relpath(file_path, path),
+                query_date=self.query_date,
+                size=size,
+                md5=md5,
+            )
+
+    def save_metadata(self, json_data, path):
+        """
+        Upload the metadata for each image in the provided JSON data.
+
+        With the JSON Lines metadata format the records are only collected, and
+        save_metadata_lines uploads them.
+
+        Args:
+            json_data (list): A list of dictionaries containing image metadata.
+            path (str): The base path object names are built from.
+
+        Returns:
+            int: The number of metadata files uploaded.
+
+        """
+        if self.metadata_lines is not None:
+            for image_data in json_data:
+                self.metadata_lines.add(image_data)
+            return 0
+
+        write_count = 0
+
+        for image_data in json_data:
+            filename = image_data["images.filename"].replace(".JPG", ".json")
+            object = os.path.join(path, image_data["images.directory"], filename)
+
+            if self.is_saved(image_data, METADATA, path, object):
+                continue
+
+            data = json.dumps(image_data, indent=4).encode()
+            try:
+                with self.metrics.time(PHASE_METADATA) as timing:
+                    uploaded, etag, md5 = self.s3.upload_stream(
+                        self.bucket_name, object, [data], len(data)
+                    )
+                    timing.bytes = len(data)
+            except (
+                botocore.exceptions.ClientError,
+                botocore.exceptions.BotoCoreError,
+                ValueError,
+            ) as e:
+                print(f"Upload failed: {filename} {e}")
+                self.count("failed")
+                continue
+
+            write_count += 1
+            self.record_file(image_data, METADATA, path, object, md5, len(data))
+
+        return write_count
+
+    def save_metadata_lines(self, path):
+        """
+        Upload the metadata records collected for the query date as one JSON Lines
+        object per image directory. An object the state database already has with the
+        same content is not uploaded again.
+
+        Args:
+            path (str): The base path object names are built from.
+
+        Returns:
+            int: The number of metadata objects uploaded, 0 unless the JSON Lines
+            metadata format is used.
+        """
+        if self.metadata_lines is None:
+            return 0
+
+        write_count = 0
+        for directory, document in self.metadata_lines.documents().items():
+            object = os.path.join(path, directory, metadata_lines_name(self.query_date))
+            if self.metadata_lines_unchanged(
+                directory, object, hashlib.md5(document).hexdigest()
+            ):
+                continue
+
+            try:
+                with self.metrics.time(PHASE_METADATA) as timing:
+                    uploaded, etag, md5 = self.s3.upload_stream(
+                        self.bucket_name, object, [document], len(document)
+                    )
+                    timing.bytes = len(document)
+            except (
+                botocore.exceptions.ClientError,
+                botocore.exceptions.BotoCoreError,
+                ValueError,
+            ) as e:
+                print(f"Upload failed: {object} {e}")
+                self.count("failed")
+                continue
+
+            write_count += 1
+            if self.state is not None:
+                self.state.set_state(
+                    metadata_lines_key(directory, self.query_date),
+                    METADATA_LINES,
+                    DELETED,
+                    path=os.path.relpath(object, path),
+                    query_date=self.query_date,
+                    size=len(document),
+                    md5=md5,
+                )
+
+        return write_count
+
+    def fetch_image(self, image_data, path):
+        """
+        Streams an image from the image host to the bucket.
+
+        The ETag S3 returns is compared with the one calculated from the data that was
+        sent before the image is checkpointed. Images are not resumed or hedged, as
+        nothing is kept on disk, but a copy that takes longer than the deadline is
+        given up on and its multipart upload aborted. The copy is timed as a download
+        in ``metrics`` and the ETag comparison as a verification. With ``validate``,
+        a JPEG image that does not start and end with the JPEG markers fails before
+        its upload is completed, as check_image would fail the downloaded file.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            path (str): The base path object names are built from.
+
+        Returns:
+            bool: True if the image was copied, False if the copy failed.
+        """
+        filename = image_data["images.filename"]
+        object = os.path.join(path, image_data["images.directory"], filename)
+
+        url = self.base_download_url + image_data["images.directory"] + "/" + filename
+        deadline = (
+            time.monotonic() + self.deadline if self.deadline is not None else None
+        )
+        try:
+            with self.metrics.time(PHASE_DOWNLOAD) as timing, self.session.get(
+                url, stream=True, timeout=self.timeout
+            ) as response:
+                if response.status_code != 200:
+                    print(f"Download failed: {filename} HTTP {response.status_code}")
+                    timing.failed = True
+                    return False
+
+                size = response.headers.get("Content-Length")
+                chunks = timing.count(self.iter_body(response, deadline))
+                if self.validate and filename.lower().endswith(JPEG_EXTENSIONS):
+                    chunks = check_jpeg_stream(chunks)
+                uploaded, etag, md5 = self.s3.upload_stream(
+                    self.bucket_name,
+                    object,
+                    chunks,
+                    int(size) if size is not None and size.isdigit() else None,
+                )
+        except (
+            requests.exceptions.RequestException,
+            botocore.exceptions.ClientError,
+            botocore.exceptions.BotoCoreError,
+            ValueError,
+        ) as e:
+            if isinstance(e, requests.exceptions.RequestException) and is_timeout(e):
+                self.count("timeouts")
+            print(f"Copy failed: {filename} {e}")
+            return False
+
+        with self.metrics.time(PHASE_VERIFY) as timing:
+            remote_etag = uploaded.get("ETag", "").replace('"', "")
+            timing.failed = bool(remote_etag) and remote_etag != etag
+        if timing.failed:
+            print(f"Copy failed: {filename} {etag} {remote_etag}")
+            return False
+
+        self.record_file(image_data, IMAGE, path, object, md5)
+
+        print(f"Copied {filename}")
+        return True
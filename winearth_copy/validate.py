@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+import importlib.util
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from winearth_copy.state import (
+    DOWNLOADED,
+    IMAGE,
+    QUARANTINED,
+    STARTED,
+    VERIFIED,
+)
+
+# Hidden directory under the download path that bad images are moved to
+QUARANTINE_DIRECTORY = ".quarantine"
+
+# Start of image and end of image markers
+JPEG_SOI = b"\xff\xd8\xff"
+JPEG_EOI = b"\xff\xd9"
+
+# Bytes at the end of a file searched for the end of image marker, to allow padding
+EOI_SEARCH_SIZE = 1024
+
+# Extensions of the JPEG images the downloader saves, the only files that are checked
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+
+
+def decode_available():
+    """
+    Check whether Pillow is installed so images can be fully decoded.
+
+    Decoding images is optional: pip install winearth_copy[validate]. Pillow is only
+    imported when an image is decoded, so winearth-sync, which checks the markers of
+    the images it streams, does not load it.
+
+    Returns:
+        bool: True if PIL can be imported.
+    """
+    return importlib.util.find_spec("PIL") is not None
+
+
+def is_jpeg(row):
+    """
+    Check whether a state database row is a JPEG image that can be validated. Other
+    files, such as TIFF or RAW images and files added to the directory by hand, are
+    uploaded as they are.
+
+    Args:
+        row (dict): The state database row of the file.
+
+    Returns:
+        bool: True if the file is an image with a .jpg or .jpeg name.
+    """
+    return (
+        row["kind"] == IMAGE
+        and row["path"] is not None
+        and row["path"].lower().endswith(JPEG_EXTENSIONS)
+    )
+
+
+def check_image(file_path, size=None, decode=False):
+    """
+    Check that a file is a complete JPEG image.
+
+    The size is compared with the one recorded when the image was downloaded, and
+    the file must start with the JPEG start of image marker and end with the end of
+    image marker, so truncated files and HTML error pages saved as images are found.
+    With decode, the whole image is also decoded with Pillow.
+
+    A module level function, so it can run in a process pool.
+
+    Args:
+        file_path (str): The path to the image.
+        size (int, optional): The expected size of the file in bytes. Defaults to None.
+        decode (bool, optional): Whether to decode the image. Defaults to False.
+
+    Returns:
+        str: The reason the image is bad, or None if it is a complete JPEG image.
+    """
+    try:
+        actual_size = os.path.getsize(file_path)
+        if size is not None and actual_size != size:
+            return "size %d, expected %d" % (actual_size, size)
+
+        with open(file_path, "rb") as f:
+            if f.read(len(JPEG_SOI)) != JPEG_SOI:
+                return "no JPEG start of image marker"
+
+            f.seek(max(0, actual_size - EOI_SEARCH_SIZE))
+            if JPEG_EOI not in f.read().rstrip(b"\x00"):
+                return "no JPEG end of image marker"
+    except OSError as e:
+        return str(e)
+
+    if decode:
+        from PIL import Image
+
+        try:
+            with Image.open(file_path) as image:
+                image.load()
+        except Exception as e:
+            # Pillow raises a variety of errors for corrupt image data
+            return "decode failed: %s" % e
+
+    return None
+
+
+def check_jpeg_stream(chunks):
+    """
+    Pass a JPEG image through as it is received, checking it the way check_image
+    checks a file.
+
+    The stream must start with the JPEG start of image marker, and the end of image
+    marker must be in its last EOI_SEARCH_SIZE bytes. The last piece is held back
+    until the end of the stream has been checked, so a consumer such as
+    S3Upload.upload_stream never receives the whole of a bad image.
+
+    Args:
+        chunks (iterable): The image as an iterable of bytes.
+
+    Yields:
+        bytes: The pieces of the image.
+
+    Raises:
+        ValueError: If a marker is missing.
+    """
+    head = b""
+    tail = b""
+    previous = None
+
+    for chunk in chunks:
+        if len(head) < len(JPEG_SOI):
+            head += chunk[: len(JPEG_SOI) - len(head)]
+            if not JPEG_SOI.startswith(head):
+                raise ValueError("no JPEG start of image marker")
+        tail = (tail + chunk)[-EOI_SEARCH_SIZE:]
+        if previous is not None:
+            yield previous
+        previous = chunk
+
+    if head != JPEG_SOI:
+        raise ValueError("no JPEG start of image marker")
+    if JPEG_EOI not in tail.rstrip(b"\x00"):
+        raise ValueError("no JPEG end of image marker")
+    if previous is not None:
+        yield previous
+
+
+class ImageValidator:
+    """
+    Checks the images the state database lists as downloaded before they are
+    uploaded.
+
+    Only JPEG images are checked, other files are uploaded as they are. Images are
+    checked by check_image in a pool of ``concurrency`` workers, threads
+    for the marker checks or processes when images are decoded. Good images move to
+    the verified state. Bad ones are moved under ``<path>/.quarantine``, marked as
+    quarantined so the downloaders fetch them again, and their day is marked as started
+    so a backfill runs it again.
+
+    Args:
+        path (str): The base path where files are saved.
+        state (winearth_copy.state.TransferState): The state database.
+        concurrency (int, optional): The number of images checked at the same time.
+            Defaults to 4.
+        decode (bool, optional): Whether to decode every image with Pillow. Defaults
+            to False.
+
+    Attributes:
+        path (str): The base path where files are saved.
+        state (winearth_copy.state.TransferState): The state database.
+        concurrency (int): The number of images checked at the same time.
+        decode (bool): Whether to decode every image.
+    """
+
+    def __init__(self, path, state, concurrency=4, decode=False):
+        self.path = path
+        self.state = state
+        self.concurrency = max(1, int(concurrency))
+        self.decode = decode
+
+    def quarantine(self, row, reason):
+        """
+        Move a bad image under the quarantine directory and queue it for download.
+
+        Args:
+            row (dict): The state database row of the image.
+            reason (str): Why the image is bad.
+
+        Returns:
+            None
+        """
+        file_path = os.path.join(self.path, row["path"])
+        quarantine_path = os.path.join(self.path, QUARANTINE_DIRECTORY, row["path"])
+
+        print(f"Quarantined {row['path']}: {reason}")
+        try:
+            os.makedirs(os.path.dirname(quarantine_path), exist_ok=True)
+            os.replace(file_path, quarantine_path)
+        except OSError as e:
+            print(f"Failed to quarantine {row['path']}: {e}")
+
+        self.state.set_state(
+            (row["mission"], row["roll"], row["frame"]), row["kind"], QUARANTINED
+        )
+        if row["query_date"] is not None and self.state.get_day(row["query_date"]):
+            self.state.set_day(row["query_date"], STARTED)
+
+        return None
+
+    def validate_row(self, row):
+        """
+        Check one file before it is uploaded, as validate does, for files that are
+        uploaded as soon as they are downloaded. Only JPEG images that are not verified yet
+        are checked.
+
+        Args:
+            row (dict): The state database row of the file.
+
+        Returns:
+            bool: True if the file can be uploaded, False if it was quarantined.
+        """
+        if not is_jpeg(row) or row["state"] != DOWNLOADED:
+            return True
+
+        reason = check_image(
+            os.path.join(self.path, row["path"]), row["size"], self.decode
+        )
+        if reason is not None:
+            self.quarantine(row, reason)
+            return False
+
+        self.state.set_state(
+            (row["mission"], row["roll"], row["frame"]), row["kind"], VERIFIED
+        )
+
+        return True
+
+    def validate(self):
+        """
+        Check every image the state database lists as downloaded. A new database is
+        first filled from the directory, as S3Upload.list_files does.
+
+        Returns:
+            dict: The number of images verified and quarantined, and the paths of the
+            quarantined images.
+        """
+        summary = {"verified": 0, "quarantined": 0, "quarantined_files": []}
+
+        if self.state.count() == 0:
+            self.state.import_directory(self.path)
+
+        rows = [row for row in self.state.pending([DOWNLOADED]) if is_jpeg(row)]
+        if not rows:
+            return summary
+
+        executor_class = ProcessPoolExecutor if self.decode else ThreadPoolExecutor
+        with executor_class(max_workers=self.concurrency) as executor:
+            reasons = executor.map(
+                check_image,
+                [os.path.join(self.path, row["path"]) for row in rows],
+                [row["size"] for row in rows],
+                [self.decode] * len(rows),
+            )
+            for row, reason in zip(rows, reasons):
+                if reason is None:
+                    self.state.set_state(
+                        (row["mission"], row["roll"], row["frame"]),
+                        row["kind"],
+                        VERIFIED,
+                    )
+                    summary["verified"] += 1
+                else:
+                    self.quarantine(row, reason)
+                    summary["quarantined"] += 1
+                    summary["quarantined_files"].append(row["path"])
+
+        return summary
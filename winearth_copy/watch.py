@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+# inotify_init1 flags, the same as O_NONBLOCK and O_CLOEXEC
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# inotify events
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# Files are complete once they are closed after writing or renamed into place, and
+# new directories are watched as soon as they are created
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# The watch descriptor, mask, cookie and name length that start each inotify event
+EVENT_HEADER = struct.Struct("iIII")
+
+# Bytes read from the inotify file descriptor at a time
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+def hidden(name):
+    """
+    Check whether a file or directory is hidden, such as an in-progress download,
+    a temporary metadata file or the state and quarantine directories.
+
+    Args:
+        name (str): The name of the file or directory.
+
+    Returns:
+        bool: True if the name starts with a dot.
+    """
+    return name.startswith(".")
+
+
+def scan(directory):
+    """
+    List the files and directories in a directory, skipping hidden ones.
+
+    Args:
+        directory (str): The path to the directory.
+
+    Returns:
+        tuple: Lists of the paths of the files and of the directories, empty if the
+        directory no longer exists.
+    """
+    files = []
+    directories = []
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if hidden(entry.name):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry.path)
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+
+    return files, directories
+
+
+class InotifyWatcher:
+    """
+    Reports the files that are finished under a directory with Linux inotify.
+
+    Every directory in the tree is watched. A file is reported once it is closed
+    after being written or is renamed into place, so the hidden ``.part`` and
+    temporary files of downloads in progress are never reported, only the finished
+    file they are renamed to. Directories created later are watched, and the files
+    already in them are reported.
+
+    Args:
+        path (str): The path to the directory.
+
+    Attributes:
+        path (str): The path to the directory.
+        fd (int): The inotify file descriptor.
+        directories (dict): The path of each watched directory, by watch descriptor.
+
+    Raises:
+        OSError: If inotify is not available or the directories can not be watched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.directories = {}
+        self.found = []
+
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, "inotify_init1: %s" % os.strerror(error))
+
+        try:
+            self.add_tree(path, report=False)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_tree(self, directory, report=True):
+        """
+        Watch a directory and every directory under it.
+
+        Args:
+            directory (str): The path to the directory.
+            report (bool, optional): Whether the files already in the directories are
+                reported by the next poll. Defaults to True.
+
+        Returns:
+            None
+
+        Raises:
+            OSError: If a directory can not be watched, for example because
+                fs.inotify.max_user_watches is reached.
+        """
+        directory_list = [directory]
+        while directory_list:
+            directory = directory_list.pop()
+            descriptor = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), WATCH_MASK
+            )
+            if descriptor < 0:
+                error = ctypes.get_errno()
+                # The directory was removed before it could be watched
+                if error == errno.ENOENT:
+                    continue
+                raise OSError(
+                    error, "inotify_add_watch: %s" % os.strerror(error), directory
+                )
+            self.directories[descriptor] = directory
+
+            # Files written before the watch was added do not raise events
+            files, directories = scan(directory)
+            if report:
+                self.found.extend(files)
+            directory_list.extend(directories)
+
+        return None
+
+    def poll(self, timeout):
+        """
+        Wait for files to be finished.
+
+        Args:
+            timeout (float): The most seconds to wait.
+
+        Returns:
+            list: The paths of the files finished since the last poll.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                data = os.read(self.fd, EVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                data = b""
+            self.read_events(data)
+
+        files, self.found = self.found, []
+
+        return files
+
+    def read_events(self, data):
+        """
+        Handle the events read from the inotify file descriptor.
+
+        Args:
+            data (bytes): The events.
+
+        Returns:
+            None
+        """
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so report every file and let the uploader skip
+                # the ones it already has
+                print(f"Too many file events, rescanning {self.path}")
+                self.rescan()
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(descriptor, None)
+                continue
+
+            directory = self.directories.get(descriptor)
+            if directory is None or not name or hidden(name):
+                continue
+
+            file_path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.add_tree(file_path)
+                    except OSError as e:
+                        print(f"Failed to watch {file_path}: {e}")
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.found.append(file_path)
+
+        return None
+
+    def rescan(self):
+        """
+        Report every file in the watched directories.
+
+        Returns:
+            None
+        """
+        for directory in list(self.directories.values()):
+            files, _ = scan(directory)
+            self.found.extend(files)
+
+        return None
+
+    def close(self):
+        """
+        Stop watching.
+
+        Returns:
+            None
+        """
+        os.close(self.fd)
+        self.directories = {}
+
+        return None
+
+
+class PollingWatcher:
+    """
+    Reports the files that are finished under a directory by polling it with scandir.
+
+    Used where inotify is not available. A directory is listed again only when its
+    modification time changes, which happens when a file is created, renamed into it
+    or removed, so a poll of a large tree costs one stat per directory rather than
+    a listing of every file. A new file is reported once its size and modification
+    time have not changed between two polls.
+
+    Args:
+        path (str): The path to the directory.
+        interval (float, optional): The seconds between polls. Defaults to 5.
+
+    Attributes:
+        path (str): The path to the directory.
+        interval (float): The seconds between polls.
+        directories (dict): The modification time in nanoseconds of each directory
+            when it was last listed.
+        known (dict): The set of files in each directory that were reported or were
+            there when the watcher started.
+        pending (dict): The size and modification time of each new file that is
+            not finished yet.
+    """
+
+    def __init__(self, path, interval=5):
+        self.path = path
+        self.interval = interval
+        self.directories = {}
+        self.known = {}
+        self.pending = {}
+        self.scanned = time.time_ns()
+
+        directory_list = [path]
+        while directory_list:
+            directory = directory_list.pop()
+            files, directories = self.list_directory(directory)
+            self.known[directory] = set(files)
+            directory_list.extend(directories)
+
+    def list_directory(self, directory):
+        """
+        List a directory and remember its modification time.
+
+        Args:
+            directory (str): The path to the directory.
+
+        Returns:
+            tuple: Lists of the paths of the files and of the directories in it.
+        """
+        try:
+            self.directories[directory] = os.stat(directory).st_mtime_ns
+        except OSError:
+            self.directories.pop(directory, None)
+            return [], []
+
+        return scan(directory)
+
+    def changed_directories(self, since):
+        """
+        List the directories whose contents may have changed.
+
+        Args:
+            since (int): The time.time_ns() of the last poll.
+
+        Returns:
+            list: The paths of the directories.
+        """
+        changed = []
+        for directory, mtime_ns in list(self.directories.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                del self.directories[directory]
+                self.known.pop(directory, None)
+                continue
+            # A file created in the same clock tick as the last listing does not
+            # change the modification time, so recently changed directories are
+            # listed again
+            if current != mtime_ns or current >= since - 1000000000:
+                changed.append(directory)
+
+        return changed
+
+    def poll(self, timeout):
+        """
+        Wait for files to be finished.
+
+        Args:
+            timeout (float): The most seconds to wait.
+
+        Returns:
+            list: The paths of the files finished since the last poll.
+        """
+        time.sleep(min(timeout, self.interval))
+        since, self.scanned = self.scanned, time.time_ns()
+
+        directory_list = self.changed_directories(since)
+        while directory_list:
+            directory = directory_list.pop()
+            files, directories = self.list_directory(directory)
+            current = set(files)
+            known = self.known.get(directory, set())
+            for file_path in current - known:
+                self.pending.setdefault(file_path, None)
+            # Forget the files that were uploaded and removed
+            self.known[directory] = known & current
+            directory_list.extend(
+                sub_directory
+                for sub_directory in directories
+                if sub_directory not in self.directories
+            )
+
+        finished = []
+        for file_path, previous in list(self.pending.items()):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                del self.pending[file_path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current == previous:
+                del self.pending[file_path]
+                self.known.setdefault(os.path.dirname(file_path), set()).add(file_path)
+                finished.append(file_path)
+            else:
+                self.pending[file_path] = current
+
+        return finished
+
+    def close(self):
+        """
+        Stop watching.
+
+        Returns:
+            None
+        """
+        self.directories = {}
+        self.known = {}
+        self.pending = {}
+
+        return None
+
+
+def open_watcher(path, interval=5):
+    """
+    Watch a directory for finished files with inotify, or by polling it where
+    inotify is not available.
+
+    Args:
+        path (str): The path to the directory.
+        interval (float, optional): The seconds between polls when polling.
+            Defaults to 5.
+
+    Returns:
+        InotifyWatcher or PollingWatcher: The watcher.
+    """
+    try:
+        return InotifyWatcher(path)
+    except (OSError, AttributeError, TypeError) as e:
+        print(f"Polling {path} every {interval} seconds, inotify is not available: {e}")
+        return PollingWatcher(path, interval)
@@ -1,40 +1,476 @@
 #!/usr/bin/env python
 
+import codecs
+import hashlib
 import json
+import statistics
+import threading
+import time
 import os
 import requests
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.exceptions import ReadTimeoutError
+from winearth_copy.limits import AdaptiveLimiter, AdaptiveRetry
+from winearth_copy.metadata import JSON, JSON_LINES, MetadataLines
+from winearth_copy.metrics import (
+    PHASE_DOWNLOAD,
+    PHASE_HASH,
+    PHASE_LIST,
+    PHASE_METADATA,
+    Metrics,
+)
+from winearth_copy.state import (
+    DELETED,
+    DOWNLOADED,
+    IMAGE,
+    METADATA,
+    METADATA_LINES,
+    QUARANTINED,
+    metadata_lines_key,
+    record_key,
+)
+
+NO_RECORDS = "SQL found no records that match the specified criteria"
+
+# The connect and read timeouts in seconds for every HTTP request
+DEFAULT_TIMEOUT = (10, 60)
+
+# The image latencies needed before the 95th percentile is used to hedge requests
+HEDGE_MIN_SAMPLES = 20
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised when an image is still being received after its deadline.
+    """
+
+
+class HedgeCancelled(Exception):
+    """
+    Raised in the slower of two hedged requests once the other one has finished.
+    """
+
+
+def is_timeout(e):
+    """
+    Check whether a requests exception was caused by a timeout.
+
+    Read timeouts are raised by requests as a ConnectionError wrapping urllib3's
+    ReadTimeoutError, or a MaxRetryError caused by one once the retries run out.
+
+    Args:
+        e (requests.exceptions.RequestException): The exception.
+
+    Returns:
+        bool: True if the request timed out.
+    """
+    if isinstance(e, requests.exceptions.Timeout):
+        return True
+
+    reason = e.args[0] if e.args else None
+    reason = getattr(reason, "reason", reason)
+
+    return isinstance(reason, ReadTimeoutError)
+
+
+def pool_size(concurrency, hedge=False, days=1):
+    """
+    Get the number of connections an HTTP session needs to keep alive per host.
+
+    Each day downloaded over the session streams its listing while up to
+    ``concurrency`` images are transferred, and a hedged image can have two requests
+    in flight.
+
+    Args:
+        concurrency (int): The number of images transferred at the same time for a day.
+        hedge (bool, optional): Whether slow image requests are hedged. Defaults to
+            False.
+        days (int, optional): The number of days downloaded over the session at the
+            same time. Defaults to 1.
+
+    Returns:
+        int: The number of connections.
+    """
+    return days * (concurrency * (2 if hedge else 1) + 1)
+
+
+class JsonArrayParser:
+    """
+    An incremental parser for a JSON array that is received in pieces.
+
+    Each call to feed returns the elements completed by that piece. A document that is
+    not an array, such as the {"result": ...} message the GAPE API returns when nothing
+    matches, is returned whole by close.
+
+    Attributes:
+        buffer (str): The text received but not parsed yet.
+        in_array (bool): Whether the document is an array, or None until the first
+            character is received.
+        finished (bool): Whether the closing bracket of the array has been received.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.in_array = None
+        self.finished = False
+
+    def feed(self, chunk):
+        """
+        Parse the next piece of the document.
+
+        Args:
+            chunk (bytes): The next piece of the document.
+
+        Returns:
+            list: The array elements completed by this piece.
+        """
+        buffer = self.buffer + self.text_decoder.decode(chunk)
+        position = 0
+        elements = []
+
+        while self.in_array is not False and not self.finished:
+            # Skip whitespace and the commas between elements
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+
+            if self.in_array is None:
+                self.in_array = buffer[position] == "["
+                if self.in_array:
+                    position += 1
+                continue
+
+            if buffer[position] == "]":
+                self.finished = True
+                break
+
+            try:
+                element, end = self.decoder.raw_decode(buffer, position)
+            except json.decoder.JSONDecodeError:
+                # The element has not been received completely yet
+                break
+
+            # A number is only complete once the character after it is received
+            if not isinstance(element, (dict, list, str)) and (
+                end == len(buffer) or buffer[end] not in " \t\r\n,]"
+            ):
+                break
+
+            elements.append(element)
+            position = end
+
+        self.buffer = buffer[position:]
+
+        return elements
+
+    def close(self):
+        """
+        Finish parsing once the whole document has been received.
+
+        Returns:
+            list: The whole document if it is not an array, otherwise an empty list.
+
+        Raises:
+            json.decoder.JSONDecodeError: If the document is not valid JSON or ends early.
+        """
+        buffer = self.buffer + self.text_decoder.decode(b"", final=True)
+
+        if not self.in_array:
+            return [json.loads(buffer)]
+        if not self.finished:
+            raise json.decoder.JSONDecodeError(
+                "Unterminated array", buffer, len(buffer)
+            )
+
+        return []
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parse a JSON array, yielding each element as soon as it is received.
+
+    A document that is not an array, such as the {"result": ...} message the GAPE API
+    returns when nothing matches, is yielded whole once it has been received.
+
+    Args:
+        chunks (iterable): The document as an iterable of bytes.
+
+    Yields:
+        The elements of the array.
+
+    Raises:
+        json.decoder.JSONDecodeError: If the document is not valid JSON or ends early.
+    """
+    parser = JsonArrayParser()
+
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+    yield from parser.close()
 
 
 class WinEarthDownload:
-    def __init__(self, query_date, api_key):
+    def __init__(
+        self,
+        query_date,
+        api_key,
+        concurrency=1,
+        retries=5,
+        manifest=None,
+        state=None,
+        session=None,
+        limiter=None,
+        metadata_format=JSON,
+        bandwidth=None,
+        timeout=DEFAULT_TIMEOUT,
+        deadline=None,
+        hedge=False,
+        metrics=None,
+        pool_maxsize=None,
+    ):
         self.query_date = query_date
         self.api_key = api_key
+        self.concurrency = max(1, int(concurrency))
+        self.retries = retries
+        self.manifest = manifest
+        self.state = state
+        self.limiter = limiter
+        self.bandwidth = bandwidth
+        self.timeout = timeout
+        self.deadline = deadline or None
+        self.hedge = hedge
+        self.hedge_executor = None
+        self.latencies = deque(maxlen=1000)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metadata_lines = (
+            MetadataLines(query_date) if metadata_format == JSON_LINES else None
+        )
+        self.directories = set()
+        self.counts = Counter()
+        self.counts_lock = threading.Lock()
         self.api_url = "https://eol.jsc.nasa.gov/SearchPhotos/PhotosDatabaseAPI/PhotosDatabaseAPI.pl"
         self.base_download_url = "https://eol.jsc.nasa.gov/DatabaseImages/"
+        self.chunk_size = 1024 * 1024
 
-    def list_images(self):
+        if pool_maxsize is None:
+            pool_maxsize = pool_size(self.concurrency, self.hedge)
+        self.pool_maxsize = pool_maxsize
+        self.session = session if session is not None else self.create_session()
+
+    def create_session(self):
         """
-        Retrieves a list of images based on the specified query date.
+        Create an HTTP session shared by the GAPE API and image requests.
+
+        The session keeps up to ``pool_maxsize`` connections alive per host and retries
+        connection errors and 429/5xx responses with exponential backoff and jitter.
+        When the limiter is an AdaptiveLimiter, it backs off on every throttling
+        response, timeout and connection error that is retried. Every retry is counted
+        in ``metrics``.
 
         Returns:
-            dict or None: A dictionary containing the response data in JSON format if the request is successful,
-            otherwise None.
+            requests.Session: The pooled session.
+        """
+        retry = AdaptiveRetry(
+            total=self.retries,
+            backoff_factor=0.5,
+            backoff_jitter=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            raise_on_status=False,
+            limiter=self.limiter if isinstance(self.limiter, AdaptiveLimiter) else None,
+            on_retry=self.observe_retry,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=2, pool_maxsize=self.pool_maxsize, max_retries=retry
+        )
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        return session
+
+    def observe_retry(self, url):
+        """
+        Count a retried request in ``metrics``, as a listing or a download retry.
+
+        Args:
+            url (str): The URL of the request.
+
+        Returns:
+            None
+        """
+        if urlsplit(self.api_url).path in url:
+            self.metrics.retry(PHASE_LIST)
+        else:
+            self.metrics.retry(PHASE_DOWNLOAD)
+
+        return None
+
+    def connection_stats(self):
+        """
+        Count the HTTP requests sent and the connections opened by the session.
+
+        Returns:
+            dict: The number of requests, new connections and reused connections.
+        """
+        request_count = 0
+        connection_count = 0
+
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                request_count += pools[key].num_requests
+                connection_count += pools[key].num_connections
+
+        return {
+            "requests": request_count,
+            "connections": connection_count,
+            "reused": request_count - connection_count,
+        }
+
+    def close(self):
+        """
+        Close the HTTP session and its pooled connections.
+        """
+        self.session.close()
+
+    def list_params(self):
+        """
+        Build the GAPE API query parameters for the query date.
+
+        Returns:
+            dict: The query parameters.
         """
-        params = {
+        return {
             "query": f"nadir|pdate|eq|{self.query_date}",
             "return": "nadir|mission|nadir|roll|nadir|frame|nadir|pdate|nadir|ptime|nadir|lat|nadir|lon|nadir|azi|nadir|elev|nadir|cldp|images|directory|images|filename",
             "key": self.api_key,
         }
-        response = requests.get(self.api_url, params=params)
+
+    def list_images(self):
+        """
+        Retrieves a list of images based on the specified query date.
+
+        Returns:
+            dict or None: A dictionary containing the response data in JSON format if the request is successful,
+            otherwise None.
+        """
+        with self.metrics.time(PHASE_LIST) as timing:
+            response = self.session.get(
+                self.api_url, params=self.list_params(), timeout=self.timeout
+            )
+            timing.bytes = len(response.content)
+            timing.failed = response.status_code != 200
+
         if response.status_code == 200:
             return response.json()
         else:
             return None
 
+    def make_directory(self, directory):
+        """
+        Create a directory unless this downloader already created or found it.
+
+        Args:
+            directory (str): The path to the directory.
+
+        Returns:
+            None
+        """
+        if directory not in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            self.directories.add(directory)
+
+    def is_saved(self, image_data, kind, path, file_path):
+        """
+        Check whether a file for an image has already been saved.
+
+        With a state database, the file is only looked for on disk when the database
+        does not know about it, and a file found that way is added to the database.
+        Quarantined images are not saved, so they are downloaded again.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            kind (str): The kind of file, IMAGE or METADATA.
+            path (str): The base path where files are saved.
+            file_path (str): The path to the file.
+
+        Returns:
+            bool: True if the file has already been saved.
+        """
+        if self.state is not None:
+            row = self.state.get(record_key(image_data), kind)
+            # A file imported from the directory is keyed by its path
+            if row is None:
+                row = self.state.get_path(os.path.relpath(file_path, path))
+            if row is not None and row["state"] != QUARANTINED:
+                return True
+
+        if not os.path.exists(file_path):
+            return False
+
+        if self.state is not None:
+            self.state.set_state(
+                record_key(image_data),
+                kind,
+                DOWNLOADED,
+                path=os.path.relpath(file_path, path),
+                query_date=self.query_date,
+            )
+
+        return True
+
+    def record_file(self, image_data, kind, path, file_path, md5):
+        """
+        Record a saved file in the manifest and the state database, if they are set.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            kind (str): The kind of file, IMAGE or METADATA.
+            path (str): The base path where files are saved.
+            file_path (str): The path to the file.
+            md5 (str): The MD5 hash of the file.
+
+        Returns:
+            None
+        """
+        if self.manifest is not None:
+            self.manifest.record(file_path, md5)
+
+        if self.state is not None:
+            stat = os.stat(file_path)
+            self.state.set_state(
+                record_key(image_data),
+                kind,
+                DOWNLOADED,
+                path=os.path.relpath(file_path, path),
+                query_date=self.query_date,
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                md5=md5,
+            )
+
     def save_metadata(self, json_data, path):
         """
         Save metadata for each image in the provided JSON data.
 
+        When a manifest or state database is set, the size and MD5 hash of each
+        metadata file are recorded in it. With the JSON Lines metadata format the
+        records are only collected, and save_metadata_lines writes them.
+
         Args:
             json_data (list): A list of dictionaries containing image metadata.
             path (str): The base path where the metadata files should be saved.
@@ -43,26 +479,554 @@ class WinEarthDownload:
             int: The number of metadata files successfully written.
 
         """
+        if self.metadata_lines is not None:
+            for image_data in json_data:
+                self.metadata_lines.add(image_data)
+            return 0
+
         write_count = 0
 
         for image_data in json_data:
             full_path = "%s/%s/" % (path, image_data["images.directory"])
             filename = image_data["images.filename"].replace(".JPG", ".json")
 
-            if not os.path.exists(os.path.dirname(full_path)):
-                os.makedirs(os.path.dirname(full_path))
+            if not self.is_saved(image_data, METADATA, path, full_path + filename):
+                self.make_directory(os.path.dirname(full_path))
 
-            if not os.path.exists(full_path + filename):
-                with open(full_path + filename, "w") as f:
-                    json.dump(image_data, f, indent=4)
-                    write_count += 1
+                with self.metrics.time(PHASE_METADATA) as timing:
+                    data = json.dumps(image_data, indent=4).encode()
+                    with open(full_path + filename, "wb") as f:
+                        f.write(data)
+                    timing.bytes = len(data)
+                write_count += 1
+
+                self.record_file(
+                    image_data,
+                    METADATA,
+                    path,
+                    full_path + filename,
+                    hashlib.md5(data).hexdigest(),
+                )
 
         return write_count
 
+    def save_metadata_lines(self, path):
+        """
+        Write the metadata records collected for the query date as one JSON Lines file
+        per image directory, and record each file in the manifest and state database.
+        A file the state database already has with the same content is not written
+        again, so it is not uploaded again.
+
+        Args:
+            path (str): The base path where the metadata files should be saved.
+
+        Returns:
+            int: The number of metadata files written, 0 unless the JSON Lines metadata
+            format is used.
+        """
+        if self.metadata_lines is None:
+            return 0
+
+        with self.metrics.time(PHASE_METADATA) as timing:
+            saved = self.metadata_lines.save(path, self.metadata_lines_unchanged)
+            timing.bytes = sum(os.path.getsize(file_path) for _, file_path, _ in saved)
+
+        for directory, file_path, md5 in saved:
+            if self.manifest is not None:
+                self.manifest.record(file_path, md5)
+
+            if self.state is not None:
+                stat = os.stat(file_path)
+                self.state.set_state(
+                    metadata_lines_key(directory, self.query_date),
+                    METADATA_LINES,
+                    DOWNLOADED,
+                    path=os.path.relpath(file_path, path),
+                    query_date=self.query_date,
+                    size=stat.st_size,
+                    mtime_ns=stat.st_mtime_ns,
+                    md5=md5,
+                )
+
+        return len(saved)
+
+    def metadata_lines_unchanged(self, directory, file_path, md5):
+        """
+        Check whether the state database already has a JSON Lines metadata file with
+        the same content, either still on disk or uploaded and removed.
+
+        Args:
+            directory (str): The image directory, relative to the base path.
+            file_path (str): The path to the file.
+            md5 (str): The MD5 hash of the new content.
+
+        Returns:
+            bool: True if the file does not need to be written again.
+        """
+        if self.state is None:
+            return False
+
+        row = self.state.get(
+            metadata_lines_key(directory, self.query_date), METADATA_LINES
+        )
+        if row is None or row["md5"] != md5:
+            return False
+
+        return row["state"] == DELETED or os.path.exists(file_path)
+
+    def download_image(self, image_data, path):
+        """
+        Downloads a single image and saves it to the specified path.
+
+        When a limiter, such as a semaphore shared with other downloaders, is set, the
+        transfer only starts once the limiter is acquired. An AdaptiveLimiter backs off
+        when the download fails.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            path (str): The path where the image will be saved.
+
+        Returns:
+            bool or None: True if the image was downloaded, False if the download failed,
+            None if the image already exists.
+        """
+        full_path = "%s/%s/" % (path, image_data["images.directory"])
+        filename = image_data["images.filename"]
+
+        if self.is_saved(image_data, IMAGE, path, full_path + filename):
+            return None
+
+        self.make_directory(os.path.dirname(full_path))
+
+        with self.limiter if self.limiter is not None else nullcontext():
+            downloaded = self.fetch_image(image_data, path)
+            if not downloaded and isinstance(self.limiter, AdaptiveLimiter):
+                self.limiter.backoff()
+
+        return downloaded
+
+    def fetch_image(self, image_data, path):
+        """
+        Fetches an image from the image host and saves it to the specified path.
+
+        The response body is streamed in ``chunk_size`` pieces to a hidden
+        ``.<filename>.part`` file that is fsynced and atomically renamed to
+        ``images.directory/images.filename``. When the server sends an ETag or
+        Last-Modified validator it is kept with the expected length in a
+        ``.<filename>.part.json`` sidecar, and a download that is interrupted is resumed
+        with a Range request, up to ``retries`` times in this run and again on the next
+        run. When a deadline is set, an image that takes longer is given up on. When a
+        manifest or state database is set, the MD5 hash of the image is recorded in it.
+        The time and size of the download are added to ``metrics``.
+
+        Args:
+            image_data (dict): A dictionary containing image data.
+            path (str): The path where the image will be saved.
+
+        Returns:
+            bool: True if the image was downloaded, False if the download failed.
+        """
+        full_path = "%s/%s/" % (path, image_data["images.directory"])
+        filename = image_data["images.filename"]
+
+        url = self.base_download_url + image_data["images.directory"] + "/" + filename
+        part_path = f"{full_path}.{filename}.part"
+
+        start = time.monotonic()
+        deadline = start + self.deadline if self.deadline is not None else None
+        with self.metrics.time(PHASE_DOWNLOAD) as timing:
+            if self.hedge_executor is not None:
+                md5, part_path = self.fetch_hedged(url, filename, part_path, deadline)
+            else:
+                md5 = self.fetch_attempts(url, filename, part_path, deadline)
+
+            if md5 is None:
+                timing.failed = True
+                return False
+
+            try:
+                os.replace(part_path, full_path + filename)
+                self.remove_part(part_path)
+                timing.bytes = os.path.getsize(full_path + filename)
+
+                self.record_file(image_data, IMAGE, path, full_path + filename, md5)
+            except OSError as e:
+                print(f"Download failed: {filename} {e}")
+                timing.failed = True
+                return False
+
+        with self.counts_lock:
+            self.latencies.append(time.monotonic() - start)
+
+        print(f"Downloaded {filename}")
+        return True
+
+    def fetch_attempts(self, url, filename, part_path, deadline=None, cancel=None):
+        """
+        Download an image into a part file, resuming it after an interrupted transfer
+        up to ``retries`` times or until the deadline.
+
+        Args:
+            url (str): The URL of the image.
+            filename (str): The file name of the image.
+            part_path (str): The path to the part file.
+            deadline (float, optional): The time.monotonic() value by which the image
+                must be received. Defaults to None.
+            cancel (threading.Event, optional): Set to stop the transfer. Defaults to None.
+
+        Returns:
+            str: The MD5 hash of the image, or None if the download failed or was
+            cancelled.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self.fetch_part(url, filename, part_path, deadline, cancel)
+            except HedgeCancelled:
+                return None
+            except requests.exceptions.RequestException as e:
+                if is_timeout(e):
+                    self.count("timeouts")
+                # Timeouts and resets while reading the body are not seen by the
+                # retries of the session
+                if isinstance(self.limiter, AdaptiveLimiter):
+                    self.limiter.backoff()
+                print(f"Download interrupted: {filename} {e}")
+                # Without an ETag or Last-Modified header the part cannot be
+                # resumed, so the next attempt downloads the whole image again.
+                # Otherwise the part file is kept for the next run.
+                if self.read_part_info(part_path) is None:
+                    self.remove_part(part_path)
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                if attempt < self.retries:
+                    self.metrics.retry(PHASE_DOWNLOAD)
+            except OSError as e:
+                print(f"Download failed: {filename} {e}")
+                if self.read_part_info(part_path) is None:
+                    self.remove_part(part_path)
+                return None
+
+        print(f"Download failed: {filename} after {attempt + 1} attempts")
+        return None
+
+    def fetch_hedged(self, url, filename, part_path, deadline=None):
+        """
+        Download an image, sending a second request for it if the first one takes
+        longer than the 95th percentile of the images downloaded so far.
+
+        The hedged request is written to its own ``.<filename>.hedge.part`` file. The
+        first request to receive the whole image wins, and the other one is cancelled
+        and its part file removed.
+
+        Args:
+            url (str): The URL of the image.
+            filename (str): The file name of the image.
+            part_path (str): The path to the part file.
+            deadline (float, optional): The time.monotonic() value by which the image
+                must be received. Defaults to None.
+
+        Returns:
+            tuple: The MD5 hash of the image, or None if both requests failed, and the
+            path to the part file it was written to.
+        """
+        delay = self.hedge_delay()
+        if delay is None:
+            return self.fetch_attempts(url, filename, part_path, deadline), part_path
+
+        primary_cancel = threading.Event()
+        primary = self.hedge_executor.submit(
+            self.fetch_attempts, url, filename, part_path, deadline, primary_cancel
+        )
+        done, pending = wait([primary], timeout=delay)
+        if done:
+            return primary.result(), part_path
+
+        self.count("hedges")
+        print(f"Hedging {filename} after {delay:.2f}s")
+
+        hedge_path = part_path[: -len(".part")] + ".hedge.part"
+        self.remove_part(hedge_path)
+        hedge_cancel = threading.Event()
+        hedge = self.hedge_executor.submit(
+            self.fetch_attempts, url, filename, hedge_path, deadline, hedge_cancel
+        )
+
+        transfers = {
+            primary: (part_path, primary_cancel),
+            hedge: (hedge_path, hedge_cancel),
+        }
+        while transfers:
+            done, pending = wait(transfers, return_when=FIRST_COMPLETED)
+            for future in done:
+                future_path, cancel = transfers.pop(future)
+                md5 = future.result()
+                if md5 is None:
+                    continue
+
+                for other, (other_path, other_cancel) in transfers.items():
+                    other_cancel.set()
+                    other.add_done_callback(
+                        lambda other, other_path=other_path: self.remove_part(
+                            other_path
+                        )
+                    )
+                if future is hedge:
+                    self.count("hedge_wins")
+
+                return md5, future_path
+
+        self.remove_part(hedge_path)
+        return None, part_path
+
+    def hedge_delay(self):
+        """
+        Get the 95th percentile of the image download times seen so far.
+
+        Returns:
+            float: The seconds to wait before hedging a request, or None if too few
+            images have been downloaded to tell.
+        """
+        with self.counts_lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return statistics.quantiles(self.latencies, n=20)[-1]
+
+    @contextmanager
+    def hedging(self):
+        """
+        Run the thread pool for hedged requests while the context is open, if hedging
+        is on.
+
+        The pool has two threads for each of the ``concurrency`` downloads, one for the
+        first request and one for the hedged request. Leaving the context waits for
+        cancelled requests to finish.
+        """
+        if not self.hedge:
+            yield
+            return
+
+        with ThreadPoolExecutor(max_workers=2 * self.concurrency) as executor:
+            self.hedge_executor = executor
+            try:
+                yield
+            finally:
+                self.hedge_executor = None
+
+    def fetch_part(self, url, filename, part_path, deadline=None, cancel=None):
+        """
+        Download an image into its ``.part`` file, resuming from the bytes already in
+        it when the sidecar has a validator.
+
+        The Range request carries the validator in If-Range, so a changed image is sent
+        whole with 200 and the part file is started again. A server that answers with
+        a range that does not continue the part file is asked for the whole image.
+
+        Args:
+            url (str): The URL of the image.
+            filename (str): The file name of the image.
+            part_path (str): The path to the part file.
+            deadline (float, optional): The time.monotonic() value by which the image
+                must be received. Defaults to None.
+            cancel (threading.Event, optional): Set to stop the transfer. Defaults to None.
+
+        Returns:
+            str: The MD5 hash of the complete image, or None if the server answered
+            with an error.
+
+        Raises:
+            requests.exceptions.RequestException: If the transfer is interrupted or
+                times out. The part file and its sidecar are kept so it can be resumed.
+            HedgeCancelled: If cancel is set.
+            OSError: If the part file can not be written.
+        """
+        info = self.read_part_info(part_path)
+        headers = {}
+        if info is not None and info["size"] > 0:
+            headers["Range"] = "bytes=%d-" % info["size"]
+            headers["If-Range"] = info["etag"] or info["last_modified"]
+
+        with self.session.get(
+            url, stream=True, headers=headers, timeout=self.timeout
+        ) as response:
+            if "Range" not in headers:
+                info = None
+
+            if response.status_code == 416 and info is not None:
+                if info["size"] == info["length"]:
+                    print(f"Resumed {filename} at {info['size']} bytes")
+                    return self.hash_part(part_path)
+                self.remove_part(part_path)
+                return self.fetch_part(url, filename, part_path, deadline, cancel)
+
+            if response.status_code == 206 and info is not None:
+                if response.headers.get("Content-Range", "").split("/")[0] != (
+                    "bytes %d-%d" % (info["size"], info["length"] - 1)
+                ):
+                    self.remove_part(part_path)
+                    return self.fetch_part(url, filename, part_path, deadline, cancel)
+
+                print(f"Resuming {filename} at {info['size']} bytes")
+                hash_md5 = hashlib.md5()
+                self.hash_part(part_path, hash_md5)
+                mode = "ab"
+                length = info["length"]
+            elif response.status_code == 200:
+                hash_md5 = hashlib.md5()
+                mode = "wb"
+                length = self.write_part_info(part_path, response)
+            else:
+                print(f"Download failed: {filename} HTTP {response.status_code}")
+                return None
+
+            # Flush what was received even if the transfer is interrupted, so the next
+            # attempt can resume from it
+            with open(part_path, mode) as f:
+                try:
+                    for chunk in self.iter_body(response, deadline):
+                        if cancel is not None and cancel.is_set():
+                            raise HedgeCancelled()
+                        f.write(chunk)
+                        hash_md5.update(chunk)
+                finally:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        if length is not None and os.path.getsize(part_path) != length:
+            raise requests.exceptions.ConnectionError(
+                "Received %d of %d bytes" % (os.path.getsize(part_path), length)
+            )
+
+        return hash_md5.hexdigest()
+
+    def read_part_info(self, part_path):
+        """
+        Read the sidecar of a part file.
+
+        Args:
+            part_path (str): The path to the part file.
+
+        Returns:
+            dict: The expected length, ETag and Last-Modified validators of the image
+            and the size of the part file, or None if there is no part file that can
+            be resumed.
+        """
+        try:
+            with open(part_path + ".json", "r") as f:
+                info = json.load(f)
+            info["size"] = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            return None
+
+        if not info.get("length") or not (
+            info.get("etag") or info.get("last_modified")
+        ):
+            return None
+
+        return info
+
+    def write_part_info(self, part_path, response):
+        """
+        Write the sidecar of a part file from the headers of a full response.
+
+        The sidecar is only written, and the download can only be resumed, when the
+        response has a Content-Length and an ETag or Last-Modified validator.
+
+        Args:
+            part_path (str): The path to the part file.
+            response (requests.Response): The response.
+
+        Returns:
+            int: The expected length of the image, or None if it is not known.
+        """
+        length = response.headers.get("Content-Length")
+        length = int(length) if length is not None and length.isdigit() else None
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+
+        # A weak ETag can not be used in If-Range
+        if etag is not None and etag.startswith("W/"):
+            etag = None
+
+        if length is None or not (etag or last_modified):
+            if os.path.exists(part_path + ".json"):
+                os.remove(part_path + ".json")
+            return length
+
+        with open(part_path + ".json", "w") as f:
+            json.dump(
+                {"length": length, "etag": etag, "last_modified": last_modified}, f
+            )
+
+        return length
+
+    def hash_part(self, part_path, hash_md5=None):
+        """
+        Hash the bytes already in a part file.
+
+        Args:
+            part_path (str): The path to the part file.
+            hash_md5 (hashlib.md5, optional): The hash to update. Defaults to a new one.
+
+        Returns:
+            str: The MD5 hash of the part file.
+        """
+        if hash_md5 is None:
+            hash_md5 = hashlib.md5()
+
+        with self.metrics.time(PHASE_HASH) as timing, open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                hash_md5.update(chunk)
+                timing.bytes += len(chunk)
+
+        return hash_md5.hexdigest()
+
+    def remove_part(self, part_path):
+        """
+        Remove a part file and its sidecar, if they exist.
+
+        Args:
+            part_path (str): The path to the part file.
+
+        Returns:
+            None
+        """
+        for file_path in (part_path, part_path + ".json"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+        return None
+
+    def iter_body(self, response, deadline=None):
+        """
+        Iterate over a streamed response body in ``chunk_size`` pieces, keeping to the
+        bandwidth limit if one is set.
+
+        Args:
+            response (requests.Response): The streamed response.
+            deadline (float, optional): The time.monotonic() value by which the body
+                must be received. It is checked between pieces. Defaults to None.
+
+        Yields:
+            bytes: The pieces of the body.
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before the whole body is received.
+        """
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            if deadline is not None and time.monotonic() > deadline:
+                raise DeadlineExceeded("Deadline of %ss exceeded" % self.deadline)
+            if self.bandwidth is not None:
+                self.bandwidth.consume(len(chunk))
+            yield chunk
+
     def download_images(self, json_data, path):
         """
         Downloads images from the provided JSON data and saves them to the specified path.
 
+        Images are fetched by a pool of up to ``concurrency`` worker threads, so a slow or
+        failing image does not hold up the rest. The number of downloaded, skipped and
+        failed images, timed out requests and hedged requests is added to ``counts``.
+
         Args:
             json_data (list): A list of dictionaries containing image data.
             path (str): The path where the images will be saved.
@@ -73,24 +1037,133 @@ class WinEarthDownload:
 
         write_count = 0
 
-        for image_data in json_data:
-            full_path = "%s/%s/" % (path, image_data["images.directory"])
-            filename = image_data["images.filename"]
-
-            if not os.path.exists(os.path.dirname(full_path)):
-                os.makedirs(os.path.dirname(full_path))
-
-            if not os.path.exists(full_path + filename):
-                with open(full_path + filename, "wb") as f:
-                    f.write(
-                        requests.get(
-                            self.base_download_url
-                            + image_data["images.directory"]
-                            + "/"
-                            + image_data["images.filename"]
-                        ).content
-                    )
-                    print(f"Downloaded {image_data['images.filename']}")
+        with self.hedging(), ThreadPoolExecutor(
+            max_workers=self.concurrency
+        ) as executor:
+            futures = [
+                executor.submit(self.download_image, image_data, path)
+                for image_data in json_data
+            ]
+            for future in as_completed(futures):
+                if self.count_download(future):
                     write_count += 1
 
         return write_count
+
+    def count_download(self, future):
+        """
+        Add the result of a finished download_image call to ``counts``. A download
+        that raised an exception is counted as failed.
+
+        Args:
+            future (concurrent.futures.Future): The finished download.
+
+        Returns:
+            bool or None: True if the image was downloaded, False if the download
+            failed, None if the image already existed.
+        """
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Download failed: {e}")
+            result = False
+
+        with self.counts_lock:
+            if result:
+                self.counts["downloaded"] += 1
+            elif result is None:
+                self.counts["skipped"] += 1
+            else:
+                self.counts["failed"] += 1
+
+        return result
+
+    def count(self, name):
+        """
+        Add one to a counter in ``counts``.
+
+        Args:
+            name (str): The name of the counter.
+
+        Returns:
+            None
+        """
+        with self.counts_lock:
+            self.counts[name] += 1
+
+        return None
+
+    def process_images(self, path):
+        """
+        Stream the image listing for the query date, saving the metadata of each image
+        and queueing it for download as soon as its record is received.
+
+        Downloads start before the whole listing has arrived. At most twice
+        ``concurrency`` images wait for or are being downloaded at a time; the listing
+        is not read further until one of them finishes, so memory use does not grow
+        with the size of the listing.
+
+        Args:
+            path (str): The base path where files are saved.
+
+        Returns:
+            dict or None: The number of images listed, metadata files saved, images
+            downloaded, requests that timed out and requests that were hedged, and the
+            GAPE API result message if there was one, or None if the listing could not
+            be retrieved.
+        """
+        summary = {
+            "images": 0,
+            "metadata": 0,
+            "downloaded": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "result": None,
+        }
+        counts = self.counts.copy()
+        queued = threading.BoundedSemaphore(2 * self.concurrency)
+
+        def finished(future):
+            try:
+                self.count_download(future)
+            finally:
+                queued.release()
+
+        with self.hedging(), ThreadPoolExecutor(
+            max_workers=self.concurrency
+        ) as executor:
+            try:
+                with self.metrics.time(PHASE_LIST) as timing, self.session.get(
+                    self.api_url,
+                    params=self.list_params(),
+                    stream=True,
+                    timeout=self.timeout,
+                ) as response:
+                    if response.status_code != 200:
+                        timing.failed = True
+                        return None
+
+                    for image_data in iter_json_array(
+                        timing.count(response.iter_content(chunk_size=64 * 1024))
+                    ):
+                        if not isinstance(image_data, dict):
+                            continue
+                        if "images.filename" not in image_data:
+                            summary["result"] = image_data.get("result")
+                            continue
+
+                        summary["images"] += 1
+                        summary["metadata"] += self.save_metadata([image_data], path)
+                        queued.acquire()
+                        executor.submit(
+                            self.download_image, image_data, path
+                        ).add_done_callback(finished)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"Failed to read the image listing: {e}")
+                return None
+
+        summary["metadata"] += self.save_metadata_lines(path)
+        for name in ("downloaded", "timeouts", "hedges"):
+            summary[name] = self.counts[name] - counts[name]
+
+        return summary